@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""End-to-end I/O benchmark for the add-on's request path.
+
+Runs ``_run_monkey_banana`` and the batch worker path outside Blender (through
+the ``bpy`` shim in ``benchmarks/bpy_shim``) against ``mock_server.py`` and
+reports, per image size and scenario:
+
+* latency percentiles (p50/p90/p99) and throughput,
+* request/response body bytes on the wire, as counted by the mock server,
+* peak RSS of the process that ran the scenario,
+* worker-side decode time of the echoed result image (``decode ms``; ``-``
+  when the PNG format is left to Blender's loader),
+* for ``cancel``, how long an in-flight request takes to return after its
+  ``CancelToken`` is set (the latency columns then hold cancel latencies).
+
+Every scenario runs in its own subprocess, so peak RSS numbers are not
+polluted by earlier scenarios or by the mock server::
+
+    python benchmarks/bench_io.py --sizes 512,1024,2048 --requests 20 --concurrency 4
+    python benchmarks/bench_io.py --stream --latency 0.1 --json bench.json
+
+Scenarios:
+
+``single``       sequential calls returning the image bytes (tiled path)
+``single_file``  sequential calls decoding straight to a file (single run)
+``batch``        ``_run_worker`` jobs on a thread pool, as ``MB_OT_RunBatch`` does
+``cancel``       sequential calls cancelled ``--cancel-after`` seconds in; the mock
+                 server is slowed to at least ``CANCEL_LATENCY`` so the request is
+                 still waiting for its first byte when the token is set
+
+Every request uses a distinct prompt so that identical in-flight requests are
+not coalesced into one API call.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import queue
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SHIM_DIR = Path(__file__).resolve().parent / "bpy_shim"
+SCENARIOS = ("single", "single_file", "batch", "cancel")
+CANCEL_LATENCY = 2.0  # minimum mock server delay for the cancel scenario
+
+
+def _setup_path() -> None:
+    for path in (str(SHIM_DIR), str(ROOT), str(Path(__file__).resolve().parent)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss survives exec() and would report the parent's peak, so prefer VmHWM
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of ``values`` (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), round(pct / 100.0 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+
+PNG_FILTERS = {"none": 0, "sub": 1, "up": 2, "average": 3, "paeth": 4}
+
+
+def encode_filtered_png(pixels, filter_type: int, level: int = 1) -> bytes:
+    """Encode uint8 ``(h, w, 3)`` pixels with every row using ``filter_type``.
+
+    ``imaging.encode_png`` only writes filter 0; real encoders (including the
+    API's) mostly pick Paeth/Average, which cannot be undone a whole row at a time.
+    """
+    import struct
+    import zlib
+
+    import numpy as np
+    from monkey_banana import imaging
+
+    h, w, c = pixels.shape
+    x = pixels.reshape(h, w * c).astype(np.int16)
+    a = np.zeros_like(x)
+    a[:, c:] = x[:, :-c]
+    b = np.zeros_like(x)
+    b[1:] = x[:-1]
+    if filter_type == 0:
+        pred = 0
+    elif filter_type == 1:
+        pred = a
+    elif filter_type == 2:
+        pred = b
+    elif filter_type == 3:
+        pred = (a + b) // 2
+    else:
+        cc = np.zeros_like(x)
+        cc[1:, c:] = x[:-1, :-c]
+        pa, pb, pc = np.abs(b - cc), np.abs(a - cc), np.abs(a + b - 2 * cc)
+        pred = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, cc))
+    raw = np.empty((h, w * c + 1), dtype=np.uint8)
+    raw[:, 0] = filter_type
+    raw[:, 1:] = (x - pred) & 0xFF
+    return (
+        imaging._PNG_SIG
+        + imaging._png_chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))
+        + imaging._png_chunk(b"IDAT", zlib.compress(raw.tobytes(), level))
+        + imaging._png_chunk(b"IEND", b"")
+    )
+
+
+def make_image(path: Path, size: int, filter_type: int = 0) -> None:
+    """Write a ``size`` x ``size`` RGB noise PNG (worst case for compression)."""
+    import numpy as np
+
+    pixels = np.random.default_rng(size).integers(0, 256, (size, size, 3), dtype=np.uint8)
+    path.write_bytes(encode_filtered_png(pixels, filter_type))
+
+
+def time_decode(addon, path: str) -> float | None:
+    """Seconds ``_decode_result`` spends on ``path`` in a worker, or None if it defers to Blender."""
+    data = Path(path).read_bytes()
+    t0 = time.perf_counter()
+    pixels = addon._decode_result(data)
+    elapsed = time.perf_counter() - t0
+    return None if pixels is None else elapsed
+
+
+# =========================================================
+# Child: run one scenario and print its measurements as JSON
+# =========================================================
+def run_scenario(args: argparse.Namespace) -> dict:
+    from monkey_banana import api
+    from monkey_banana import monkey_banana_addon as addon
+    from monkey_banana.transport import POOL, SCHEDULER, Cancelled, CancelToken
+
+    api.set_endpoint(args.url)
+    POOL.max_size = max(args.concurrency, 1)
+    SCHEDULER.configure(rpm=0, max_inflight=max(args.concurrency, 1), max_retries=args.max_retries)
+    refs = (args.refs + ["", ""])[:2]
+    out_dir = Path(tempfile.mkdtemp(prefix="mb_bench_out_"))
+
+    def call(i: int, cancel=None) -> None:
+        # 同じ入力の同時リクエストは 1 回の API 呼び出しにまとめられるため、プロンプトを変える
+        prompt = f"benchmark {i}"
+        if args.scenario != "single":  # batch も単発実行と同じくファイルへ直接書き出す
+            api._run_monkey_banana("bench", prompt, refs[0], refs[1], args.image,
+                                   stream=args.stream, out_path=str(out_dir / f"out_{i}.png"), cancel=cancel)
+        else:
+            api._run_monkey_banana("bench", prompt, refs[0], refs[1], args.image, stream=args.stream)
+
+    def cancelled_call(i: int) -> float:
+        """Start call(i), cancel it after --cancel-after seconds and return the cancel-to-return time."""
+        cancel = CancelToken()
+        timer = threading.Timer(args.cancel_after, cancel.set)
+        timer.start()
+        try:
+            call(i, cancel)
+        except Cancelled:
+            return time.perf_counter() - cancel.cancelled_at
+        finally:
+            timer.cancel()
+        raise RuntimeError("request finished before it was cancelled")
+
+    rss_base = _peak_rss_mb()
+    call(-1)  # 接続確立と参照画像のエンコードを計測から外す
+    parts = urllib.parse.urlsplit(args.url)
+    urllib.request.urlopen(f"{parts.scheme}://{parts.netloc}/stats/reset", data=b"").close()
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+
+    if args.scenario == "batch":
+        q: queue.Queue = queue.Queue()
+        cancel = CancelToken()
+        out_base = str(out_dir / "mb_out.png")
+
+        def job(frame: int) -> float:
+            t0 = time.perf_counter()
+            addon._run_worker("bench", f"benchmark {frame}", refs[0], refs[1], args.image, q, cancel,
+                              {"frame": frame}, None, args.stream, addon._OutputTarget(out_base, frame))
+            return time.perf_counter() - t0
+
+        with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="mb_batch") as pool:
+            latencies = list(pool.map(job, range(1, args.requests + 1)))
+        while not q.empty():
+            errors += q.get().get("type") == "error"
+    elif args.scenario == "cancel":
+        for i in range(args.requests):
+            try:
+                latencies.append(cancelled_call(i))
+            except Exception:
+                errors += 1
+    else:
+        for i in range(args.requests):
+            t0 = time.perf_counter()
+            try:
+                call(i)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+
+    wall = time.perf_counter() - start
+    return {
+        "latencies": latencies,
+        "wall": wall,
+        "errors": errors,
+        "retries": SCHEDULER.retries,
+        "rss_base_mb": rss_base,
+        "decode_s": time_decode(addon, args.image),
+        "peak_rss_mb": _peak_rss_mb(),
+        "connections": POOL.created,
+    }
+
+
+# =========================================================
+# Parent: start the mock server and drive the scenarios
+# =========================================================
+def run_all(args: argparse.Namespace) -> list:
+    from mock_server import MockConfig, MockServer
+
+    config = MockConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        retry_after=0 if args.error_rate else None)
+    server = MockServer(config=config).start()
+    work = Path(tempfile.mkdtemp(prefix="mb_bench_"))
+    refs = []
+    for i in range(args.refs):
+        ref = work / f"ref_{i}.png"
+        make_image(ref, 512, PNG_FILTERS[args.png_filter])
+        refs.append(str(ref))
+
+    results = []
+    try:
+        for size in args.sizes:
+            image = work / f"render_{size}.png"
+            make_image(image, size, PNG_FILTERS[args.png_filter])
+            for scenario in args.scenarios:
+                cmd = [
+                    sys.executable, __file__, "--child", scenario, "--url", server.url, "--image", str(image),
+                    "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+                    "--max-retries", str(args.max_retries),
+                ] + (["--stream"] if args.stream else []) + [a for ref in refs for a in ("--ref", ref)]
+                if scenario == "cancel":
+                    cmd += ["--cancel-after", str(args.cancel_after)]
+                server.config.latency = max(args.latency, CANCEL_LATENCY) if scenario == "cancel" else args.latency
+                server.stats.reset()
+                out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+                child = json.loads(out.strip().splitlines()[-1])
+                stats = server.stats.snapshot()
+                lat = child["latencies"]
+                results.append({
+                    "size": size,
+                    "scenario": scenario,
+                    "image_bytes": image.stat().st_size,
+                    "requests": len(lat),
+                    "errors": child["errors"],
+                    "retries": child["retries"],
+                    "p50_ms": 1000 * percentile(lat, 50),
+                    "p90_ms": 1000 * percentile(lat, 90),
+                    "p99_ms": 1000 * percentile(lat, 99),
+                    "req_per_s": len(lat) / child["wall"] if child["wall"] else 0.0,
+                    "mb_per_s": (stats["bytes_in"] + stats["bytes_out"]) / (1024 * 1024) / child["wall"] if child["wall"] else 0.0,
+                    "bytes_up": stats["bytes_in"],
+                    "bytes_down": stats["bytes_out"],
+                    "server_requests": stats["requests"],
+                    "connections": child["connections"],
+                    "decode_ms": None if child["decode_s"] is None else 1000 * child["decode_s"],
+                    "peak_rss_mb": child["peak_rss_mb"],
+                    "rss_growth_mb": child["peak_rss_mb"] - child["rss_base_mb"],
+                })
+                print_row(results[-1])
+    finally:
+        server.stop()
+    return results
+
+
+# (結果のキー, 見出し, 書式)
+_COLUMNS = (
+    ("size", "size", "{:>5}"),
+    ("scenario", "scenario", "{:<11}"),
+    ("requests", "req", "{:>4}"),
+    ("errors", "err", "{:>3}"),
+    ("p50_ms", "p50 ms", "{:>8.1f}"),
+    ("p90_ms", "p90 ms", "{:>8.1f}"),
+    ("p99_ms", "p99 ms", "{:>8.1f}"),
+    ("req_per_s", "req/s", "{:>7.2f}"),
+    ("mb_per_s", "MB/s", "{:>7.1f}"),
+    ("bytes_up", "bytes up", "{:>12,}"),
+    ("bytes_down", "bytes down", "{:>12,}"),
+    ("decode_ms", "decode ms", "{:>9.1f}"),
+    ("peak_rss_mb", "peak MB", "{:>8.1f}"),
+    ("rss_growth_mb", "+RSS MB", "{:>8.1f}"),
+)
+
+
+def _width(fmt: str) -> int:
+    return int("".join(ch for ch in fmt.split(".")[0] if ch.isdigit()))
+
+
+def print_header() -> None:
+    cells = []
+    for _, title, fmt in _COLUMNS:
+        cells.append(title.ljust(_width(fmt)) if "<" in fmt else title.rjust(_width(fmt)))
+    print(" ".join(cells))
+
+
+def print_row(row: dict) -> None:
+    cells = ("-".rjust(_width(fmt)) if row[key] is None else fmt.format(row[key]) for key, _, fmt in _COLUMNS)
+    print(" ".join(cells), flush=True)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="512,1024,2048", help="comma-separated square image sizes in pixels")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=10, help="measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="worker threads for the batch scenario")
+    parser.add_argument("--refs", type=int, default=0, choices=(0, 1, 2), help="number of reference images to send")
+    parser.add_argument("--stream", action="store_true", help="use streamGenerateContent (SSE)")
+    parser.add_argument("--latency", type=float, default=0.0, help="mock server response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="mock server extra random delay in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of injected 503 responses")
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--png-filter", default="paeth", choices=tuple(PNG_FILTERS),
+                        help="PNG row filter for the generated images (real encoders mostly use paeth)")
+    parser.add_argument("--cancel-after", type=float, default=0.2, help="seconds before the cancel scenario cancels a request")
+    parser.add_argument("--json", type=Path, default=None, help="also write the results to this file")
+    # 子プロセス用（シナリオ 1 つを実行して JSON を出力）
+    parser.add_argument("--child", choices=SCENARIOS, dest="scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--image", help=argparse.SUPPRESS)
+    parser.add_argument("--ref", action="append", default=[], dest="ref_paths", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario: {scenario}")
+    return args
+
+
+def main(argv=None) -> None:
+    _setup_path()
+    args = parse_args(argv)
+    if args.scenario:
+        args.refs = args.ref_paths
+        print(json.dumps(run_scenario(args)))
+        return
+    print_header()
+    results = run_all(args)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
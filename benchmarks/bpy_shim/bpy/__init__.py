@@ -0,0 +1,30 @@
+"""Minimal stand-in for Blender's ``bpy`` used by the benchmarks.
+
+It only provides what the add-on touches at import time and on its
+worker/I-O paths, so ``monkey_banana`` can be imported in a plain Python
+interpreter. Nothing here renders or draws; operators and panels are inert.
+"""
+
+import os
+
+from . import app, props, types, utils
+
+
+class _Path:
+    @staticmethod
+    def abspath(path: str) -> str:
+        return os.path.abspath(path[2:]) if path.startswith("//") else path
+
+    @staticmethod
+    def relpath(path: str) -> str:
+        return path
+
+
+class _Data:
+    texts: dict = {}
+    images: dict = {}
+
+
+path = _Path()
+data = _Data()
+context = None
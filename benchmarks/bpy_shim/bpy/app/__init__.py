@@ -0,0 +1,19 @@
+from . import handlers, translations
+
+
+class timers:
+    @staticmethod
+    def register(*args, **kwargs) -> None:
+        pass
+
+    @staticmethod
+    def unregister(*args, **kwargs) -> None:
+        pass
+
+    @staticmethod
+    def is_registered(*args) -> bool:
+        return False
+
+
+background = True
+version = (4, 0, 0)
@@ -0,0 +1,7 @@
+render_complete: list = []
+render_cancel: list = []
+load_post: list = []
+
+
+def persistent(func):
+    return func
@@ -0,0 +1,10 @@
+def pgettext_iface(msg: str) -> str:
+    return msg
+
+
+def register(*args) -> None:
+    pass
+
+
+def unregister(*args) -> None:
+    pass
@@ -0,0 +1,9 @@
+"""Property factories; the shim never instantiates property groups."""
+
+
+def _prop(*args, **kwargs):
+    return None
+
+
+StringProperty = BoolProperty = EnumProperty = PointerProperty = _prop
+IntProperty = FloatProperty = CollectionProperty = _prop
@@ -0,0 +1,29 @@
+"""Base classes the add-on subclasses at import time."""
+
+
+class PropertyGroup:
+    pass
+
+
+class Operator:
+    pass
+
+
+class Panel:
+    pass
+
+
+class UIList:
+    pass
+
+
+class Text:
+    pass
+
+
+class Scene:
+    pass
+
+
+class Image:
+    pass
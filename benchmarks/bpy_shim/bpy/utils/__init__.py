@@ -0,0 +1,6 @@
+def register_class(cls) -> None:
+    pass
+
+
+def unregister_class(cls) -> None:
+    pass
@@ -0,0 +1,20 @@
+"""Preview collections; icons are never drawn, so ids are placeholders."""
+
+
+class _Preview:
+    def __init__(self, icon_id: int):
+        self.icon_id = icon_id
+
+
+class ImagePreviewCollection(dict):
+    def load(self, name: str, path: str, path_type: str) -> _Preview:
+        self[name] = _Preview(len(self) + 1)
+        return self[name]
+
+
+def new() -> ImagePreviewCollection:
+    return ImagePreviewCollection()
+
+
+def remove(collection: ImagePreviewCollection) -> None:
+    collection.clear()
@@ -0,0 +1 @@
+"""Minimal stand-in for ``bpy_extras`` (see ``bpy/__init__.py``)."""
@@ -0,0 +1,2 @@
+def world_to_camera_view(scene, obj, coord):
+    return coord
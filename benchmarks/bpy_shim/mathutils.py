@@ -0,0 +1,10 @@
+"""Minimal stand-in for Blender's ``mathutils``; only what the add-on imports."""
+
+
+class Vector(tuple):
+    def __new__(cls, values=(0.0, 0.0, 0.0)):
+        return super().__new__(cls, values)
+
+    x = property(lambda self: self[0])
+    y = property(lambda self: self[1])
+    z = property(lambda self: self[2])
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Gemini ``generateContent`` endpoint.
+
+Responds to ``POST .../<model>:generateContent`` and, when the path contains
+``:streamGenerateContent``, with server-sent events like ``alt=sse``.
+The response image is either the last ``inline_data`` of the request (echo,
+the default) or a fixed payload of ``--image-bytes`` random bytes.
+
+Latency, jitter and error injection are configurable so the add-on's retry,
+streaming and I/O paths can be exercised without network access::
+
+    python benchmarks/mock_server.py --port 8765 --latency 0.2 --error-rate 0.1
+    MB_API_URL=http://127.0.0.1:8765/v1beta/models/mock:generateContent blender ...
+
+``GET /stats`` returns request/byte counters as JSON; ``POST /stats/reset``
+clears them.
+
+``--tls`` serves HTTPS with a throwaway self-signed certificate for
+127.0.0.1 (generated with the ``openssl`` command); clients trust it through
+``MockServer.client_context()``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_INLINE_DATA = re.compile(rb'"(?:inline_data|inlineData)"\s*:\s*\{[^{}]*?"data"\s*:\s*"([^"]*)"')
+
+
+@dataclass
+class MockConfig:
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+    retry_after: float | None = None
+    fail_first: int = 0  # answer the first N requests with error_status (deterministic injection)
+    close_after_response: bool = False  # drop keep-alive connections silently, like a server idle timeout
+    image_bytes: int = 0
+    sse_chunk: int = 64 * 1024
+
+
+@dataclass
+class MockStats:
+    requests: int = 0
+    errors: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, bytes_in: int, bytes_out: int, error: bool) -> None:
+        with self.lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "errors": self.errors, "bytes_in": self.bytes_in, "bytes_out": self.bytes_out}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.requests = self.errors = self.bytes_in = self.bytes_out = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "MockServer"
+
+    def log_message(self, format, *args):  # noqa: A002 - signature from BaseHTTPRequestHandler
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json", headers: dict | None = None) -> int:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def do_GET(self):
+        if self.path.startswith("/stats"):
+            self._send(200, json.dumps(self.server.stats.snapshot()).encode())
+        else:
+            self._send(404, b"{}")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if self.path.startswith("/stats/reset"):
+            self.server.stats.reset()
+            self._send(200, b"{}")
+            return
+
+        cfg = self.server.config
+        delay = cfg.latency + random.uniform(0.0, cfg.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.server.take_failure() or random.random() < cfg.error_rate:
+            headers = {}
+            if cfg.retry_after is not None:
+                headers["Retry-After"] = f"{cfg.retry_after:g}"
+            error = {"error": {"code": cfg.error_status, "status": "UNAVAILABLE", "message": "injected error"}}
+            sent = self._send(cfg.error_status, json.dumps(error).encode(), headers=headers)
+            self.server.stats.add(length, sent, error=True)
+            return
+
+        image_b64 = self.server.image_b64
+        if image_b64 is None:
+            matches = _INLINE_DATA.findall(body)
+            image_b64 = matches[-1] if matches else b""
+        part = b'{"inlineData": {"mimeType": "image/png", "data": "' + image_b64 + b'"}}'
+
+        if ":streamGenerateContent" in self.path:
+            sent = self._send_sse(part, cfg.sse_chunk)
+        else:
+            payload = b'{"candidates": [{"content": {"parts": [{"text": "mock"}, ' + part + b"]}}]}"
+            sent = self._send(200, payload)
+        self.server.stats.add(length, sent, error=False)
+        if cfg.close_after_response:
+            self.close_connection = True
+
+    def _send_sse(self, part: bytes, chunk_size: int) -> int:
+        events = [
+            b'data: {"candidates": [{"content": {"parts": [{"text": "mock"}]}}]}\r\n\r\n',
+            b'data: {"candidates": [{"content": {"parts": [' + part + b"]}}]}\r\n\r\n",
+        ]
+        payload = b"".join(events)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(0, len(payload), chunk_size):
+            chunk = payload[i:i + chunk_size]
+            self.wfile.write(b"%x\r\n" % len(chunk) + chunk + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+        return len(payload)
+
+
+def make_self_signed(directory: str, host: str = "127.0.0.1") -> tuple[str, str]:
+    """Write a one-day self-signed certificate for ``host`` and return ``(cert, key)`` paths."""
+    if shutil.which("openssl") is None:
+        raise RuntimeError("--tls needs the openssl command")
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-keyout", key, "-out", cert, "-subj", f"/CN={host}",
+         "-addext", f"subjectAltName=IP:{host},DNS:localhost"],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+class MockServer(ThreadingHTTPServer):
+    """Threaded mock server; ``start()`` serves from a daemon thread."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, config: MockConfig | None = None, tls: bool = False):
+        super().__init__((host, port), _Handler)
+        self.config = config or MockConfig()
+        self.cert_path = None
+        self.ssl_context = None
+        if tls:
+            self._cert_dir = tempfile.mkdtemp(prefix="mock_gemini_tls_")
+            self.cert_path, key = make_self_signed(self._cert_dir, host)
+            self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.ssl_context.load_cert_chain(self.cert_path, key)
+        self.stats = MockStats()
+        self.image_b64 = None
+        self._failures_left = self.config.fail_first
+        self._failures_lock = threading.Lock()
+        if self.config.image_bytes:
+            self.image_b64 = base64.b64encode(os.urandom(self.config.image_bytes))
+        self._thread: threading.Thread | None = None
+
+    def take_failure(self) -> bool:
+        """Consume one of the ``fail_first`` injected errors, if any are left."""
+        with self._failures_lock:
+            if self._failures_left <= 0:
+                return False
+            self._failures_left -= 1
+            return True
+
+    def get_request(self):
+        sock, addr = super().get_request()
+        if self.ssl_context is not None:
+            # handshake on first read, in the handler thread rather than the accept loop
+            sock = self.ssl_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+        return sock, addr
+
+    def client_context(self) -> ssl.SSLContext:
+        """Client-side context that trusts this server's certificate."""
+        return ssl.create_default_context(cafile=self.cert_path)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        scheme = "https" if self.ssl_context is not None else "http"
+        return f"{scheme}://{host}:{port}/v1beta/models/mock:generateContent"
+
+    def handle_error(self, request, client_address) -> None:
+        # clients that cancel mid-request drop the connection, and clients that reject the
+        # self-signed certificate abort the handshake; both are expected, not server errors
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError, ssl.SSLError)):
+            return
+        super().handle_error(request, client_address)
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="mock_gemini", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self.cert_path:
+            shutil.rmtree(self._cert_dir, ignore_errors=True)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="base response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra uniform random delay in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds sent with injected errors")
+    parser.add_argument("--fail-first", type=int, default=0, help="answer the first N requests with --error-status")
+    parser.add_argument("--tls", action="store_true", help="serve HTTPS with a self-signed certificate")
+    parser.add_argument("--image-bytes", type=int, default=0, help="return this many random bytes instead of echoing")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    config = MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        fail_first=args.fail_first,
+        image_bytes=args.image_bytes,
+    )
+    server = MockServer(args.host, args.port, config, tls=args.tls)
+    print(f"Serving {server.url}" + (f" (certificate: {server.cert_path})" if server.cert_path else ""))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,15 +8,18 @@ bl_info = {
     "category": "Image",
 }
 
-from .monkey_banana_addon import register as _r, unregister as _u
-from . import i18n
+# bpy に依存するモジュールは登録時に読み込む（cli / api 等は Blender なしでも import できる）
 
 
 def register():
+    from . import i18n
+    from .monkey_banana_addon import register as _r
     i18n.register()
     _r()
 
 
 def unregister():
+    from . import i18n
+    from .monkey_banana_addon import unregister as _u
     _u()
     i18n.unregister()
@@ -0,0 +1,459 @@
+import os, re, json, base64, hashlib, time
+from .transport import KEYS, POOL, SCHEDULER, Cancelled, CancelToken
+from .cache import ResultCache, EncodedImage, EncodedImageCache, InflightRegistry, make_key
+
+DEFAULT_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-image-preview:generateContent"
+
+# 送信先（パネルの API URL → 環境変数 MB_API_URL → 既定の順。ローカルのモックサーバ等に向けられる）
+API_URL = os.environ.get("MB_API_URL") or DEFAULT_API_URL
+
+# base64 は 3 バイト単位で符号化されるため、3 の倍数で読めば途中にパディングが入らない
+_B64_CHUNK = 3 * 64 * 1024
+
+# レスポンスの読み込み単位（ダウンロード進捗の報告間隔）
+_READ_CHUNK = 64 * 1024
+
+# 参照画像（セッション中ほぼ固定）のエンコード結果を使い回すキャッシュ
+REF_CACHE = EncodedImageCache(max_bytes=256 * 1024 * 1024)
+# 同じ入力（プロンプト・画像・seed・送信先）のリクエストを同時に 2 回送らない
+INFLIGHT = InflightRegistry()
+
+
+# =========================================================
+# Request Body（ストリーミング）
+# =========================================================
+class InlineImage:
+    """リクエストに埋め込む画像 1 枚。
+
+    encoded（事前エンコード済み）があればそれを送り、data（メモリ上の画像）があればそれを、
+    どちらもなければ送信時にファイルを読みながら base64 化する。
+    """
+
+    def __init__(self, mime: str, path: str = "", encoded=None, data: bytes = None):
+        self.mime = mime
+        self.path = path
+        self.encoded = encoded
+        self.data = data
+        self.size = len(data) if data is not None else os.path.getsize(path)
+
+    def b64_len(self) -> int:
+        if self.encoded is not None:
+            return len(self.encoded.b64)
+        return 4 * ((self.size + 2) // 3)
+
+    def digest(self) -> str:
+        if self.encoded is not None:
+            return self.encoded.digest
+        h = hashlib.sha256()
+        for chunk in self.iter_raw():
+            h.update(chunk)
+        return h.hexdigest()
+
+    def iter_raw(self):
+        if self.data is not None:
+            view = memoryview(self.data)
+            for i in range(0, self.size, _B64_CHUNK):
+                yield view[i:i + _B64_CHUNK]
+            return
+        with open(self.path, "rb") as f:
+            remaining = self.size
+            while remaining > 0:
+                chunk = f.read(min(_B64_CHUNK, remaining))
+                if not chunk:
+                    raise OSError(f"読み込み中にファイルが縮みました: {self.path}")
+                remaining -= len(chunk)
+                yield chunk
+
+    def shared(self) -> "InlineImage":
+        """base64 と sha256 を一度だけ計算した InlineImage を返す（同じ画像を複数のリクエストで送る場合）"""
+        if self.encoded is not None:
+            return self
+        raw = b"".join(self.iter_raw())
+        encoded = EncodedImage(base64.b64encode(raw), hashlib.sha256(raw).hexdigest(), None)
+        return InlineImage(self.mime, self.path, encoded, self.data)
+
+    def iter_b64(self):
+        if self.encoded is not None:
+            yield self.encoded.b64
+            return
+        for chunk in self.iter_raw():
+            yield base64.b64encode(chunk)
+
+
+class RequestBody:
+    """generateContent の JSON ボディを断片ごとに生成する（全体をメモリに載せない）
+
+    長さは事前に計算できるので Content-Length を付けて送る。
+    __iter__ は毎回先頭から生成し直すため、再送にもそのまま使える。
+    seed を指定すると generationConfig.seed を付ける（同じ入力から別の候補を得る）。
+    """
+
+    def __init__(self, text: str, images, seed: int = None):
+        self.text = text
+        self.images = list(images)
+        self._head = b'{"contents": [{"parts": [' + json.dumps({"text": text}).encode("utf-8")
+        self._image_heads = [
+            b', {"inline_data": {"mime_type": ' + json.dumps(im.mime).encode("ascii") + b', "data": "'
+            for im in self.images
+        ]
+        self._image_tail = b'"}}'
+        self._tail = b']}]' + (b'' if seed is None else b', "generationConfig": {"seed": %d}' % seed) + b'}'
+        self.length = (
+            len(self._head) + len(self._tail)
+            + sum(len(h) + len(self._image_tail) for h in self._image_heads)
+            + sum(im.b64_len() for im in self.images)
+        )
+
+    def __iter__(self):
+        yield self._head
+        for head, im in zip(self._image_heads, self.images):
+            yield head
+            yield from im.iter_b64()
+            yield self._image_tail
+        yield self._tail
+
+
+class _ProgressBody:
+    """送信済みバイト数を報告しながら body を流す（再送時は先頭からやり直す）"""
+
+    def __init__(self, body: RequestBody, report):
+        self.body = body
+        self.report = report
+        self.sent = 0
+        self.done_at = None
+
+    def __iter__(self):
+        self.sent = 0
+        for chunk in self.body:
+            yield chunk
+            self.sent += len(chunk)
+            self.report({"stage": "upload", "sent": self.sent, "total": self.body.length})
+        self.done_at = time.perf_counter()
+
+
+# =========================================================
+# Response（JSON / SSE）
+# =========================================================
+def _iter_response(r, report):
+    """レスポンス本文をチャンクで読み、受信バイト数を報告する"""
+    total = r.length
+    received = 0
+    while True:
+        chunk = r.read1(_READ_CHUNK)
+        if not chunk:
+            return
+        received += len(chunk)
+        report({"stage": "download", "received": received, "total": total})
+        yield chunk
+
+def _find_event_end(buf, start: int):
+    """空行（\n\n または \n\r\n）の位置と長さを返す。なければ (-1, 0)"""
+    a = buf.find(b"\n\n", start)
+    b = buf.find(b"\n\r\n", start)
+    if b >= 0 and (a < 0 or b < a):
+        return b, 3
+    return a, (2 if a >= 0 else 0)
+
+def _iter_sse_data(chunks):
+    """SSE のバイト列から各イベントの data フィールドを取り出す"""
+    buf = bytearray()
+    start = 0
+    for chunk in chunks:
+        buf += chunk
+        while True:
+            end, sep = _find_event_end(buf, start)
+            if end < 0:
+                start = max(0, len(buf) - 2)  # 既に調べた範囲は再走査しない
+                break
+            event = bytes(buf[:end])
+            del buf[:end + sep]
+            start = 0
+            data = _sse_event_data(event)
+            if data:
+                yield data
+    data = _sse_event_data(bytes(buf))
+    if data:
+        yield data
+
+def _sse_event_data(event: bytes) -> bytes:
+    lines = (line.rstrip(b"\r") for line in event.split(b"\n"))
+    return b"\n".join(line[5:].lstrip(b" ") for line in lines if line.startswith(b"data:"))
+
+def _parse_sse(chunks) -> dict:
+    """streamGenerateContent（alt=sse）の応答を 1 つの generateContent 応答にまとめる"""
+    parts = []
+    for data in _iter_sse_data(chunks):
+        res = json.loads(data)
+        if isinstance(res, dict) and "error" in res:
+            return res
+        try:
+            parts.extend(res["candidates"][0]["content"]["parts"])
+        except (KeyError, IndexError, TypeError):
+            continue
+    return {"candidates": [{"content": {"parts": parts}}]}
+
+def _parse_json(chunks) -> dict:
+    return json.loads(b"".join(chunks).decode("utf-8"))
+
+
+class InlineDataDecoder:
+    """応答を流し込むと、最初の inline_data / inlineData の data を逐次 base64 デコードして path に書く
+
+    data 以外の部分（data は空文字に置き換え）は text に残るので、JSON/SSE として通常どおり解析できる。
+    巨大な base64 文字列・デコード後の画像のどちらも全体をメモリに載せない。
+    """
+
+    _FIELD = re.compile(rb'"(?:inline_data|inlineData)"\s*:\s*\{[^{}]*?"data"\s*:\s*"')
+    _LOOKBACK = 512  # チャンク境界をまたぐフィールド名を見落とさないための再走査幅
+
+    def __init__(self, path: str):
+        self.path = path
+        self.reset()
+
+    def reset(self):
+        """再送に備えて状態を初期化（書きかけのファイルは切り詰める）"""
+        self.text = bytearray()
+        self.size = 0
+        self.found = False
+        self._file = None
+        self._carry = b""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def feed(self, chunk: bytes):
+        while chunk:
+            if self._file is not None:
+                end = chunk.find(b'"')
+                self._write_b64(chunk if end < 0 else chunk[:end])
+                if end < 0:
+                    return
+                self._close_file()
+                chunk = chunk[end:]  # 閉じ引用符以降は通常のテキストに戻す
+                continue
+            if self.found:
+                self.text += chunk
+                return
+            scan_from = max(0, len(self.text) - self._LOOKBACK)
+            self.text += chunk
+            m = self._FIELD.search(self.text, scan_from)
+            if m is None:
+                return
+            chunk = bytes(self.text[m.end():])
+            del self.text[m.end():]
+            self.found = True
+            self._file = open(self.path, "wb")
+
+    def close(self):
+        if self._file is not None:
+            self._close_file()
+
+    def _write_b64(self, part: bytes):
+        # JSON で "\/" とエスケープされた "/" を戻す（base64 に \ は現れない）
+        buf = self._carry + part.replace(b"\\", b"")
+        n = len(buf) - len(buf) % 4
+        self._carry = buf[n:]
+        if n:
+            raw = base64.b64decode(buf[:n])
+            self._file.write(raw)
+            self.size += len(raw)
+
+    def _close_file(self):
+        try:
+            if self._carry:
+                raw = base64.b64decode(self._carry + b"=" * (-len(self._carry) % 4))
+                self._file.write(raw)
+                self.size += len(raw)
+                self._carry = b""
+        finally:
+            self._file.close()
+            self._file = None
+
+
+# =========================================================
+# Helpers（API/入出力）
+# =========================================================
+def set_endpoint(url: str = ""):
+    """送信先の generateContent URL を設定（空なら環境変数 MB_API_URL か既定値）"""
+    global API_URL
+    API_URL = (url or "").strip() or os.environ.get("MB_API_URL") or DEFAULT_API_URL
+
+def _guess_mime(path):
+    p = path.lower()
+    if p.endswith(".png"):  return "image/png"
+    if p.endswith(".jpg") or p.endswith(".jpeg"): return "image/jpeg"
+    if p.endswith(".webp"): return "image/webp"
+    return "image/png"
+
+def _stream_url(url: str) -> str:
+    """generateContent の URL を SSE 版の streamGenerateContent に変換"""
+    base, _, query = url.partition("?")
+    base = base.replace(":generateContent", ":streamGenerateContent")
+    return base + "?" + "&".join(q for q in (query, "alt=sse") if q)
+
+def _api_call(api_key: str, body: RequestBody, stream: bool = False, on_progress=None,
+              decoder: InlineDataDecoder = None, cancel: CancelToken = None) -> dict:
+    """API を呼び出す。on_progress には送信/初回応答/受信/受信完了の進捗 dict が渡される
+
+    decoder を渡すと画像は受信しながらファイルへ書き出され、戻り値の data は空文字になる。
+    キープール（KEYS）が設定されていれば、送信（再試行を含む）ごとに最も空いているキーを使う。
+    cancel が set() されると送受信中でも接続を閉じて Cancelled を送出する。
+    """
+    report = on_progress or (lambda _ev: None)
+
+    def send():
+        lease = KEYS.acquire(cancel)
+        target = (lease.url if lease is not None and lease.url else API_URL)
+        url = _stream_url(target) if stream else target
+        headers = {
+            "Content-Type": "application/json",
+            "Content-Length": str(body.length),
+            "x-goog-api-key": lease.key if lease is not None else api_key.strip(),
+        }
+        counted = _ProgressBody(body, report)
+        t0 = time.perf_counter()
+        received = [0]
+
+        def track(ev):
+            received[0] = ev["received"]
+            report(ev)
+
+        error = None
+        try:
+            with POOL.open("POST", url, body=counted, headers=headers, cancel=cancel) as r:
+                now = time.perf_counter()
+                done_at = counted.done_at or now
+                report({"stage": "first_byte", "sent": counted.sent, "upload_s": done_at - t0, "ttfb": now - done_at})
+                chunks = _iter_response(r, track)
+                if decoder is not None:
+                    decoder.reset()
+                    try:
+                        for chunk in chunks:
+                            decoder.feed(chunk)
+                    finally:
+                        decoder.close()
+                    chunks = [bytes(decoder.text)]
+                res = _parse_sse(chunks) if stream else _parse_json(chunks)
+                if cancel is not None:
+                    cancel.check()  # 閉じた接続から途中までしか読めていない
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if lease is not None:
+                KEYS.release(lease, error)
+        report({"stage": "response", "received": received[0], "download_s": time.perf_counter() - now})
+        return res
+
+    return SCHEDULER.call(send, cancel)
+
+def _extract_image_b64(res: dict) -> str:
+    try:
+        parts = res["candidates"][0]["content"]["parts"]
+    except Exception:
+        return None
+    for part in parts:
+        if "inline_data" in part and "data" in part["inline_data"]:
+            return part["inline_data"]["data"]
+        if "inlineData" in part and "data" in part["inlineData"]:
+            return part["inlineData"]["data"]
+    return None
+
+def _augment_prompt(user_text: str) -> str:
+    guard = (
+        "ゼロからの新規生成は禁止。最後の画像（レンダ）を加工対象とし、"
+        "構図・カメラ・照明・解像度・アスペクト比・被写体の形状を保持。"
+        "参照画像は色味/質感/雰囲気の手掛かりのみとして用いる。"
+    )
+    base = (user_text or "").strip()
+    return (base + ("\n" if base else "") + guard)
+
+def _run_monkey_banana(api_key: str, prompt: str, ref1: str, ref2: str, render_img, cache: ResultCache = None,
+                       stream: bool = False, on_progress=None, out_path: str = None, seed: int = None,
+                       cancel: CancelToken = None):
+    """render_img はファイルパス、またはメモリ上でエンコード済みの InlineImage
+
+    結果画像の bytes を返す。out_path を渡すと画像は受信しながら out_path に書き出し、out_path を返す。
+    on_progress には通信の進捗に加えて prepare / cache / decode 段階の所要時間も渡される。
+    seed は候補ごとに変えて送る値（キャッシュのキーにも含める）。
+    同じ入力のリクエストが既に送信中なら API は呼ばず、その結果を受け取る（INFLIGHT）。
+    cancel（CancelToken）が set() されると通信や待機を打ち切って Cancelled を送出する。
+    """
+    report = on_progress or (lambda _ev: None)
+    t0 = time.perf_counter()
+    if isinstance(render_img, InlineImage):
+        render = render_img
+    elif not render_img or not os.path.isfile(render_img):
+        raise FileNotFoundError("Render (Base) Image が見つかりません")
+    else:
+        render = InlineImage(_guess_mime(render_img), render_img)
+    images = [InlineImage(_guess_mime(p), p, REF_CACHE.encode(p)) for p in (ref1, ref2) if p and os.path.isfile(p)]
+    images.append(render)
+    text = _augment_prompt(prompt)
+
+    report({"stage": "prepare", "seconds": time.perf_counter() - t0})
+
+    t0 = time.perf_counter()
+    key_text = text if seed is None else f"{text}\0seed={seed}"
+    key = make_key(key_text, [(im.mime, im.digest()) for im in images], API_URL)
+    if cache is not None:
+        if out_path is not None:
+            hit = cache.get_file(key, out_path)
+            data = out_path if hit else None
+        else:
+            data = cache.get(key)
+            hit = data is not None
+        report({"stage": "cache", "hit": hit, "seconds": time.perf_counter() - t0})
+        if hit:
+            return data
+
+    while True:
+        waiting = INFLIGHT.join(key, out_path)
+        if waiting is None:
+            break
+        t0 = time.perf_counter()
+        try:
+            data = INFLIGHT.wait(key, waiting, cancel)
+        except Cancelled:
+            if cancel is not None and cancel.is_set():
+                raise
+            continue  # 先行リクエストだけがキャンセルされたので、自分で送り直す
+        report({"stage": "coalesce", "seconds": time.perf_counter() - t0})
+        return data
+    try:
+        data = _fetch_result(api_key, text, images, seed, key, cache, stream, on_progress, out_path, cancel)
+    except BaseException as e:
+        INFLIGHT.reject(key, e)
+        raise
+    INFLIGHT.resolve(key, data)
+    return data
+
+def _fetch_result(api_key: str, text: str, images, seed, key: str, cache: ResultCache, stream: bool,
+                  on_progress, out_path: str, cancel: CancelToken = None):
+    """API を呼んで結果画像（bytes か out_path）を返し、キャッシュに保存する"""
+    report = on_progress or (lambda _ev: None)
+    decoder = InlineDataDecoder(out_path) if out_path is not None else None
+    res = _api_call(api_key, RequestBody(text, images, seed), stream, on_progress, decoder, cancel)
+
+    if isinstance(res, dict) and "error" in res:
+        code = res["error"].get("code")
+        status = res["error"].get("status")
+        msg = res["error"].get("message", "Unknown error")
+        raise RuntimeError(f"APIエラー: {code}/{status} {msg}")
+
+    if decoder is not None and decoder.size:
+        if cache is not None:
+            cache.put_file(key, out_path)
+        return out_path
+
+    img_b64 = _extract_image_b64(res)
+    if not img_b64:
+        raise RuntimeError("画像が返りませんでした（プロンプトを簡潔化/保持要素を明記）")
+    t0 = time.perf_counter()
+    data = base64.b64decode(img_b64)
+    if out_path is not None:
+        with open(out_path, "wb") as f:
+            f.write(data)
+    report({"stage": "decode", "seconds": time.perf_counter() - t0})
+    if cache is not None:
+        cache.put(key, data)
+    return out_path if out_path is not None else data
@@ -0,0 +1,292 @@
+import base64, hashlib, os, shutil, threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from .transport import Cancelled, CancelToken
+
+
+def make_key(prompt: str, images, endpoint: str = "") -> str:
+    """送信先 + 拡張後プロンプト + (MIME, 画像 sha256) 列からキャッシュキー（sha256）を生成"""
+    h = hashlib.sha256()
+    h.update(b"endpoint\0")
+    h.update(endpoint.encode("utf-8"))
+    h.update(b"\0prompt\0")
+    h.update(prompt.encode("utf-8"))
+    for mime, digest in images:
+        h.update(b"\0image\0")
+        h.update(mime.encode("ascii"))
+        h.update(b"\0")
+        h.update(digest.encode("ascii"))
+    return h.hexdigest()
+
+
+EncodedImage = namedtuple("EncodedImage", "b64 digest stamp")
+
+
+def _file_stamp(path: str):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+class EncodedImageCache:
+    """参照画像の base64 と sha256 を (パス, mtime, サイズ) 単位で保持するメモリキャッシュ"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # path -> EncodedImage（古い順）
+        self._warming = set()
+        self._pool = None
+
+    def get(self, path: str):
+        """最新の内容に一致するエンコード結果があれば返す"""
+        try:
+            stamp = _file_stamp(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry.stamp != stamp:
+                return None
+            self._entries.move_to_end(path)
+            return entry
+
+    def encode(self, path: str) -> EncodedImage:
+        """キャッシュを使って path をエンコード（ファイルが変わっていれば作り直す）"""
+        entry = self.get(path)
+        if entry is not None:
+            return entry
+        stamp = _file_stamp(path)
+        with open(path, "rb") as f:
+            raw = f.read()
+        entry = EncodedImage(base64.b64encode(raw), hashlib.sha256(raw).hexdigest(), stamp)
+        del raw
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            total = sum(len(e.b64) for e in self._entries.values())
+            while total > self.max_bytes and len(self._entries) > 1:
+                _, old = self._entries.popitem(last=False)
+                total -= len(old.b64)
+        return entry
+
+    def warm(self, path: str):
+        """バックグラウンドで path を事前エンコード"""
+        if not path or not os.path.isfile(path) or self.get(path) is not None:
+            return
+        with self._lock:
+            if path in self._warming:
+                return
+            self._warming.add(path)
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mb_warm")
+        self._pool.submit(self._warm_job, path)
+
+    def _warm_job(self, path: str):
+        try:
+            self.encode(path)
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._warming.discard(path)
+
+
+class ResultCache:
+    """API 結果画像をキーで保存するディスクキャッシュ（容量上限・LRU 破棄）"""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = None  # OrderedDict[key, size]（古い順）
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key + ".img")
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        entries = []
+        if os.path.isdir(self.root):
+            for e in os.scandir(self.root):
+                if e.is_file() and e.name.endswith(".img"):
+                    st = e.stat()
+                    entries.append((st.st_mtime, e.name[:-4], st.st_size))
+        entries.sort()
+        self._index = OrderedDict((k, size) for _, k, size in entries)
+
+    def _tmp_path(self, path: str) -> str:
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _lookup(self, key: str, read):
+        """ヒットしたエントリのパスに read(path) を適用して返す。なければ None
+
+        ロックは索引の参照・更新だけに使い、ファイルの読み込み・コピーはロックの外で行う
+        （置き換えは os.replace なので、読み込み中に同じキーが書き込まれても壊れたファイルは見えない）。
+        """
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                self.misses += 1
+                return None
+            # 読み込み中に追い出されにくいよう、先に最近使ったものにする
+            self._index.move_to_end(key)
+        path = self._path(key)
+        try:
+            result = read(path)
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                if not os.path.isfile(path):
+                    self._index.pop(key, None)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def get(self, key: str):
+        """ヒットすれば画像 bytes、なければ None"""
+        def read(path):
+            with open(path, "rb") as f:
+                return f.read()
+        return self._lookup(key, read)
+
+    def get_file(self, key: str, dest: str) -> bool:
+        """ヒットすれば dest にコピーして True（画像をメモリに載せない。コピー途中の dest は見せない）"""
+        def copy(path):
+            tmp = self._tmp_path(dest)
+            try:
+                shutil.copyfile(path, tmp)
+                os.replace(tmp, dest)
+            except OSError:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+            return dest
+        return self._lookup(key, copy) is not None
+
+    def _store(self, key: str, write, size: int):
+        """一時ファイルへの書き込みはロックの外で行い、置き換えと索引の更新だけをロック内で行う"""
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(key)
+        tmp = self._tmp_path(path)
+        try:
+            write(tmp)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._load_index()
+            os.replace(tmp, path)
+            self._index[key] = size
+            self._index.move_to_end(key)
+            self._evict()
+
+    def put(self, key: str, data: bytes):
+        def write(tmp):
+            with open(tmp, "wb") as f:
+                f.write(data)
+        self._store(key, write, len(data))
+
+    def put_file(self, key: str, src: str):
+        """src のファイルをコピーして保存"""
+        self._store(key, lambda tmp: shutil.copyfile(src, tmp), os.path.getsize(src))
+
+    def _evict(self):
+        total = sum(self._index.values())
+        while total > self.max_bytes and len(self._index) > 1:
+            key, size = self._index.popitem(last=False)
+            total -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            self._load_index()
+            return sum(self._index.values())
+
+
+class InflightRegistry:
+    """送信中のリクエストをキーで登録し、同じキーの重複送信を先行リクエストの結果に相乗りさせる
+
+    最初の 1 件（leader）だけが API を呼び、後続は join() が返す Future で結果を待つ。
+    結果は bytes か出力ファイルのパス。leader の出力ファイルは返却後に移動・削除されるため、
+    後続が out_path を指定していれば resolve() の中で leader がそこへコピーしてから渡す。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = {}  # key -> [(out_path, Future)]（leader が実行中のキーのみ）
+        self.coalesced = 0
+
+    def join(self, key: str, out_path: str = None):
+        """leader なら None、同じキーが実行中なら結果を待つ Future を返す"""
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if waiters is None:
+                self._waiters[key] = []
+                return None
+            fut = Future()
+            waiters.append((out_path, fut))
+            self.coalesced += 1
+            return fut
+
+    def wait(self, key: str, fut: Future, cancel: CancelToken = None):
+        """join() で得た Future の結果を待つ。自分がキャンセルされたら待機をやめて登録も外す"""
+        if cancel is None:
+            return fut.result()
+        while True:
+            try:
+                return fut.result(timeout=0.1)
+            except FutureTimeout:
+                if cancel.is_set():
+                    with self._lock:
+                        waiters = self._waiters.get(key, [])
+                        waiters[:] = [w for w in waiters if w[1] is not fut]
+                    raise Cancelled()
+
+    def resolve(self, key: str, result):
+        """leader の結果を待っている重複リクエストに配る"""
+        with self._lock:
+            waiters = self._waiters.pop(key, [])
+        for out_path, fut in waiters:
+            try:
+                if out_path is None:
+                    if isinstance(result, str):
+                        with open(result, "rb") as f:
+                            value = f.read()
+                    else:
+                        value = result
+                else:
+                    if isinstance(result, str):
+                        shutil.copyfile(result, out_path)
+                    else:
+                        with open(out_path, "wb") as f:
+                            f.write(result)
+                    value = out_path
+            except OSError as e:
+                fut.set_exception(e)
+                continue
+            fut.set_result(value)
+
+    def reject(self, key: str, error: BaseException):
+        """leader が失敗したら、待っている重複リクエストにも同じ例外を渡す"""
+        with self._lock:
+            waiters = self._waiters.pop(key, [])
+        for _, fut in waiters:
+            fut.set_exception(error)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._waiters)
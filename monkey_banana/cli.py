@@ -0,0 +1,283 @@
+"""GUI なしで編集ステージを実行するバッチランナー
+
+レンダ済み画像のフォルダ、またはジョブ一覧（JSON / JSONL）を受け取り、
+スレッドまたはプロセスのプールで _run_monkey_banana を並列に実行して
+出力画像とサマリーレポート（JSON）を書き出す。
+
+    python -m monkey_banana.cli --dir renders/ --prompt-file prompt.txt --out edited/ --workers 4
+    python -m monkey_banana.cli --dir renders/ --prompt "..."   # 出力は renders/mb_out/
+    python -m monkey_banana.cli --manifest jobs.jsonl --processes 4 --report report.json
+    blender -b scene.blend --python-expr "import monkey_banana.cli as c; c.main()" -- --dir renders/ --out edited/
+
+ジョブ一覧の各要素は {"render": パス, "refs": [パス, ...], "prompt": 文字列, "output": 出力パス}
+（render 以外は省略可）。相対パスはジョブ一覧のあるフォルダからの相対。
+Blender 内で実行した場合、プロンプト・参照画像・API キーの既定値はシーンのパネル設定から取る。
+"""
+import argparse, json, os, sys, threading, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from . import api
+from .cache import ResultCache
+from .telemetry import JobTrace
+from .transport import KEYS, POOL, SCHEDULER
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp")
+OUT_SUFFIX = "_mb.png"   # 出力ファイル名の末尾（入力フォルダの走査ではこれを除く）
+DEFAULT_OUT = "mb_out"   # --out 省略時の出力先（入力フォルダ内）
+
+
+# =========================================================
+# Jobs
+# =========================================================
+def _out_path(out_dir: str, render: str) -> str:
+    return os.path.join(out_dir, os.path.splitext(os.path.basename(render))[0] + OUT_SUFFIX)
+
+def jobs_from_dir(path_dir: str, out_dir: str, prompt: str, refs) -> list:
+    """フォルダ内の画像 1 枚を 1 ジョブとする（名前順）
+
+    以前の実行の出力（*_mb.png）は入力にしない（同じフォルダに出力しても 2 回目に x_mb_mb.png を作らない）。
+    """
+    names = sorted(n for n in os.listdir(path_dir)
+                   if n.lower().endswith(IMAGE_EXTS) and not n.lower().endswith(OUT_SUFFIX))
+    return [
+        {"render": os.path.join(path_dir, n), "refs": list(refs), "prompt": prompt,
+         "output": _out_path(out_dir, n)}
+        for n in names
+    ]
+
+def jobs_from_manifest(path: str, out_dir: str, prompt: str, refs) -> list:
+    """JSON 配列または JSONL のジョブ一覧を読み込み、省略された項目を既定値で埋める"""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        entries = json.loads(text)
+    else:
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    def resolve(p):
+        return p if not p or os.path.isabs(p) else os.path.join(base, p)
+
+    jobs = []
+    for i, e in enumerate(entries):
+        if "render" not in e:
+            raise ValueError(f"{path}: {i + 1} 件目に render がありません")
+        render = resolve(e["render"])
+        jobs.append({
+            "render": render,
+            "refs": [resolve(r) for r in e.get("refs", refs)],
+            "prompt": e.get("prompt", prompt),
+            "output": resolve(e["output"]) if e.get("output") else _out_path(out_dir, render),
+        })
+    return jobs
+
+
+# =========================================================
+# Worker（スレッド/プロセス共通）
+# =========================================================
+_settings = {}
+_configure_lock = threading.Lock()
+_cache = None  # プロセスで 1 つの結果キャッシュ（索引の走査・容量の管理・ヒット数を全ジョブで共有）
+
+def _configure(settings: dict):
+    """ワーカー（プロセス）ごとの送信先・レート制限・キャッシュを設定し、結果キャッシュ（なければ None）を返す"""
+    global _cache
+    with _configure_lock:
+        if _settings == settings:
+            return _cache
+        _settings.clear()
+        _settings.update(settings)
+        root, max_bytes = settings["cache_dir"], settings["cache_max_mb"] * 1024 * 1024
+        if not root:
+            _cache = None
+        elif _cache is None or _cache.root != root:
+            _cache = ResultCache(root, max_bytes)
+        else:
+            _cache.max_bytes = max_bytes
+        api.set_endpoint(settings["api_url"])
+        POOL.max_size = max(settings["workers"], 1)
+        keys = settings["api_keys"]
+        KEYS.configure([(k, "") for k in keys], rpm=settings["rpm"])
+        SCHEDULER.configure(rpm=settings["rpm"] * len(keys), max_inflight=settings["workers"], max_retries=settings["max_retries"])
+        return _cache
+
+def run_job(job: dict, settings: dict) -> dict:
+    """1 ジョブを実行して結果（status / output / 所要時間 / エラー）を返す"""
+    cache = _configure(settings)
+    trace = JobTrace("cli", render=job["render"])
+    out = job["output"]
+    if settings["skip_existing"] and os.path.isfile(out):
+        return trace.record("skipped", output=out)
+    refs = (list(job["refs"]) + ["", ""])[:2]
+    part = f"{out}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+        api._run_monkey_banana(settings["api_keys"][0], job["prompt"], refs[0], refs[1], job["render"], cache,
+                               settings["stream"], trace.on_event, out_path=part)
+        os.replace(part, out)
+        return trace.record("done", output=out)
+    except Exception as e:
+        return trace.record("error", output=out, error=str(e))
+    finally:
+        if os.path.exists(part):
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+
+def run_jobs(jobs: list, settings: dict, processes: bool = False, on_result=None) -> list:
+    """ジョブをプールで並列実行し、投入順の結果リストを返す"""
+    workers = max(settings["workers"], 1)
+    if processes:
+        # レート制限はプロセスごとにかかるため、全体の上限を等分する
+        per_proc = dict(settings, workers=1, rpm=settings["rpm"] // workers if settings["rpm"] else 0)
+        if settings["rpm"] and not per_proc["rpm"]:
+            per_proc["rpm"] = 1
+        pool, job_settings = ProcessPoolExecutor(max_workers=workers), per_proc
+    else:
+        pool, job_settings = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mb_cli"), settings
+    results = [None] * len(jobs)
+    with pool:
+        futures = {pool.submit(run_job, job, job_settings): i for i, job in enumerate(jobs)}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try:
+                results[i] = fut.result()
+            except Exception as e:  # プロセスの異常終了など
+                results[i] = {"status": "error", "render": jobs[i]["render"], "output": jobs[i]["output"], "error": str(e)}
+            if on_result:
+                on_result(results[i])
+    return results
+
+
+# =========================================================
+# Entry
+# =========================================================
+def _scene_defaults() -> dict:
+    """Blender 内で実行されていればシーンのパネル設定を既定値として返す"""
+    try:
+        import bpy
+        p = bpy.context.scene.mb_props
+    except Exception:
+        return {}
+    refs = [bpy.path.abspath(r) for r in (p.input_path_b, p.input_path_c) if r]
+    return {
+        "api_key": p.api_key,
+        "prompt": p.prompt_text.as_string() if p.prompt_text else "",
+        "refs": refs,
+        "api_url": p.api_url,
+        "cache_dir": bpy.path.abspath(p.cache_dir) if p.use_cache and p.cache_dir else "",
+    }
+
+def _argv() -> list:
+    """blender ... -- <引数> の形式なら -- 以降だけを使う"""
+    argv = sys.argv
+    return argv[argv.index("--") + 1:] if "--" in argv else argv[1:]
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="monkey_banana.cli", description="レンダ済み画像を GUI なしで一括編集")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--dir", help="レンダ画像のフォルダ（画像 1 枚 = 1 ジョブ）")
+    src.add_argument("--manifest", help="ジョブ一覧（JSON 配列 / JSONL）")
+    parser.add_argument("--out", default="", help=f"出力フォルダ（既定: --dir なら <dir>/{DEFAULT_OUT}、--manifest ならその場所）")
+    parser.add_argument("--prompt", default=None, help="全ジョブ共通のプロンプト")
+    parser.add_argument("--prompt-file", default=None, help="プロンプトを読むテキストファイル")
+    parser.add_argument("--ref", action="append", default=None, help="参照画像（最大 2 回指定）")
+    parser.add_argument("--api-key", action="append", default=None,
+                        help="API キー（複数指定で最も空いているキーに分散。既定: 環境変数 MB_API_KEY / GEMINI_API_KEY）")
+    parser.add_argument("--api-url", default=None, help="generateContent の URL（既定: MB_API_URL / 既定値）")
+    parser.add_argument("--workers", type=int, default=4, help="同時実行数")
+    parser.add_argument("--processes", action="store_true", help="スレッドではなくプロセスで並列実行")
+    parser.add_argument("--rpm", type=int, default=0, help="キーごとの 1 分あたりのリクエスト上限（0 で無制限）")
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--stream", action="store_true", help="streamGenerateContent（SSE）で受信")
+    parser.add_argument("--cache-dir", default=None, help="結果キャッシュのフォルダ（未指定なら使わない）")
+    parser.add_argument("--cache-max-mb", type=int, default=512)
+    parser.add_argument("--skip-existing", action="store_true", help="出力が既にあるジョブは実行しない")
+    parser.add_argument("--report", default=None, help="サマリーレポートの出力先（既定: <out>/mb_report.json）")
+    return parser.parse_args(_argv() if argv is None else argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    scene = _scene_defaults()
+
+    prompt = args.prompt
+    if args.prompt_file:
+        with open(args.prompt_file, "r", encoding="utf-8") as f:
+            prompt = f.read()
+    if prompt is None:
+        prompt = scene.get("prompt", "")
+    refs = args.ref if args.ref is not None else scene.get("refs", [])
+    if len(refs) > 2:
+        print("参照画像は 2 枚までです", file=sys.stderr)
+        return 2
+    api_keys = [k.strip() for k in args.api_key or [] if k.strip()]
+    if not api_keys:
+        api_key = (os.environ.get("MB_API_KEY") or os.environ.get("GEMINI_API_KEY") or scene.get("api_key") or "").strip()
+        api_keys = [api_key] if api_key else []
+    if not api_keys:
+        print("API キーがありません（--api-key または MB_API_KEY）", file=sys.stderr)
+        return 2
+
+    if args.dir:
+        out_dir = args.out or os.path.join(args.dir, DEFAULT_OUT)
+        jobs = jobs_from_dir(args.dir, out_dir, prompt, refs)
+    else:
+        out_dir = args.out or os.path.dirname(os.path.abspath(args.manifest))
+        jobs = jobs_from_manifest(args.manifest, out_dir, prompt, refs)
+    if not jobs:
+        print("処理するジョブがありません", file=sys.stderr)
+        return 2
+    clobber = [j["render"] for j in jobs if os.path.abspath(j["output"]) == os.path.abspath(j["render"])]
+    if clobber:
+        print(f"出力先が入力画像と同じです（{len(clobber)} 件、例: {clobber[0]}）。--out か output を変えてください",
+              file=sys.stderr)
+        return 2
+
+    settings = {
+        "api_keys": api_keys,
+        "api_url": args.api_url or scene.get("api_url", ""),
+        "workers": max(args.workers, 1),
+        "rpm": args.rpm,
+        "max_retries": args.max_retries,
+        "stream": args.stream,
+        "cache_dir": args.cache_dir if args.cache_dir is not None else scene.get("cache_dir", ""),
+        "cache_max_mb": args.cache_max_mb,
+        "skip_existing": args.skip_existing,
+    }
+
+    done = [0]
+
+    def on_result(res):
+        done[0] += 1
+        line = f"[{done[0]}/{len(jobs)}] {res['status']}: {res.get('output', '')}"
+        if res.get("error"):
+            line += f" ({res['error']})"
+        print(line, flush=True)
+
+    t0 = time.perf_counter()
+    results = run_jobs(jobs, settings, processes=args.processes, on_result=on_result)
+    counts = {}
+    for res in results:
+        counts[res["status"]] = counts.get(res["status"], 0) + 1
+    report = {
+        "jobs": len(jobs),
+        "counts": counts,
+        "wall_s": round(time.perf_counter() - t0, 3),
+        "workers": settings["workers"],
+        "processes": args.processes,
+        "results": results,
+    }
+    if _cache is not None:
+        # スレッド実行のキャッシュ（プロセス実行では各プロセスが持つため集計しない）
+        report["cache"] = {"hits": _cache.hits, "misses": _cache.misses}
+    report_path = args.report or os.path.join(out_dir, "mb_report.json")
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"完了: {counts}（{report['wall_s']}s）→ {report_path}")
+    return 1 if counts.get("error") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
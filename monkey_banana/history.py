@@ -0,0 +1,203 @@
+import hashlib, json, os, sqlite3, threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import imaging
+
+HISTORY_NAME = "mb_history.sqlite"
+THUMB_DIR = "mb_thumbs"
+THUMB_SIZE = 128
+# thumb 列の特別な値（それ以外はサムネイルのパス、空なら未作成）
+THUMB_BLENDER = "?"  # ワーカーではデコードできない形式。メインスレッドで Blender に作らせる
+THUMB_FAILED = "!"   # 作成に失敗（プレースホルダを表示する）
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prompts (
+    hash TEXT PRIMARY KEY,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job TEXT,
+    kind TEXT,
+    started TEXT,
+    status TEXT,
+    output TEXT,
+    render TEXT,
+    refs TEXT,
+    prompt_hash TEXT,
+    seed INTEGER,
+    frame INTEGER,
+    total_s REAL,
+    stages TEXT,
+    thumb TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS runs_prompt ON runs(prompt_hash);
+CREATE INDEX IF NOT EXISTS runs_output ON runs(output);
+"""
+
+
+def prompt_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def make_thumbnail(src: str, dest: str, size: int = THUMB_SIZE) -> bool:
+    """PNG の長辺を size px に縮めたサムネイルを書き出す（PNG 以外は False）"""
+    with open(src, "rb") as f:
+        pixels = imaging.decode_png(f.read())
+    if pixels is None:
+        return False
+    pixels = imaging.to_float_rgba(pixels)[::-1]
+    h, w = pixels.shape[:2]
+    # 大きく縮めるときは先にブロック平均で荒く縮め、双線形補間のエイリアスを抑える
+    step = max(1, max(h, w) // (size * 2))
+    if step > 1:
+        hh, ww = h // step * step, w // step * step
+        pixels = pixels[:hh, :ww].reshape(hh // step, step, ww // step, step, -1).mean(axis=(1, 3))
+        h, w = pixels.shape[:2]
+    s = size / max(h, w)
+    thumb = imaging.resize(pixels.astype(np.float32), max(1, round(w * s)), max(1, round(h * s)))
+    png = imaging.encode_png(np.ascontiguousarray(imaging.to_uint8(thumb)))
+    tmp = f"{dest}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(png)
+    os.replace(tmp, dest)
+    return True
+
+
+class HistoryDB:
+    """すべての実行結果（入力・プロンプトのハッシュ・所要時間・出力先）を SQLite に索引する
+
+    プロンプト本文はハッシュごとに 1 度だけ prompts に保存する。
+    サムネイルは request_thumbnail() でバックグラウンド生成し、thumb 列にパスを記録する。
+    ワーカーでデコードできない出力は THUMB_BLENDER にして、deferred() / set_thumb() でメインスレッドに任せる。
+    メインスレッドとサムネイル生成スレッドで 1 つの接続をロックで共有する。
+    """
+
+    def __init__(self, path_dir: str):
+        self.dir = path_dir
+        self.path = os.path.join(path_dir, HISTORY_NAME)
+        self.thumb_dir = os.path.join(path_dir, THUMB_DIR)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pool = None
+        self._pending = set()  # サムネイル生成中の run id
+
+    def _db(self) -> sqlite3.Connection:
+        """接続（初回にテーブルを作成）。ロックを保持して呼ぶこと"""
+        if self._conn is None:
+            os.makedirs(self.dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def add_prompt(self, text: str) -> str:
+        """プロンプト本文を登録してハッシュを返す"""
+        h = prompt_hash(text)
+        with self._lock:
+            db = self._db()
+            db.execute("INSERT OR IGNORE INTO prompts (hash, text) VALUES (?, ?)", (h, text))
+            db.commit()
+        return h
+
+    def add(self, rec: dict) -> int:
+        """テレメトリの記録（JobTrace.record）から 1 件登録して id を返す"""
+        row = (
+            rec.get("job"), rec.get("kind"), rec.get("started"), rec.get("status"),
+            rec.get("output"), rec.get("render"), json.dumps(rec.get("refs") or []),
+            rec.get("prompt_hash"), rec.get("seed"), rec.get("frame"),
+            rec.get("total_s"), json.dumps(rec.get("stages") or {}),
+        )
+        with self._lock:
+            db = self._db()
+            cur = db.execute(
+                "INSERT INTO runs (job, kind, started, status, output, render, refs, prompt_hash, seed, frame,"
+                " total_s, stages) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            db.commit()
+            return cur.lastrowid
+
+    @staticmethod
+    def _where(query: str):
+        if not query:
+            return "", ()
+        like = f"%{query}%"
+        return " WHERE runs.output LIKE ? OR prompts.text LIKE ?", (like, like)
+
+    def count(self, query: str = "") -> int:
+        where, args = self._where(query)
+        with self._lock:
+            return self._db().execute(
+                "SELECT COUNT(*) FROM runs LEFT JOIN prompts ON prompts.hash = runs.prompt_hash" + where, args
+            ).fetchone()[0]
+
+    def page(self, offset: int, limit: int, query: str = "") -> list:
+        """新しい順に limit 件（query は出力パスかプロンプトの部分一致）"""
+        where, args = self._where(query)
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT runs.*, prompts.text AS prompt FROM runs"
+                " LEFT JOIN prompts ON prompts.hash = runs.prompt_hash" + where +
+                " ORDER BY runs.id DESC LIMIT ? OFFSET ?", args + (limit, offset)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def request_thumbnail(self, run_id: int, output: str):
+        """サムネイルをバックグラウンドで作る（作成済み・作成中なら何もしない）"""
+        with self._lock:
+            if run_id in self._pending:
+                return
+            self._pending.add(run_id)
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mb_thumb")
+            pool = self._pool
+        pool.submit(self._make_thumbnail, run_id, output)
+
+    def thumb_path(self, run_id: int) -> str:
+        return os.path.join(self.thumb_dir, f"{run_id}.png")
+
+    def _make_thumbnail(self, run_id: int, output: str):
+        thumb = THUMB_FAILED
+        try:
+            os.makedirs(self.thumb_dir, exist_ok=True)
+            thumb = self.thumb_path(run_id) if make_thumbnail(output, self.thumb_path(run_id)) else THUMB_BLENDER
+        except Exception as e:  # 壊れた PNG（zlib.error / struct.error 等）も含む
+            print(f"[Monkey Banana] サムネイルを作成できません: {output}: {e}")
+        finally:
+            self.set_thumb(run_id, thumb)
+
+    def set_thumb(self, run_id: int, thumb: str):
+        """サムネイルの状態を記録し、作成中の印を外す"""
+        with self._lock:
+            self._pending.discard(run_id)
+            try:
+                db = self._db()
+                db.execute("UPDATE runs SET thumb = ? WHERE id = ?", (thumb, run_id))
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"[Monkey Banana] 履歴を更新できません: {e}")
+
+    def deferred(self, limit: int = 1) -> list:
+        """Blender に作らせるサムネイルの (id, 出力パス)（新しい順）"""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT id, output FROM runs WHERE thumb = ? ORDER BY id DESC LIMIT ?", (THUMB_BLENDER, limit)
+            ).fetchall()
+        return [(r["id"], r["output"]) for r in rows]
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
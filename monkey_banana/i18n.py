@@ -31,6 +31,83 @@ I18N_DICT = {
         ("*", "Open in Editor"): "エディタで開く",
         ("*", "Last Info: "): "最終情報: ",
         ("*", "Last Error: "): "最終エラー: ",
+        ("*", "Batch (Animation)"): "バッチ（アニメーション）",
+        ("*", "Frames"): "フレーム",
+        ("*", "Concurrency"): "同時実行数",
+        ("*", "Run Batch (Frames)"): "バッチ実行（フレーム）",
+        ("*", "Result Cache"): "結果キャッシュ",
+        ("*", "Use Result Cache"): "結果キャッシュを使う",
+        ("*", "Cache Dir"): "キャッシュフォルダ",
+        ("*", "Cache Size (MB)"): "キャッシュ容量（MB）",
+        ("*", "Hits / Misses: "): "ヒット / ミス: ",
+        ("*", "Connection Pool Size"): "接続プールサイズ",
+        ("*", "Upload"): "アップロード",
+        ("*", "In-Memory Handoff"): "メモリ経由で受け渡し",
+        ("*", "Upload Format"): "アップロード形式",
+        ("*", "As Rendered"): "レンダ出力のまま",
+        ("*", "Upload Quality"): "アップロード品質",
+        ("*", "Max Long Edge"): "最大長辺",
+        ("*", "Tiled (Large Renders)"): "タイル処理（大きなレンダ）",
+        ("*", "Tile Size"): "タイルサイズ",
+        ("*", "Tile Overlap"): "タイルの重なり",
+        ("*", "Run Tiled"): "タイル実行",
+        ("*", "Network"): "通信",
+        ("*", "Requests / Minute"): "リクエスト数/分",
+        ("*", "Max In-Flight"): "最大同時送信数",
+        ("*", "Max Retries"): "最大再試行回数",
+        ("*", "Retries / 429s: "): "再試行 / 429: ",
+        ("*", "Streaming (SSE)"): "ストリーミング（SSE）",
+        ("*", "Telemetry"): "計測",
+        ("*", "Telemetry (JSONL)"): "計測を記録（JSONL）",
+        ("*", "Last: "): "前回: ",
+        ("*", "Average: "): "平均: ",
+        ("*", "Render"): "レンダ",
+        ("*", "Encode"): "エンコード",
+        ("*", "Prepare"): "準備",
+        ("*", "Cache"): "キャッシュ",
+        ("*", "Server"): "サーバ",
+        ("*", "Download"): "受信",
+        ("*", "Decode"): "デコード",
+        ("*", "Save"): "保存",
+        ("*", "Display"): "表示",
+        ("*", "Skip Static Frames"): "静止フレームをスキップ",
+        ("*", "Difference Threshold (%)"): "差分のしきい値（%）",
+        ("*", "Region (Local Edit)"): "部分編集（範囲指定）",
+        ("*", "Region"): "範囲",
+        ("*", "Render Border"): "レンダ境界",
+        ("*", "Active Object"): "アクティブオブジェクト",
+        ("*", "Mask Image"): "マスク画像",
+        ("*", "Region Padding"): "範囲の余白",
+        ("*", "Region Feather"): "範囲のぼかし幅",
+        ("*", "Run Region"): "部分編集を実行",
+        ("*", "Variants (Look Exploration)"): "バリエーション（ルック検討）",
+        ("*", "Split Prompt by Paragraph"): "段落ごとにプロンプトを分割",
+        ("*", "Candidates per Prompt"): "プロンプトあたりの候補数",
+        ("*", "Base Seed"): "seed の起点",
+        ("*", "Last Base Seed"): "直前の seed の起点",
+        ("*", "Last base seed: "): "直前の seed の起点: ",
+        ("*", "Sheet Thumbnail"): "シートのサムネイル幅",
+        ("*", "Run Variants"): "バリエーションを実行",
+        ("*", "API Key Pool"): "APIキープール",
+        ("*", "Keys (in-flight / last min / total)"): "キー（送信中 / 直近1分 / 累計）",
+        ("*", "Cooldown "): "待機 ",
+        ("*", "Error"): "エラー",
+        ("*", "Coalesced Duplicates: "): "相乗りした重複リクエスト: ",
+        ("*", "Connect Timeout (s)"): "接続タイムアウト（秒）",
+        ("*", "Upload Stall Timeout (s)"): "送信停滞タイムアウト（秒）",
+        ("*", "First Byte Timeout (s)"): "初回応答タイムアウト（秒）",
+        ("*", "Read Stall Timeout (s)"): "受信停滞タイムアウト（秒）",
+        ("*", "History"): "履歴",
+        ("*", "Record History (SQLite)"): "履歴を記録（SQLite）",
+        ("*", "Search"): "検索",
+        ("*", "Open Result"): "結果を開く",
+        ("*", "Job Journal"): "ジョブジャーナル",
+        ("*", "Record Jobs (JSONL)"): "ジョブを記録（JSONL）",
+        ("*", "Resume on Load"): "読み込み時に再開",
+        ("*", "Resume Jobs"): "ジョブを再開",
+        ("*", "Resume"): "再開",
+        ("*", "Unfinished: "): "未完了: ",
+        ("*", "Resuming: "): "再開中: ",
         ("*", "Save path for manual run. If blank, mb_out_01.png is saved in the same folder as the render image."): "手動実行の保存先。未指定ならレンダ画像と同フォルダに mb_out_01.png 形式で保存",
     }
 }
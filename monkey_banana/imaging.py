@@ -0,0 +1,348 @@
+import struct, zlib
+import numpy as np
+
+_PNG_SIG = b"\x89PNG\r\n\x1a\n"
+
+
+# =========================================================
+# Encode
+# =========================================================
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+def encode_png(pixels: np.ndarray, level: int = 6) -> bytes:
+    """uint8 の (h, w, 3|4) 配列（上から下の行順）を PNG にエンコード"""
+    h, w, c = pixels.shape
+    color_type = {3: 2, 4: 6}[c]
+    raw = np.zeros((h, w * c + 1), dtype=np.uint8)  # 各行の先頭はフィルタ種別 0
+    raw[:, 1:] = pixels.reshape(h, w * c)
+    return (
+        _PNG_SIG
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, color_type, 0, 0, 0))
+        + _png_chunk(b"IDAT", zlib.compress(raw.tobytes(), level))
+        + _png_chunk(b"IEND", b"")
+    )
+
+def to_uint8(pixels: np.ndarray) -> np.ndarray:
+    """0..1 の float 画素を uint8 に変換"""
+    return np.clip(np.rint(pixels * 255.0), 0, 255).astype(np.uint8)
+
+def image_ext(data: bytes) -> str:
+    """画像バイト列の先頭から拡張子を推定"""
+    if data.startswith(_PNG_SIG):
+        return ".png"
+    if data.startswith(b"\xff\xd8"):
+        return ".jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    return ".png"
+
+
+# =========================================================
+# Decode
+# =========================================================
+_PNG_CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}  # color type -> チャンネル数（パレットは非対応）
+
+# 斜め走査で使う作業配列（int16）の要素数の上限。超える画像は行の帯に分けて戻す
+_WAVEFRONT_ELEMS = 1 << 24
+
+def _unfilter_wavefront(ft: np.ndarray, lines: np.ndarray, prev: np.ndarray, w: int, c: int) -> np.ndarray:
+    """フィルタ種別 ft の行 lines（k, w*c）を、直前の行 prev を上として斜め（x + y が同じ画素）ごとに戻す
+
+    Average/Paeth は左・上・左上の画素に依存するため行内では逐次にしか戻せないが、
+    x + y = d の画素は d - 1 と d - 2 の画素だけに依存するので、斜め 1 本をまとめて NumPy で計算できる。
+    ループは行数 × 幅ではなく 幅 + 行数 回で済む。種別の混ざった行もそのまま扱う。
+    """
+    k = len(ft)
+    ys = np.arange(1, k + 1)[:, None]  # 行 0 は prev
+    xs = np.arange(w)[None, :]
+    diag = xs + ys
+    # t[d, y] が画素 (y, x = d - y)。範囲外（x < 0）は 0 のまま残り、左・左上の 0 として使われる
+    raw = np.zeros((w + k + 1, k + 1, c), dtype=np.int16)
+    raw[diag, ys] = lines.reshape(k, w, c)
+    t = np.zeros_like(raw)
+    t[np.arange(w), 0] = prev.reshape(w, c)
+    ftc = ft[:, None]
+    kinds = set(np.unique(ft).tolist())
+    for d in range(1, w + k):
+        lo, hi = max(1, d - w + 1), min(k, d) + 1
+        a = t[d - 1, lo:hi]
+        b = t[d - 1, lo - 1:hi - 1]
+        f = ftc[lo - 1:hi - 1]
+        pred = np.zeros_like(a)
+        if 1 in kinds:
+            np.copyto(pred, a, where=f == 1)
+        if 2 in kinds:
+            np.copyto(pred, b, where=f == 2)
+        if 3 in kinds:
+            np.copyto(pred, (a + b) >> 1, where=f == 3)
+        if 4 in kinds:
+            cc = t[d - 2, lo - 1:hi - 1]
+            pa, pb, pc = np.abs(b - cc), np.abs(a - cc), np.abs(a + b - 2 * cc)
+            np.copyto(pred, np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, cc)), where=f == 4)
+        t[d, lo:hi] = (raw[d, lo:hi] + pred) & 0xFF
+    return t[diag, ys].astype(np.uint8).reshape(k, w * c)
+
+def _band_rows(w: int, c: int) -> int:
+    """作業配列（(w + k) * k * c 要素）が上限に収まる帯の行数 k"""
+    m = _WAVEFRONT_ELEMS / c
+    return max(1, int((-w + (w * w + 4 * m) ** 0.5) / 2))
+
+def decode_png(data: bytes):
+    """8bit・非インターレースの PNG を uint8 の (h, w, c) 配列（上から下の行順）にデコード
+
+    非対応の形式（PNG 以外・16bit・パレット・インターレース）は None を返す。
+    None/Sub/Up フィルタの行は NumPy で行全体をまとめて戻す。Average/Paeth の行が現れたら、
+    そこから下は _unfilter_wavefront で斜めごとに戻す（Python の逐次ループを使わない）。
+    """
+    if not data.startswith(_PNG_SIG):
+        return None
+    header, idat, pos = None, [], len(_PNG_SIG)
+    while pos + 8 <= len(data):
+        length, tag = struct.unpack(">I4s", data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if tag == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk)
+        elif tag == b"IDAT":
+            idat.append(chunk)
+        elif tag == b"IEND":
+            break
+    if header is None:
+        return None
+    w, h, depth, color_type, _, _, interlace = header
+    c = _PNG_CHANNELS.get(color_type)
+    if depth != 8 or interlace or c is None:
+        return None
+    stride = w * c
+    raw = np.frombuffer(zlib.decompress(b"".join(idat)), dtype=np.uint8)
+    if raw.size < h * (stride + 1):
+        return None
+    rows = raw[:h * (stride + 1)].reshape(h, stride + 1)
+    if (rows[:, 0] > 4).any():
+        return None
+    out = np.empty((h, stride), dtype=np.uint8)
+    prev = np.zeros(stride, dtype=np.uint8)
+    slow = np.flatnonzero(rows[:, 0] > 2)
+    first = slow[0] if slow.size else h
+    for y in range(first):
+        ft, line = rows[y, 0], rows[y, 1:]
+        if ft == 0:
+            out[y] = line
+        elif ft == 1:
+            out[y] = line.reshape(w, c).cumsum(axis=0, dtype=np.uint8).ravel()
+        else:
+            out[y] = line + prev
+        prev = out[y]
+    band = _band_rows(w, c)
+    for y in range(first, h, band):
+        end = min(h, y + band)
+        out[y:end] = _unfilter_wavefront(rows[y:end, 0], rows[y:end, 1:], prev, w, c)
+        prev = out[end - 1]
+    return out.reshape(h, w, c)
+
+def to_float_rgba(pixels: np.ndarray) -> np.ndarray:
+    """uint8 の (h, w, 1-4) 配列（上から下）を Blender の画素順 (h, w, 4) float32（下から上）に変換"""
+    h, w, c = pixels.shape
+    out = np.ones((h, w, 4), dtype=np.float32)
+    src = pixels[::-1].astype(np.float32) / 255.0
+    if c <= 2:
+        out[..., :3] = src[..., :1]
+    else:
+        out[..., :3] = src[..., :3]
+    if c in (2, 4):
+        out[..., 3] = src[..., -1]
+    return out
+
+def resize(pixels: np.ndarray, width: int, height: int) -> np.ndarray:
+    """(h, w, c) float 配列を双線形補間で (height, width, c) に拡縮"""
+    h, w = pixels.shape[:2]
+    if (w, h) == (width, height):
+        return pixels
+
+    def axis(n_src, n_dst):
+        pos = np.clip((np.arange(n_dst, dtype=np.float32) + 0.5) * (n_src / n_dst) - 0.5, 0, n_src - 1)
+        i0 = np.floor(pos).astype(np.intp)
+        i1 = np.minimum(i0 + 1, n_src - 1)
+        return i0, i1, (pos - i0)
+
+    y0, y1, fy = axis(h, height)
+    x0, x1, fx = axis(w, width)
+    fx = fx[None, :, None]
+    rows = pixels[y0] * (1 - fy)[:, None, None] + pixels[y1] * fy[:, None, None]
+    return (rows[:, x0] * (1 - fx) + rows[:, x1] * fx).astype(np.float32)
+
+
+# =========================================================
+# Compare
+# =========================================================
+SIGNATURE_SIZE = 32
+
+def signature(pixels: np.ndarray, size: int = SIGNATURE_SIZE) -> np.ndarray:
+    """(h, w, c) の画素（0-1）を size x size の輝度（ブロック平均）に縮めたフレーム比較用の署名"""
+    h, w = pixels.shape[:2]
+    if min(h, w) < size:
+        pixels = resize(pixels, max(w, size), max(h, size))
+        h, w = pixels.shape[:2]
+    rgb = pixels[..., :3] if pixels.shape[2] >= 3 else np.repeat(pixels[..., :1], 3, axis=2)
+    luma = rgb.astype(np.float32) @ np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+    by, bx = h // size, w // size
+    luma = luma[:by * size, :bx * size]
+    return luma.reshape(size, by, size, bx).mean(axis=(1, 3))
+
+def frame_difference(a: np.ndarray, b: np.ndarray) -> float:
+    """2 つの署名の平均絶対差（0-1）。0 なら同一とみなせる"""
+    return float(np.abs(a - b).mean())
+
+
+# =========================================================
+# Contact Sheet
+# =========================================================
+def contact_sheet(cells, cols: int, pad: int = 8, background: float = 0.1) -> np.ndarray:
+    """同じ大きさの (h, w, 4) 画素を cols 列の格子に並べる（None のセルは背景のまま）
+
+    cells[0] は配列の先頭行側の左端に置く。上から下の行順で渡せば左上から並ぶ。
+    """
+    shape = next(c.shape for c in cells if c is not None)
+    h, w = shape[:2]
+    rows = (len(cells) + cols - 1) // cols
+    sheet = np.full((rows * h + (rows + 1) * pad, cols * w + (cols + 1) * pad, 4), background, dtype=np.float32)
+    sheet[..., 3] = 1.0
+    for i, cell in enumerate(cells):
+        if cell is None:
+            continue
+        r, c = divmod(i, cols)
+        y, x = pad + r * (h + pad), pad + c * (w + pad)
+        sheet[y:y + h, x:x + w] = cell[..., :4]
+    return sheet
+
+
+# =========================================================
+# Tiles
+# =========================================================
+def _axis_starts(length: int, tile: int, overlap: int) -> list:
+    if length <= tile:
+        return [0]
+    stride = max(1, tile - overlap)
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+    return starts
+
+def tile_boxes(width: int, height: int, tile: int, overlap: int) -> list:
+    """画像を重なり付きタイルに分割した (x0, y0, x1, y1) のリスト"""
+    return [
+        (x, y, min(x + tile, width), min(y + tile, height))
+        for y in _axis_starts(height, tile, overlap)
+        for x in _axis_starts(width, tile, overlap)
+    ]
+
+def _ramp(n: int, overlap: int, lead: bool, trail: bool) -> np.ndarray:
+    w = np.ones(n, dtype=np.float32)
+    ov = min(overlap, n // 2)
+    if ov > 0:
+        r = (np.arange(ov, dtype=np.float32) + 0.5) / ov
+        if lead:
+            w[:ov] = r
+        if trail:
+            w[-ov:] = r[::-1]
+    return w
+
+def feather_weights(box, width: int, height: int, overlap: int) -> np.ndarray:
+    """隣接タイルと重なる辺だけを線形にフェードさせる (h, w) の重み"""
+    x0, y0, x1, y1 = box
+    wx = _ramp(x1 - x0, overlap, x0 > 0, x1 < width)
+    wy = _ramp(y1 - y0, overlap, y0 > 0, y1 < height)
+    return np.outer(wy, wx)
+
+
+class TileBlender:
+    """届いた順にタイルを重み付きで積算し、最後に正規化して 1 枚に合成する"""
+
+    def __init__(self, width: int, height: int, overlap: int, channels: int = 4):
+        self.width = width
+        self.height = height
+        self.overlap = overlap
+        self.channels = channels
+        self._acc = np.zeros((height, width, channels), dtype=np.float32)
+        self._wsum = np.zeros((height, width, 1), dtype=np.float32)
+
+    def add(self, box, pixels: np.ndarray):
+        x0, y0, x1, y1 = box
+        w = feather_weights(box, self.width, self.height, self.overlap)[..., None]
+        self._acc[y0:y1, x0:x1] += pixels[..., :self.channels] * w
+        self._wsum[y0:y1, x0:x1] += w
+
+    def result(self) -> np.ndarray:
+        np.maximum(self._wsum, 1e-6, out=self._wsum)
+        self._acc /= self._wsum
+        return self._acc
+
+
+def blend_tiles(width: int, height: int, tiles, overlap: int, channels: int = 4) -> np.ndarray:
+    """(box, (h, w, c) 配列) の列をフェザー付きで合成した (height, width, c) 配列"""
+    blender = TileBlender(width, height, overlap, channels)
+    for box, pixels in tiles:
+        blender.add(box, pixels)
+    return blender.result()
+
+
+# =========================================================
+# Region
+# =========================================================
+def region_box(box, width: int, height: int, padding: int):
+    """(x0, y0, x1, y1) を padding だけ広げて画像内に収めた整数の箱（空なら None）"""
+    x0, y0, x1, y1 = box
+    x0 = max(0, int(np.floor(x0)) - padding)
+    y0 = max(0, int(np.floor(y0)) - padding)
+    x1 = min(width, int(np.ceil(x1)) + padding)
+    y1 = min(height, int(np.ceil(y1)) + padding)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return (x0, y0, x1, y1)
+
+def mask_values(pixels: np.ndarray) -> np.ndarray:
+    """マスク画像の画素 (h, w, c) を 0-1 の重み (h, w) に変換（輝度 × アルファ）"""
+    if pixels.shape[2] < 3:
+        return pixels[..., 0].astype(np.float32)
+    luma = pixels[..., :3].astype(np.float32) @ np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+    return luma * pixels[..., 3] if pixels.shape[2] == 4 else luma
+
+def mask_box(mask: np.ndarray, threshold: float = 0.01):
+    """重みが threshold を超える範囲の (x0, y0, x1, y1)。なければ None"""
+    ys = np.flatnonzero((mask > threshold).any(axis=1))
+    xs = np.flatnonzero((mask > threshold).any(axis=0))
+    if not len(ys):
+        return None
+    return (int(xs[0]), int(ys[0]), int(xs[-1]) + 1, int(ys[-1]) + 1)
+
+def _box_blur(a: np.ndarray, radius: int) -> np.ndarray:
+    """(h, w) 配列の分離型ボックスぼかし（端は端の値で延長）"""
+    if radius <= 0:
+        return a
+    for axis in (0, 1):
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (radius + 1, radius)
+        c = np.cumsum(np.pad(a, pad, mode="edge"), axis=axis, dtype=np.float64)
+        n = a.shape[axis]
+        hi = np.take(c, np.arange(2 * radius + 1, 2 * radius + 1 + n), axis=axis)
+        lo = np.take(c, np.arange(n), axis=axis)
+        a = ((hi - lo) / (2 * radius + 1)).astype(np.float32)
+    return a
+
+def composite_region(base: np.ndarray, patch: np.ndarray, box, feather: int, mask: np.ndarray = None) -> np.ndarray:
+    """patch を base の box に重ねる（base を直接書き換えて返す）
+
+    box の縁（画像の端以外）は feather px で線形にフェードさせる。mask（base と同じ大きさの重み）を
+    渡すとその範囲だけを置き換え、マスクの境界も feather の半分でぼかす。
+    """
+    x0, y0, x1, y1 = box
+    h, w = base.shape[:2]
+    weight = feather_weights(box, w, h, feather)
+    if mask is not None:
+        weight = weight * _box_blur(mask[y0:y1, x0:x1].astype(np.float32), feather // 2)
+    weight = weight[..., None]
+    channels = min(base.shape[2], patch.shape[2])
+    region = base[y0:y1, x0:x1, :channels]
+    region += (patch[..., :channels] - region) * weight
+    return base
+
@@ -0,0 +1,365 @@
+import json, os, shutil, threading, time, uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+JOURNAL_NAME = "mb_jobs.jsonl"
+SPILL_DIR = "mb_jobs"
+OWNER_DIR = "owners"
+
+# 再開の対象になる状態（saving は出力が存在しなければ未完了として扱う）
+_OPEN_STATES = ("pending", "inflight", "saving")
+
+
+def _lock_file(f, blocking: bool = True) -> bool:
+    """ファイルを排他ロック（blocking=False で取れなければ False）。プロセスが終われば OS が解放する"""
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return False
+        return True
+    while True:
+        f.seek(0)
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(0.05)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _saved(entry: "JobEntry") -> bool:
+    # 連番の予約は空ファイルを作るため、中身のある出力だけを完了とみなす
+    return entry.state == "saving" and bool(entry.output) and os.path.isfile(entry.output) \
+        and os.path.getsize(entry.output) > 0
+
+
+class JobEntry:
+    """ジャーナル上の 1 ジョブ。状態遷移のたびに 1 行追記する"""
+
+    def __init__(self, journal: "JobJournal", job_id: str, job: dict, state: str = "pending", output: str = "",
+                 owner: str = ""):
+        self.journal = journal
+        self.id = job_id
+        self.job = job
+        self.state = state
+        self.output = output
+        self.owner = owner  # 実行しているインスタンス（JobJournal.owner）
+
+    def _set(self, state: str, **fields):
+        self.state = state
+        if "output" in fields:
+            self.output = fields["output"]
+        if state not in _OPEN_STATES:
+            self.journal._live.discard(self.id)
+        self.journal._append({"id": self.id, "op": "state", "state": state, **fields})
+
+    def inflight(self):
+        self._set("inflight")
+
+    def saving(self, output: str):
+        """出力を確定する直前（この後クラッシュしても出力があれば完了扱い）"""
+        self._set("saving", output=output)
+
+    def done(self, output: str):
+        self._set("done", output=output)
+        self.journal._release(self)
+
+    def failed(self, message: str):
+        self._set("error", error=message)
+        self.journal._release(self)
+
+    def cancelled(self):
+        self._set("cancelled")
+        self.journal._release(self)
+
+
+class JobJournal:
+    """ジョブの入力・状態・出力を追記専用の JSONL に記録し、クラッシュ後に未完了分を再開できるようにする
+
+    各行は {"id", "op": "add" | "state" | "owner", ...}。読み込み時は id ごとに最後の状態を採用する。
+    追記は行単位で fsync するため、途中で落ちても壊れるのは最後の 1 行だけ（読み込み時に無視する）。
+    入力画像は spill() / spill_file() でジャーナルのフォルダに複製して参照する（次の実行で上書きされても再開できる）。
+
+    同じフォルダを複数の Blender が共有してもよい。ジョブには実行中のインスタンス（owner）を記録し、
+    各インスタンスは owners/<owner>.lock を生きている間ロックし続ける。ロックを取れる（= 持ち主が終了した）
+    ジョブだけを claim() / unfinished() の対象にする。追記・claim・compact はフォルダ単位のロックで排他する。
+    """
+
+    def __init__(self, path_dir: str):
+        self.dir = path_dir
+        self.path = os.path.join(path_dir, JOURNAL_NAME)
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.RLock()
+        self._depth = 0        # _locked() の入れ子の深さ
+        self._entries = None   # id -> JobEntry（読み込み順）
+        self._stamp = None     # 読み込んだ時点のファイルの (mtime, size)
+        self._live = set()     # このプロセスで実行中のジョブ id
+        self._owner_file = None
+
+    @contextmanager
+    def _locked(self):
+        """プロセス内のロックに加え、同じフォルダを使う他のインスタンスとも排他する（入れ子可）"""
+        with self._lock:
+            f = None
+            if self._depth == 0:
+                try:
+                    os.makedirs(self.dir, exist_ok=True)
+                    f = open(self.path + ".lock", "a+b")
+                    _lock_file(f)
+                except OSError as e:
+                    # ロックできなくても記録は続ける（単一インスタンスなら問題にならない）
+                    print(f"[Monkey Banana] ジャーナルをロックできません: {e}")
+                    if f is not None:
+                        f.close()
+                        f = None
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if f is not None:
+                    _unlock_file(f)
+                    f.close()
+
+    def _owner_path(self, owner: str) -> str:
+        return os.path.join(self.dir, SPILL_DIR, OWNER_DIR, owner + ".lock")
+
+    def _hold_owner(self):
+        """このインスタンスの所有ロックを取り、プロセスが生きている間持ち続ける"""
+        if self._owner_file is not None:
+            return
+        path = self._owner_path(self.owner)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        f = open(path, "w+b")
+        _lock_file(f)
+        f.write(str(os.getpid()).encode("ascii"))
+        f.flush()
+        self._owner_file = f
+
+    def _held_elsewhere(self, owner: str, reap: bool = False) -> bool:
+        """他の実行中インスタンスが持っているジョブか（持ち主が終了していればロックが取れる）
+
+        reap=True なら終了したインスタンスのロックファイルを削除する（claim / compact からのみ）。
+        """
+        if not owner or owner == self.owner:
+            return False
+        path = self._owner_path(owner)
+        try:
+            f = open(path, "r+b")
+        except OSError:
+            return False
+        with f:
+            if not _lock_file(f, blocking=False):
+                return True
+            _unlock_file(f)
+        if reap:
+            self._remove_owner(path)
+        return False
+
+    @staticmethod
+    def _remove_owner(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _reap_owners(self):
+        """終了したインスタンスが残したロックファイルを削除"""
+        owners = os.path.join(self.dir, SPILL_DIR, OWNER_DIR)
+        try:
+            names = os.listdir(owners)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(".lock"):
+                self._held_elsewhere(name[:-5], reap=True)
+
+    def close(self):
+        """所有ロックを手放す（以降このインスタンスの未完了ジョブは他から再開できる）"""
+        with self._lock:
+            f, self._owner_file = self._owner_file, None
+        if f is None:
+            return
+        f.close()
+        try:
+            os.remove(self._owner_path(self.owner))
+        except OSError:
+            pass
+
+    def _load(self):
+        """ファイルが変わっていれば読み直す（他のインスタンスの追記も反映する）"""
+        try:
+            st = os.stat(self.path)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        if self._entries is not None and stamp == self._stamp:
+            return
+        old = self._entries or {}
+        entries = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            lines = []
+        for line in lines:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # 書きかけの行
+            job_id = rec.get("id")
+            if job_id in self._live:
+                # 実行中のジョブはメモリ上の状態が正（ワーカーが参照しているオブジェクトを使い続ける）
+                if job_id in old:
+                    entries[job_id] = old[job_id]
+                continue
+            if rec.get("op") == "add":
+                entries[job_id] = JobEntry(self, job_id, rec["job"], owner=rec.get("owner", ""))
+            elif job_id in entries:
+                entry = entries[job_id]
+                entry.state = rec.get("state", entry.state)
+                entry.output = rec.get("output", entry.output)
+                entry.owner = rec.get("owner", entry.owner)
+        for job_id in self._live:
+            if job_id in old:
+                entries.setdefault(job_id, old[job_id])
+        self._entries = entries
+        self._stamp = stamp
+
+    def _append(self, rec: dict) -> bool:
+        """1 行追記して fsync（書けなくてもジョブ自体は止めない）"""
+        rec["t"] = round(time.time(), 3)
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        with self._locked():
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                print(f"[Monkey Banana] ジャーナルに書き込めません: {e}")
+                return False
+        return True
+
+    def _release(self, entry: JobEntry):
+        """完了したジョブの退避ファイルを削除"""
+        spilled = entry.job.get("spilled")
+        if spilled and os.path.isfile(spilled):
+            try:
+                os.remove(spilled)
+            except OSError:
+                pass
+
+    def _spill_path(self, ext: str) -> str:
+        spill_dir = os.path.join(self.dir, SPILL_DIR)
+        os.makedirs(spill_dir, exist_ok=True)
+        return os.path.join(spill_dir, uuid.uuid4().hex + ext)
+
+    def spill(self, data: bytes, ext: str) -> str:
+        """メモリ上の入力画像を退避して、そのパスを返す"""
+        path = self._spill_path(ext)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def spill_file(self, src: str, ext: str) -> str:
+        """入力画像のファイルを退避して、そのパスを返す（メモリに読み込まずに複製する）"""
+        path = self._spill_path(ext)
+        shutil.copyfile(src, path)
+        return path
+
+    def add(self, job: dict) -> JobEntry:
+        """ジョブを pending として記録（このプロセスで実行中として扱う）"""
+        job_id = uuid.uuid4().hex[:12]
+        try:
+            self._hold_owner()
+        except OSError as e:
+            print(f"[Monkey Banana] ジャーナルの所有ロックを取れません: {e}")
+        with self._lock:
+            self._load()
+        self._append({"id": job_id, "op": "add", "job": job, "owner": self.owner})
+        entry = JobEntry(self, job_id, job, owner=self.owner)
+        with self._lock:
+            self._entries[job_id] = entry
+            self._live.add(job_id)
+        return entry
+
+    @property
+    def live(self) -> int:
+        """このプロセスで実行中のジョブ数"""
+        return len(self._live)
+
+    def _candidates(self, reap: bool = False) -> list:
+        self._load()
+        return [e for e in self._entries.values()
+                if e.state in _OPEN_STATES and e.id not in self._live and not self._held_elsewhere(e.owner, reap)]
+
+    def unfinished(self) -> list:
+        """再開すべきジョブ（ファイルは書き換えない。出力まで確定していたものと、他の実行中インスタンスのものは除く）
+
+        ジャーナルを読み直すため、パネルの描画からは呼ばずにタイマーで数える。
+        """
+        with self._lock:
+            entries = self._candidates()
+        return [e for e in entries if not _saved(e)]
+
+    def claim(self) -> list:
+        """未完了のジョブを取り出し、このインスタンスを持ち主として記録する（二重の再投入を防ぐ）
+
+        出力まで確定していたジョブはここで done を記録する。
+        """
+        try:
+            self._hold_owner()
+        except OSError as e:
+            print(f"[Monkey Banana] ジャーナルの所有ロックを取れません: {e}")
+        result = []
+        with self._locked():
+            for e in self._candidates(reap=True):
+                if _saved(e):
+                    e.done(e.output)
+                    continue
+                e.owner = self.owner
+                self._append({"id": e.id, "op": "owner", "owner": self.owner})
+                self._live.add(e.id)
+                result.append(e)
+        return result
+
+    def compact(self):
+        """未完了のジョブだけを残してジャーナルを書き直す（他のインスタンスの実行中ジョブも残す）"""
+        with self._locked():
+            self._reap_owners()
+            self._load()
+            keep = [e for e in self._entries.values() if e.state in _OPEN_STATES]
+            if len(keep) == len(self._entries):
+                return
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    for e in keep:
+                        rec = {"id": e.id, "op": "add", "job": e.job, "owner": e.owner}
+                        f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                        if e.state != "pending":
+                            rec = {"id": e.id, "op": "state", "state": e.state, "output": e.output}
+                            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except OSError:
+                return
+            self._entries = {e.id: e for e in keep}
+            self._stamp = None
@@ -0,0 +1,92 @@
+import os, queue, threading
+
+LOG_NAME = "mb_log.txt"
+
+
+class LogWriter:
+    """ログ行をキューに積み、バックグラウンドスレッドでまとめて追記するファイルライタ
+
+    出力先フォルダ・ファイルごとに 1 回だけ開いて書き込み、max_bytes を超えたら
+    mb_log.txt → mb_log.1.txt → … → mb_log.<backups>.txt とローテーションする。
+    name を指定すると同じフォルダの別ファイル（テレメトリの JSONL 等）に書ける。
+    """
+
+    def __init__(self, max_bytes: int = 5 * 1024 * 1024, backups: int = 3, flush_interval: float = 0.5, batch_size: int = 256):
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._known_dirs = set()
+
+    def write(self, path_dir: str, line: str, name: str = LOG_NAME):
+        self._queue.put((path_dir, name, line))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="mb_log", daemon=True)
+                    self._thread.start()
+
+    def flush(self, timeout: float = None):
+        """キュー済みの行がすべて書き込まれるまで待つ"""
+        if self._thread is not None:
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait(timeout)
+
+    def close(self, timeout: float = 2.0):
+        if self._thread is not None:
+            self.flush(timeout)
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch, waiters, stop = [], [], False
+            while True:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=self.flush_interval if batch else 0)
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+            for w in waiters:
+                w.set()
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        by_file = {}
+        for path_dir, name, line in batch:
+            by_file.setdefault((path_dir, name), []).append(line)
+        for (path_dir, name), lines in by_file.items():
+            try:
+                if path_dir not in self._known_dirs:
+                    os.makedirs(path_dir, exist_ok=True)
+                    self._known_dirs.add(path_dir)
+                path = os.path.join(path_dir, name)
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                    size = f.tell()
+                if size > self.max_bytes:
+                    self._rotate(path)
+            except Exception:
+                pass
+
+    def _rotate(self, path: str):
+        base, ext = os.path.splitext(path)
+        for i in range(self.backups, 0, -1):
+            src = path if i == 1 else f"{base}.{i - 1}{ext}"
+            if os.path.exists(src):
+                os.replace(src, f"{base}.{i}{ext}")
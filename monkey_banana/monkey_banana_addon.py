@@ -1,11 +1,22 @@
-import bpy, os, json, base64, datetime, threading, queue, re
-from urllib.request import Request, urlopen
-from urllib.error import URLError, HTTPError
-from bpy.props import StringProperty, BoolProperty, EnumProperty, PointerProperty
+import bpy, bpy.utils.previews, os, re, datetime, json, math, random, shutil, sqlite3, threading, queue, tempfile, time
+from collections import deque
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from bpy.props import StringProperty, BoolProperty, EnumProperty, PointerProperty, IntProperty, FloatProperty
 from bpy.types import Operator, Panel, PropertyGroup
+from bpy.app.handlers import persistent
 from bpy.app.translations import pgettext_iface as _
-
-API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-image-preview:generateContent"
+from bpy_extras.object_utils import world_to_camera_view
+from mathutils import Vector
+from .api import INFLIGHT, REF_CACHE, InlineImage, _guess_mime, _run_monkey_banana, set_endpoint
+from . import imaging
+from .cache import ResultCache
+from .history import THUMB_BLENDER, THUMB_FAILED, THUMB_SIZE, HistoryDB, prompt_hash
+from .journal import JobJournal, JobEntry
+from .logwriter import LogWriter
+from .telemetry import JobTrace, TelemetryLog, TELEMETRY_NAME, format_stages
+from .versioning import reserve_path, reserve_version_path
+from .transport import KEYS, POOL, SCHEDULER, Cancelled, CancelToken, Timeouts
 
 
 # =========================================================
@@ -27,20 +38,29 @@ def _rel(path: str) -> str:
         return abs_path
 
 
-def _update_to_rel(attr: str):
-    """Create update callback that converts a path property to relative."""
+def _update_to_rel(attr: str, warm: bool = False):
+    """Create update callback that converts a path property to relative.
+
+    With ``warm``, the referenced image is pre-encoded in the background.
+    """
     def updater(self, _ctx):
         p = getattr(self, attr)
         if p:
             new = _rel(p)
             if new != p:
-                setattr(self, attr, new)
+                setattr(self, attr, new)  # updater が再度呼ばれる
+            elif warm:
+                REF_CACHE.warm(_abs(p))
     return updater
 
 
 # =========================================================
 # Scene Properties
 # =========================================================
+# generationConfig.seed は int32。起点 + (候補数 - 1) が収まる範囲から選ぶ
+SEED_MAX = 2 ** 31 - 8
+
+
 class MBProps(PropertyGroup):
     api_key: StringProperty(
         name="Gemini API Key",
@@ -48,6 +68,11 @@ class MBProps(PropertyGroup):
         subtype='PASSWORD',
         default="",
     )
+    api_keys_text: PointerProperty(
+        name="API Key Pool",
+        description="追加のAPIキー（1行に「キー」または「キー URL」、# 以降はコメント）。リクエストは最も空いているキーに振り分ける",
+        type=bpy.types.Text,
+    )
     # モード（手動UIの見た目用）
     mode: EnumProperty(
         name="Mode",
@@ -72,14 +97,14 @@ class MBProps(PropertyGroup):
         description="色/背景/質感など参照画像（任意）",
         default="",
         subtype='FILE_PATH',
-        update=_update_to_rel("input_path_b")
+        update=_update_to_rel("input_path_b", warm=True)
     )
     input_path_c: StringProperty(
         name="Ref 2 (optional)",
         description="追加の参照画像（任意）",
         default="",
         subtype='FILE_PATH',
-        update=_update_to_rel("input_path_c")
+        update=_update_to_rel("input_path_c", warm=True)
     )
 
     # 手動実行
@@ -96,6 +121,235 @@ class MBProps(PropertyGroup):
         update=_update_to_rel("output_path")
     )
 
+    # バッチ（アニメーション）
+    batch_frames: StringProperty(
+        name="Frames",
+        description="処理するフレーム（例: 1-10, 15）。未指定ならシーンのフレーム範囲",
+        default="",
+    )
+    batch_concurrency: IntProperty(
+        name="Concurrency",
+        description="同時に実行するAPIリクエスト数",
+        default=4,
+        min=1,
+        max=16,
+    )
+    batch_skip_static: BoolProperty(
+        name="Skip Static Frames",
+        description="直前に送信したフレームとの差が小さいフレームはAPIを呼ばず、その結果を使い回す",
+        default=False
+    )
+    batch_skip_threshold: FloatProperty(
+        name="Difference Threshold (%)",
+        description="縮小した輝度の平均差（%）がこの値未満なら静止フレームとみなす",
+        default=1.0,
+        min=0.0,
+        max=100.0,
+        precision=2,
+    )
+
+    # 結果キャッシュ
+    use_cache: BoolProperty(
+        name="Use Result Cache",
+        description="同一のプロンプト・画像での再実行はAPIを呼ばずキャッシュ結果を使う",
+        default=True
+    )
+    cache_dir: StringProperty(
+        name="Cache Dir",
+        description="結果キャッシュの保存先（未指定なら //mb_cache ）",
+        default="",
+        subtype='DIR_PATH',
+        update=_update_to_rel("cache_dir")
+    )
+    cache_max_mb: IntProperty(
+        name="Cache Size (MB)",
+        description="結果キャッシュの容量上限。超えると古いものから削除",
+        default=512,
+        min=16,
+    )
+
+    # タイル
+    tile_size: IntProperty(
+        name="Tile Size",
+        description="タイル1枚の一辺（px）。モデルの実効解像度（1024px前後）が目安",
+        default=1024,
+        min=256,
+        max=4096,
+    )
+    tile_overlap: IntProperty(
+        name="Tile Overlap",
+        description="隣接タイルの重なり幅（px）。この範囲で継ぎ目をぼかして合成",
+        default=128,
+        min=0,
+        max=1024,
+    )
+
+    # 部分編集（ROI）
+    roi_source: EnumProperty(
+        name="Region",
+        description="送信する範囲の決め方",
+        items=[
+            ('BORDER', "Render Border", "レンダ境界（Ctrl+B）の範囲"),
+            ('OBJECT', "Active Object", "アクティブオブジェクトのカメラ上の外接矩形"),
+            ('MASK', "Mask Image", "マスク画像の明るい部分（輝度 × アルファ）"),
+        ],
+        default='BORDER'
+    )
+    roi_mask_path: StringProperty(
+        name="Mask Image",
+        description="部分編集のマスク画像（白が編集範囲。レンダと同じ縦横比）",
+        default="",
+        subtype='FILE_PATH',
+        update=_update_to_rel("roi_mask_path")
+    )
+    roi_padding: IntProperty(
+        name="Region Padding",
+        description="範囲の周囲に含める余白（px）。周辺の文脈をモデルに渡す",
+        default=64,
+        min=0,
+        max=1024,
+    )
+    roi_feather: IntProperty(
+        name="Region Feather",
+        description="合成時に範囲の縁をぼかす幅（px）",
+        default=32,
+        min=0,
+        max=512,
+    )
+
+    # バリエーション
+    variant_split: BoolProperty(
+        name="Split Prompt by Paragraph",
+        description="プロンプトテキストを空行で区切り、段落ごとに別のバリエーションとして送信",
+        default=True
+    )
+    variant_count: IntProperty(
+        name="Candidates per Prompt",
+        description="各プロンプトで生成する候補数（2以上なら seed を変えて送信）",
+        default=1,
+        min=1,
+        max=8,
+    )
+    variant_seed: IntProperty(
+        name="Base Seed",
+        description="候補の seed の起点（候補 c は起点 + c）。0 なら実行ごとにランダム。気に入った候補の seed を入れ、候補数 1 で再現できる",
+        default=0,
+        min=0,
+        max=SEED_MAX,
+    )
+    variant_last_seed: IntProperty(
+        name="Last Base Seed",
+        description="直前のバリエーション実行で使った seed の起点",
+        default=0,
+        min=0,
+    )
+    variant_thumb: IntProperty(
+        name="Sheet Thumbnail",
+        description="コンタクトシートの1枚あたりの幅（px）",
+        default=384,
+        min=64,
+        max=2048,
+    )
+
+    # アップロード画像
+    render_in_memory: BoolProperty(
+        name="In-Memory Handoff",
+        description="レンダ結果をベース画像ファイルに書き出さず、アップロード用エンコードのみをメモリで渡す",
+        default=False
+    )
+    upload_format: EnumProperty(
+        name="Upload Format",
+        description="APIへ送るベース画像のエンコード形式",
+        items=[
+            ('SOURCE', "As Rendered", "レンダ出力設定のまま送る"),
+            ('PNG', "PNG", "可逆圧縮"),
+            ('JPEG', "JPEG", "非可逆（品質指定）"),
+            ('WEBP', "WebP", "非可逆（品質指定）"),
+        ],
+        default='SOURCE'
+    )
+    upload_quality: IntProperty(
+        name="Upload Quality",
+        description="JPEG/WebP の品質",
+        default=90,
+        min=1,
+        max=100,
+    )
+    upload_max_edge: IntProperty(
+        name="Max Long Edge",
+        description="アップロード前に長辺をこのピクセル数まで縮小（0で無効。モデルは1024px前後で処理）",
+        default=0,
+        min=0,
+        max=16384,
+    )
+
+    # 通信
+    pool_size: IntProperty(
+        name="Connection Pool Size",
+        description="再利用のために保持する keep-alive 接続の最大数（バッチの同時実行数以上を推奨）",
+        default=4,
+        min=1,
+        max=32,
+    )
+    api_url: StringProperty(
+        name="API URL",
+        description="generateContent のエンドポイント（空なら既定。ローカルのモックサーバで計測する場合などに指定）",
+        default=""
+    )
+    use_streaming: BoolProperty(
+        name="Streaming (SSE)",
+        description="streamGenerateContent（SSE）で受信し、送信/初回応答/受信の進捗を表示",
+        default=False
+    )
+    rate_limit_rpm: IntProperty(
+        name="Requests / Minute",
+        description="キーごとの1分あたりのリクエスト上限（0で無制限）。プロジェクトのクォータに合わせる",
+        default=0,
+        min=0,
+    )
+    max_inflight: IntProperty(
+        name="Max In-Flight",
+        description="同時に送信中にできるリクエスト数の上限",
+        default=4,
+        min=1,
+        max=32,
+    )
+    max_retries: IntProperty(
+        name="Max Retries",
+        description="429/5xx・接続エラー時の再試行回数（Retry-After を尊重し指数バックオフ）",
+        default=5,
+        min=0,
+        max=20,
+    )
+    connect_timeout: FloatProperty(
+        name="Connect Timeout (s)",
+        description="接続の確立（TLS を含む）を待つ時間",
+        default=10.0,
+        min=1.0,
+        max=120.0,
+    )
+    upload_timeout: FloatProperty(
+        name="Upload Stall Timeout (s)",
+        description="送信が進まない状態をこの時間まで待つ（送信全体の上限ではない）",
+        default=60.0,
+        min=1.0,
+        max=600.0,
+    )
+    first_byte_timeout: FloatProperty(
+        name="First Byte Timeout (s)",
+        description="送信完了から応答が返り始めるまで（サーバの生成時間）を待つ時間",
+        default=120.0,
+        min=1.0,
+        max=600.0,
+    )
+    read_timeout: FloatProperty(
+        name="Read Stall Timeout (s)",
+        description="受信が進まない状態をこの時間まで待つ（受信全体の上限ではない）",
+        default=60.0,
+        min=1.0,
+        max=600.0,
+    )
+
     # ログ設定・状態
     verbose: BoolProperty(
         name="Verbose (Console + Text + File)",
@@ -119,6 +373,40 @@ class MBProps(PropertyGroup):
         subtype='DIR_PATH',
         update=_update_to_rel("log_dir")
     )
+    use_telemetry: BoolProperty(
+        name="Telemetry (JSONL)",
+        description="ジョブごとの段階別所要時間とサイズを mb_log.txt と同じフォルダの mb_telemetry.jsonl に記録",
+        default=True
+    )
+
+    # 履歴
+    use_history: BoolProperty(
+        name="Record History (SQLite)",
+        description="すべての実行（入力・プロンプトのハッシュ・所要時間・出力先）を mb_log.txt と同じフォルダの mb_history.sqlite に記録",
+        default=True
+    )
+    history_filter: StringProperty(
+        name="Search",
+        description="出力パスまたはプロンプトの部分一致で絞り込む",
+        default="",
+    )
+    history_page: IntProperty(
+        name="Page",
+        default=0,
+        min=0,
+    )
+
+    # ジョブジャーナル
+    use_journal: BoolProperty(
+        name="Record Jobs (JSONL)",
+        description="送信するジョブの入力・状態・出力を mb_log.txt と同じフォルダの mb_jobs.jsonl に記録し、クラッシュ後に再開できるようにする",
+        default=True
+    )
+    auto_resume: BoolProperty(
+        name="Resume on Load",
+        description="ファイルを開いたときにジャーナルに残った未完了ジョブを自動で再実行する（完了済みのジョブは再送しない）",
+        default=True
+    )
 
 # =========================================================
 # Helpers（ログ）
@@ -126,20 +414,38 @@ class MBProps(PropertyGroup):
 def _now():
     return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+_LOG_WRITER = LogWriter()
+
+# テキストブロックは直近 _TEXT_LOG_LINES 行だけを保持（.blend の肥大化を防ぐ）
+_TEXT_LOG_LINES = 500
+_TEXT_RING = deque(maxlen=_TEXT_LOG_LINES)
+_text_state = {"pending": 0, "ptr": None}
+
 def _log_write_to_textblock(line: str):
     name = "MonkeyBananaLog"
     txt = bpy.data.texts.get(name) or bpy.data.texts.new(name)
-    txt.write(line + "\n")
+    if _text_state["ptr"] != txt.as_pointer():
+        # 別のテキスト（ファイル読み込み後など）なら既存の末尾からリングを作り直す
+        _TEXT_RING.clear()
+        _TEXT_RING.extend(l.body for l in txt.lines if l.body)
+        _text_state["ptr"] = txt.as_pointer()
+        _text_state["pending"] = _TEXT_LOG_LINES
+    _TEXT_RING.append(line)
+    _text_state["pending"] += 1
+    if _text_state["pending"] > _TEXT_LOG_LINES:
+        # 上限の 2 倍に達したら直近分だけに書き換える（毎行の全書き換えは避ける）
+        txt.from_string("\n".join(_TEXT_RING) + "\n")
+        _text_state["pending"] = 0
+    else:
+        txt.write(line + "\n")
+
+def _log_dir(props) -> str:
+    return bpy.path.abspath(props.log_dir) if props.log_dir else bpy.path.abspath("//mb_out")
 
 def _log_write_to_file(path_dir: str, line: str):
-    try:
-        if not path_dir:
-            path_dir = bpy.path.abspath("//mb_out")
-        os.makedirs(path_dir, exist_ok=True)
-        with open(os.path.join(path_dir, "mb_log.txt"), "a", encoding="utf-8") as f:
-            f.write(line + "\n")
-    except Exception:
-        pass
+    if not path_dir:
+        path_dir = bpy.path.abspath("//mb_out")
+    _LOG_WRITER.write(path_dir, line)
 
 def mb_log(scene, level: str, msg: str):
     """Console + Scene Props + Text + File に出力"""
@@ -159,128 +465,807 @@ def mb_log(scene, level: str, msg: str):
     except Exception:
         pass
 
+_TELEMETRY = TelemetryLog()
+
+def _finish_trace(scene, trace: JobTrace, status: str, **fields):
+    """ジョブの計測を確定し、有効なら mb_log.txt と同じフォルダの JSONL と履歴 DB に追記"""
+    if trace is None:
+        return
+    rec = _TELEMETRY.finish(trace, status, **fields)
+    try:
+        p = scene.mb_props
+        if p.use_telemetry:
+            _LOG_WRITER.write(_log_dir(p), _TELEMETRY.dumps(rec), TELEMETRY_NAME)
+        history = _history(p)
+        if history is not None:
+            history.add(rec)
+            _schedule_history()
+        if p.use_journal:
+            _schedule_journal()
+    except Exception:
+        pass
+
 # =========================================================
-# Helpers（API/入出力）
+# Helpers（履歴）
 # =========================================================
-def _file_to_b64(path):
-    with open(path, "rb") as f:
-        return base64.b64encode(f.read()).decode("ascii")
+_HISTORY = None
+_HISTORY_VIEW = None    # パネルに出す履歴のページ（_history_tick で更新）
+_HISTORY_PAGE = 9       # 1 ページの件数（3 列）
+_PREVIEW_LIMIT = 200    # これを超えたらプレビューを読み込み直す
+_PREVIEWS = None        # bpy.utils.previews のコレクション（登録時に作成）
+
+def _history(props):
+    """設定に応じた履歴 DB（無効なら None）。ログと同じフォルダに置く"""
+    global _HISTORY
+    if not props.use_history:
+        return None
+    path_dir = _log_dir(props)
+    if _HISTORY is None or _HISTORY.dir != path_dir:
+        if _HISTORY is not None:
+            _HISTORY.close()
+        _HISTORY = HistoryDB(path_dir)
+    return _HISTORY
+
+def _trace_inputs(props, trace: JobTrace, prompt: str, render: str, ref1: str = "", ref2: str = ""):
+    """履歴に残す入力（レンダ・参照・プロンプトのハッシュ）をトレースに記録"""
+    h = prompt_hash(prompt)
+    try:
+        history = _history(props)
+        if history is not None:
+            history.add_prompt(prompt)
+    except sqlite3.Error:
+        pass
+    trace.set(render=render, refs=[r for r in (ref1, ref2) if r], prompt_hash=h)
+
+def _history_key(props) -> tuple:
+    """表示中の履歴ページを決める設定（変わったら _HISTORY_VIEW を作り直す）"""
+    return (props.use_history, _log_dir(props), props.history_filter, props.history_page)
 
-def _guess_mime(path):
-    p = path.lower()
-    if p.endswith(".png"):  return "image/png"
-    if p.endswith(".jpg") or p.endswith(".jpeg"): return "image/jpeg"
-    return "image/png"
+def _schedule_history():
+    """履歴の表示内容の更新を予約（メインスレッドから呼ぶ）"""
+    if not bpy.app.timers.is_registered(_history_tick):
+        bpy.app.timers.register(_history_tick, first_interval=0.0)
 
+def _tag_redraw():
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'IMAGE_EDITOR':
+                area.tag_redraw()
+
+def _blender_thumbnail(history: HistoryDB) -> bool:
+    """ワーカーでデコードできなかった出力のサムネイルを Blender で 1 件作る（まだ残っていれば True）"""
+    try:
+        todo = history.deferred(2)
+    except sqlite3.Error:
+        return False
+    if not todo:
+        return False
+    run_id, output = todo[0]
+    dest, thumb = history.thumb_path(run_id), THUMB_FAILED
+    try:
+        img = bpy.data.images.load(output, check_existing=False)
+        try:
+            w, h = img.size
+            s = THUMB_SIZE / max(w, h, 1)
+            img.scale(max(1, round(w * s)), max(1, round(h * s)))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            img.filepath_raw = dest
+            img.file_format = 'PNG'
+            img.save()
+            thumb = dest
+        finally:
+            bpy.data.images.remove(img)
+    except Exception as e:
+        print(f"[Monkey Banana] サムネイルを作成できません: {output}: {e}")
+    history.set_thumb(run_id, thumb)
+    return len(todo) > 1
+
+def _history_tick():
+    """パネルに出す履歴のページを読み直し、足りないサムネイルの作成を進める
+
+    描画のたびに DB を開かないよう、表示内容は _HISTORY_VIEW に置いてタイマーと操作からだけ更新する。
+    サムネイルの作成中は 0.5 秒ごとに繰り返し、終われば止まる。
+    """
+    global _HISTORY_VIEW
+    scene = bpy.context.scene
+    if scene is None:
+        return None
+    p = scene.mb_props
+    view = {"key": _history_key(p), "total": 0, "pages": 1, "page": 0, "rows": [], "error": ""}
+    history = _history(p)
+    busy = False
+    if history is not None:
+        busy = _blender_thumbnail(history)
+        try:
+            view["total"] = history.count(p.history_filter)
+            view["pages"] = max(1, math.ceil(view["total"] / _HISTORY_PAGE))
+            view["page"] = min(p.history_page, view["pages"] - 1)
+            view["rows"] = history.page(view["page"] * _HISTORY_PAGE, _HISTORY_PAGE, p.history_filter)
+        except sqlite3.Error as e:
+            view["error"] = str(e)
+        for r in view["rows"]:
+            # 以前の版は出力そのものを thumb にしていたので、作り直す
+            if r["output"] and r["thumb"] in ("", r["output"]) and os.path.isfile(r["output"]):
+                history.request_thumbnail(r["id"], r["output"])
+        busy = busy or history.pending > 0
+    _HISTORY_VIEW = view
+    _tag_redraw()
+    return 0.5 if busy else None
+
+def _history_icon(row: dict) -> int:
+    """履歴 1 件のサムネイルのアイコン ID（未作成・作成失敗なら 0）"""
+    thumb = row["thumb"]
+    if _PREVIEWS is None or thumb in ("", THUMB_BLENDER, THUMB_FAILED) or thumb == row["output"]:
+        return 0
+    if thumb not in _PREVIEWS:
+        _PREVIEWS.load(thumb, thumb, 'IMAGE')
+    return _PREVIEWS[thumb].icon_id
+
+# =========================================================
+# Helpers（API/入出力）
+# =========================================================
 def _ensure_dir(path_dir: str):
     if path_dir:
         os.makedirs(path_dir, exist_ok=True)
 
-def _next_version_number(path_dir: str, prefix: str, ext: str) -> int:
-    pattern = re.compile(rf"^{re.escape(prefix)}_(\d+){re.escape(ext)}$")
-    max_n = 0
-    if os.path.isdir(path_dir):
-        for name in os.listdir(path_dir):
-            m = pattern.match(name)
-            if m:
-                max_n = max(max_n, int(m.group(1)))
-    return max_n + 1
-
 def _next_version_path(path: str) -> str:
+    """次の連番パスを予約して返す（空ファイルとして作成済み）"""
+    return reserve_version_path(path)
+
+def _frame_path(path: str, frame: int) -> str:
+    """path の拡張子の前にフレーム番号（4桁）を付与"""
     base, ext = os.path.splitext(path)
-    dir_path = os.path.dirname(path) or "."
-    prefix = os.path.basename(base)
-    n = _next_version_number(dir_path, prefix, ext)
-    return os.path.join(dir_path, f"{prefix}_{n:02d}{ext}")
-
-def _api_call(api_key: str, body: dict) -> dict:
-    req = Request(
-        API_URL,
-        data=json.dumps(body).encode("utf-8"),
-        headers={
-            "Content-Type": "application/json",
-            "x-goog-api-key": api_key.strip(),
-        }
-    )
-    with urlopen(req, timeout=180) as r:
-        return json.loads(r.read().decode("utf-8"))
+    return f"{base}_{frame:04d}{ext}"
 
-def _extract_image_b64(res: dict) -> str:
+def _frame_output_path(path: str, frame: int) -> str:
+    """フレームの出力パス（mb_out_f0001.png）。連番（mb_out_NN.png）の採番に数えられないよう f を付ける"""
+    base, ext = os.path.splitext(path)
+    return f"{base}_f{frame:04d}{ext}"
+
+class _OutputTarget:
+    """ワーカーが結果を書き出す先。受信中は一時ファイルに書き、成功後に確定パスへ移す
+
+    frame を指定するとフレーム番号付きパス（既にあれば別の連番）、しなければ次の連番パスを確定時に予約する。
+    """
+
+    def __init__(self, base: str, frame: int = None):
+        self.base = base
+        self.frame = frame
+
+    def part_path(self) -> str:
+        path = self.base if self.frame is None else _frame_output_path(self.base, self.frame)
+        return f"{path}.{threading.get_ident()}.part"
+
+    def final_path(self) -> str:
+        if self.frame is None:
+            return _next_version_path(self.base)
+        # バッチを再実行しても以前のフレームは置き換えない
+        return reserve_path(_frame_output_path(self.base, self.frame))
+
+def _split_prompts(text: str) -> list:
+    """空行で区切られた段落をそれぞれ 1 つのプロンプトとして返す（段落がなければ全体を 1 つ）"""
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text)]
+    return [p for p in paragraphs if p] or [text]
+
+def _parse_frames(spec: str) -> list:
+    """'1-10, 15' 形式のフレーム指定を昇順のリストに変換（不正な指定は ValueError）"""
+    frames = set()
+    for tok in spec.replace(" ", "").split(","):
+        if not tok:
+            continue
+        sep = tok.find("-", 1)
+        if sep > 0:
+            a, b = int(tok[:sep]), int(tok[sep + 1:])
+            frames.update(range(min(a, b), max(a, b) + 1))
+        else:
+            frames.add(int(tok))
+    return sorted(frames)
+
+def _resolve_out_base(props, in_a: str) -> str:
+    """出力設定から保存先のベースパス（mb_out.png 等）を決定"""
+    out_path = _abs(props.output_path).strip()
+    if not out_path:
+        base_dir = os.path.dirname(in_a) if os.path.dirname(in_a) else bpy.path.abspath("//")
+        out_dir = base_dir; os.makedirs(out_dir, exist_ok=True)
+        return os.path.join(out_dir, "mb_out.png")
+    is_dir_like = out_path.endswith(("/", "\\")) or os.path.isdir(out_path) or (os.path.splitext(out_path)[1] == "")
+    if is_dir_like:
+        out_dir = out_path.rstrip("/\\")
+        _ensure_dir(out_dir)
+        return os.path.join(out_dir, "mb_out.png")
+    out_dir = os.path.dirname(out_path) or bpy.path.abspath("//")
+    _ensure_dir(out_dir)
+    return out_path
+
+_UPLOAD_MIME = {'PNG': "image/png", 'JPEG': "image/jpeg", 'WEBP': "image/webp"}
+
+def _encode_upload_image(scene, props, src_path: str = None) -> InlineImage:
+    """レンダ結果（src_path 指定時はそのファイル）をアップロード用にエンコードしメモリ上で返す
+
+    Render Result の画素は Python から直接読めないため、save_render でアップロード形式に
+    一度だけ書き出して読み込む。縮小が必要な場合のみ画像として読み込んで scale する。
+    """
+    settings = scene.render.image_settings
+    fmt = props.upload_format
+    if fmt == 'SOURCE':
+        fmt = settings.file_format if settings.file_format in _UPLOAD_MIME else 'PNG'
+    saved = (settings.file_format, settings.color_mode, settings.quality)
+    fd, tmp = tempfile.mkstemp(prefix="mb_upload_", suffix="." + fmt.lower())
+    os.close(fd)
+    work = None
     try:
-        parts = res["candidates"][0]["content"]["parts"]
-    except Exception:
+        if src_path:
+            work = bpy.data.images.load(src_path, check_existing=False)
+            src_bytes = os.path.getsize(src_path)
+        else:
+            rr = bpy.data.images.get("Render Result")
+            if rr is None or not rr.has_data:
+                raise RuntimeError("Render Result がありません")
+            settings.file_format = 'PNG' if props.upload_max_edge else fmt
+            settings.color_mode = 'RGB' if settings.file_format == 'JPEG' else 'RGBA'
+            settings.quality = props.upload_quality
+            rr.save_render(filepath=tmp, scene=scene)
+            # 縮小・再エンコード前の大きさ（縮小する場合は中間の PNG）
+            src_bytes = os.path.getsize(tmp)
+            if props.upload_max_edge:
+                work = bpy.data.images.load(tmp, check_existing=False)
+        size = tuple(work.size) if work else (scene.render.resolution_x * scene.render.resolution_percentage // 100,
+                                              scene.render.resolution_y * scene.render.resolution_percentage // 100)
+        new_size = size
+        if work is not None:
+            long_edge = max(size)
+            if props.upload_max_edge and long_edge > props.upload_max_edge:
+                s = props.upload_max_edge / long_edge
+                new_size = (max(1, round(size[0] * s)), max(1, round(size[1] * s)))
+                work.scale(*new_size)
+            work.file_format = fmt
+            work.save(filepath=tmp, quality=props.upload_quality)
+        with open(tmp, "rb") as f:
+            data = f.read()
+    finally:
+        settings.file_format, settings.color_mode, settings.quality = saved
+        if work is not None:
+            bpy.data.images.remove(work)
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+    mb_log(scene, "INFO", f"アップロード画像: {size[0]}x{size[1]} → {new_size[0]}x{new_size[1]} {fmt} "
+                          f"{len(data)} bytes（元: {src_bytes} bytes）")
+    return InlineImage(_UPLOAD_MIME[fmt], data=data)
+
+_ACTIVE_RENDER = None  # レンダリング中の _RenderJob（完了/中断の通知はこのジョブにだけ届ける）
+
+def _deliver_render_event(state: str):
+    # MB が開始していないレンダ（F12 など）の通知は無視する
+    if _ACTIVE_RENDER is not None:
+        _ACTIVE_RENDER._events.put(state)
+
+@persistent
+def _on_render_complete(scene, *_args):
+    _deliver_render_event('complete')
+
+@persistent
+def _on_render_cancel(scene, *_args):
+    _deliver_render_event('cancel')
+
+def _render_busy() -> bool:
+    """MB のレンダジョブが完了待ちか（その間は別のレンダ付き操作を開始しない）"""
+    return _ACTIVE_RENDER is not None and _ACTIVE_RENDER.state is None
+
+class _RenderJob:
+    """現在フレームのレンダリングを非同期に開始し、完了を render_complete/render_cancel で受け取る
+
+    poll() は未完了なら None、終了後は 'complete' / 'cancel' / 'failed' を返す。
+    通知は開始したジョブだけが受け取る。別のジョブが完了待ちのときは開始せず 'failed' になる。
+    バックグラウンド起動（-b）ではウィンドウがないため、その場でブロッキングでレンダリングする。
+    """
+
+    def __init__(self, scene, path: str, write: bool = True):
+        global _ACTIVE_RENDER
+        self.scene = scene
+        self.path = path
+        self.state = None
+        self._events = queue.Queue()
+        self._prev = scene.render.filepath
+        if _render_busy():
+            self._done('failed')
+            return
+        if write:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        scene.render.filepath = path
+        _ACTIVE_RENDER = self
+        try:
+            if bpy.app.background:
+                bpy.ops.render.render(write_still=write)
+                self._done('complete')
+            elif 'CANCELLED' in bpy.ops.render.render('INVOKE_DEFAULT', write_still=write):
+                self._done('failed')
+        except RuntimeError:
+            self._done('failed')
+
+    def _done(self, state: str):
+        global _ACTIVE_RENDER
+        self.state = state
+        self.scene.render.filepath = self._prev
+        if _ACTIVE_RENDER is self:
+            _ACTIVE_RENDER = None
+
+    def poll(self):
+        if self.state is None and not self._events.empty():
+            self._done(self._events.get_nowait())
+        return self.state
+
+def _collect_base(scene, props, path: str):
+    """レンダ完了後、ワーカーへ渡すベース画像（パス or InlineImage）を用意する。失敗時は None"""
+    in_memory = props.render_in_memory
+    if not in_memory and not os.path.isfile(path):
+        return None
+    if not in_memory and props.upload_format == 'SOURCE' and not props.upload_max_edge:
+        size = os.path.getsize(path)
+        mb_log(scene, "INFO", f"アップロード画像: {size} bytes（変換なし）")
+        return path
+    try:
+        return _encode_upload_image(scene, props, None if in_memory else path)
+    except Exception as e:
+        mb_log(scene, "ERROR", f"アップロード画像の変換に失敗: {e}")
         return None
-    for part in parts:
-        if "inline_data" in part and "data" in part["inline_data"]:
-            return part["inline_data"]["data"]
-        if "inlineData" in part and "data" in part["inlineData"]:
-            return part["inlineData"]["data"]
-    return None
-
-def _augment_prompt(user_text: str) -> str:
-    guard = (
-        "ゼロからの新規生成は禁止。最後の画像（レンダ）を加工対象とし、"
-        "構図・カメラ・照明・解像度・アスペクト比・被写体の形状を保持。"
-        "参照画像は色味/質感/雰囲気の手掛かりのみとして用いる。"
-    )
-    base = (user_text or "").strip()
-    return (base + ("\n" if base else "") + guard)
-
-def _run_monkey_banana(api_key: str, prompt: str, ref1: str, ref2: str, render_img: str) -> bytes:
-    parts = [{"text": _augment_prompt(prompt)}]
-
-    if ref1 and os.path.isfile(ref1):
-        parts.append({"inline_data": {"mime_type": _guess_mime(ref1), "data": _file_to_b64(ref1)}})
-    if ref2 and os.path.isfile(ref2):
-        parts.append({"inline_data": {"mime_type": _guess_mime(ref2), "data": _file_to_b64(ref2)}})
 
-    if not render_img or not os.path.isfile(render_img):
-        raise FileNotFoundError("Render (Base) Image が見つかりません")
-    parts.append({"inline_data": {"mime_type": _guess_mime(render_img), "data": _file_to_b64(render_img)}})
+def _frame_signature(base) -> np.ndarray:
+    """ベース画像（パス or InlineImage）から比較用の署名を作る（Blender で読み込み、縮小してから取得）"""
+    tmp = None
+    if isinstance(base, InlineImage) and base.data is not None:
+        fd, tmp = tempfile.mkstemp(prefix="mb_sig_", suffix=imaging.image_ext(base.data))
+        with os.fdopen(fd, "wb") as f:
+            f.write(base.data)
+        path = tmp
+    else:
+        path = base.path if isinstance(base, InlineImage) else base
+    img = bpy.data.images.load(path, check_existing=False)
+    try:
+        img.scale(imaging.SIGNATURE_SIZE * 2, imaging.SIGNATURE_SIZE * 2)
+        return imaging.signature(_image_pixels(img))
+    finally:
+        bpy.data.images.remove(img)
+        if tmp:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+def _object_region(scene, obj):
+    """オブジェクトのバウンディングボックスをカメラに投影した正規化矩形 (x0, y0, x1, y1)（左下原点）"""
+    corners = [world_to_camera_view(scene, scene.camera, obj.matrix_world @ Vector(c)) for c in obj.bound_box]
+    front = [c for c in corners if c.z > 0]
+    if not front:
+        return None  # カメラの後ろ
+    xs = [min(max(c.x, 0.0), 1.0) for c in front]
+    ys = [min(max(c.y, 0.0), 1.0) for c in front]
+    if max(xs) <= min(xs) or max(ys) <= min(ys):
+        return None  # 画面外
+    return (min(xs), min(ys), max(xs), max(ys))
+
+def _image_pixels(img) -> np.ndarray:
+    """Image データブロックの画素を (h, w, 4) の float32 配列（下から上の行順）で取得"""
+    w, h = img.size
+    buf = np.empty(w * h * 4, dtype=np.float32)
+    img.pixels.foreach_get(buf)
+    return buf.reshape(h, w, 4)
+
+def _load_image_pixels(path: str, size=None) -> np.ndarray:
+    """画像ファイルを Blender で読み込み画素配列にする（size=(w, h) 指定時はその大きさに拡縮）
+
+    ワーカーでデコードできない形式（JPEG/WebP 等）のときだけメインスレッドで使う。
+    読み込んだデータブロックはすぐに削除する。
+    """
+    img = bpy.data.images.load(path, check_existing=False)
+    try:
+        if size and tuple(img.size) != tuple(size):
+            img.scale(*size)
+        return _image_pixels(img)
+    finally:
+        bpy.data.images.remove(img)
+
+def _decode_image_bytes(data: bytes, size=None) -> np.ndarray:
+    """画像バイト列を一時ファイル経由で Blender に読み込み画素配列にする"""
+    fd, tmp = tempfile.mkstemp(prefix="mb_decode_", suffix=imaging.image_ext(data))
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    try:
+        return _load_image_pixels(tmp, size)
+    finally:
+        os.remove(tmp)
+
+def _decode_result(data: bytes, size=None):
+    """ワーカー用: PNG を Blender の画素順 (h, w, 4) float32 に変換（非対応形式なら None）"""
+    pixels = imaging.decode_png(data)
+    if pixels is None:
+        return None
+    pixels = imaging.to_float_rgba(pixels)
+    if size:
+        pixels = imaging.resize(pixels, *size)
+    return pixels
+
+def _write_pixels_png(pixels: np.ndarray, path: str):
+    """ワーカー用: (h, w, 4) 画素（下から上）を PNG にエンコードして保存"""
+    png = imaging.encode_png(np.ascontiguousarray(imaging.to_uint8(pixels[::-1])))
+    with open(path, "wb") as f:
+        f.write(png)
+
+_PREVIEW_NAME = "MB Result"
+
+def _show_pixels(ctx, pixels: np.ndarray):
+    """結果表示用の Image（1 つを使い回す）に画素を直接書き込んで表示"""
+    h, w = pixels.shape[:2]
+    img = bpy.data.images.get(_PREVIEW_NAME)
+    if img is None:
+        img = bpy.data.images.new(_PREVIEW_NAME, w, h, alpha=True)
+    elif tuple(img.size) != (w, h):
+        img.scale(w, h)
+    img.pixels.foreach_set(np.ascontiguousarray(pixels, dtype=np.float32).ravel())
+    img.update()
+    _show_image(ctx, img)
+    return img
+
+def _show_image(ctx, img):
+    """最初の Image Editor に img を表示して全ウィンドウを再描画"""
+    for area in ctx.screen.areas:
+        if area.type == 'IMAGE_EDITOR':
+            area.spaces.active.image = img
+            area.tag_redraw()
+            break
+    for window in ctx.window_manager.windows:
+        for a in window.screen.areas:
+            a.tag_redraw()
+
+
+def _key_entries(props) -> list:
+    """パネルのキーと API キープールのテキストから (キー, URL) の列を作る（URL が空なら既定の送信先）"""
+    entries = []
+    key = (props.api_key or "").strip()
+    if key:
+        entries.append((key, ""))
+    if props.api_keys_text:
+        for line in props.api_keys_text.as_string().splitlines():
+            fields = line.split("#", 1)[0].split()
+            if fields:
+                entries.append((fields[0], fields[1] if len(fields) > 1 else ""))
+    return entries
+
+def _api_key(props) -> str:
+    """代表の API キー（パネルのキー、なければプールの先頭。未設定なら空文字）"""
+    entries = _key_entries(props)
+    return entries[0][0] if entries else ""
+
+def _configure_transport(props, concurrency: int = 1):
+    """送信先・接続プール・キープール・スケジューラにパネルの設定を反映"""
+    set_endpoint(props.api_url)
+    POOL.max_size = max(props.pool_size, concurrency)
+    entries = _key_entries(props)
+    KEYS.configure(entries, rpm=props.rate_limit_rpm)
+    # 上限はキーごとなので、全体の上限はキー数倍
+    SCHEDULER.configure(rpm=props.rate_limit_rpm * max(len(entries), 1), max_inflight=props.max_inflight, max_retries=props.max_retries)
+    POOL.timeouts = Timeouts(props.connect_timeout, props.upload_timeout, props.first_byte_timeout, props.read_timeout)
+
+
+_RESULT_CACHE = None
+
+def _result_cache(props):
+    """設定に応じた共有結果キャッシュ（無効なら None）"""
+    global _RESULT_CACHE
+    if not props.use_cache:
+        return None
+    root = _abs(props.cache_dir) if props.cache_dir else bpy.path.abspath("//mb_cache")
+    if _RESULT_CACHE is None or _RESULT_CACHE.root != root:
+        _RESULT_CACHE = ResultCache(root, 0)
+    _RESULT_CACHE.max_bytes = props.cache_max_mb * 1024 * 1024
+    return _RESULT_CACHE
 
-    body = {"contents": [{"parts": parts}]}
-    res = _api_call(api_key, body)
 
-    if isinstance(res, dict) and "error" in res:
-        code = res["error"].get("code")
-        status = res["error"].get("status")
-        msg = res["error"].get("message", "Unknown error")
-        raise RuntimeError(f"APIエラー: {code}/{status} {msg}")
+_JOURNAL = None
+_JOURNAL_VIEW = None  # パネルに出す未完了ジョブ数（_journal_tick で更新）
 
-    img_b64 = _extract_image_b64(res)
-    if not img_b64:
-        raise RuntimeError("画像が返りませんでした（プロンプトを簡潔化/保持要素を明記）")
-    return base64.b64decode(img_b64)
+def _job_journal(props):
+    """設定に応じたジョブジャーナル（無効なら None）。ログと同じフォルダに置く"""
+    global _JOURNAL
+    if not props.use_journal:
+        return None
+    path_dir = _log_dir(props)
+    if _JOURNAL is None or _JOURNAL.dir != path_dir:
+        _JOURNAL = JobJournal(path_dir)
+    return _JOURNAL
+
+def _journal_key(props) -> tuple:
+    """未完了ジョブ数を決める設定（変わったら _JOURNAL_VIEW を作り直す）"""
+    return (props.use_journal, _log_dir(props))
+
+def _schedule_journal():
+    """未完了ジョブ数の更新を予約（メインスレッドから呼ぶ）"""
+    if not bpy.app.timers.is_registered(_journal_tick):
+        bpy.app.timers.register(_journal_tick, first_interval=0.0)
+
+def _journal_tick():
+    """未完了ジョブを数え直す（ジャーナルの読み直しを描画のたびに行わない）
+
+    このプロセスで実行中のジョブがなければ、ついでに終わったジョブを消してジャーナルを小さく保つ。
+    """
+    global _JOURNAL_VIEW
+    scene = bpy.context.scene
+    if scene is None:
+        return None
+    p = scene.mb_props
+    view = {"key": _journal_key(p), "unfinished": 0}
+    journal = _job_journal(p)
+    if journal is not None:
+        if not journal.live and not _RESUMER.running:
+            journal.compact()
+        view["unfinished"] = len(journal.unfinished())
+    _JOURNAL_VIEW = view
+    _tag_redraw()
+    return None
 
+def _journal_job(scene, props, base, prompt: str, ref1: str, ref2: str, out_base: str, frame: int = None):
+    """ワーカーへ渡す直前のジョブを記録する（入力画像は複製して退避）。無効・失敗時は None"""
+    journal = _job_journal(props)
+    if journal is None:
+        return None
+    try:
+        if isinstance(base, InlineImage) and base.data is not None:
+            render = journal.spill(base.data, imaging.image_ext(base.data))
+        else:
+            # ファイルは読み込まずに複製する（拡張子の判定には先頭だけ読む）
+            src = base.path if isinstance(base, InlineImage) else base
+            with open(src, "rb") as f:
+                head = f.read(16)
+            render = journal.spill_file(src, imaging.image_ext(head))
+    except (OSError, TypeError) as e:
+        mb_log(scene, "ERROR", f"ジョブをジャーナルに記録できません: {e}")
+        return None
+    return journal.add({
+        "prompt": prompt,
+        "refs": [ref1, ref2],
+        "render": render,
+        "spilled": render,
+        "out_base": out_base,
+        "frame": frame,
+        "stream": props.use_streaming,
+    })
+
+
+def _progress_value(ev: dict):
+    """送信 0-50% / 受信 50-100% として進捗イベントを百分率に換算（通信以外の段階は None）"""
+    stage = ev.get("stage")
+    if stage == "upload":
+        return int(50 * ev["sent"] / max(ev["total"], 1))
+    if stage == "download":
+        return 50 + int(49 * ev["received"] / ev["total"]) if ev.get("total") else 50
+    if stage == "first_byte":
+        return 50
+    return None
 
-def _run_worker(api_key: str, prompt: str, ref1: str, ref2: str, render_img: str, q: "queue.Queue", cancel_evt: "threading.Event") -> None:
-    """バックグラウンドスレッドから API を実行し結果をキューへ送る"""
+def _run_worker(api_key: str, prompt: str, ref1: str, ref2: str, render_img, q: "queue.Queue", cancel_evt: CancelToken, tag: dict = None, cache: ResultCache = None, stream: bool = False, out=None, decode: bool = False, size=None, trace: JobTrace = None, job: JobEntry = None, seed: int = None) -> None:
+    """バックグラウンドスレッドから API を実行し結果をキューへ送る（tag はメッセージに付与）
+
+    out（_OutputTarget）を渡すと、結果は受信しながらワーカーでファイルに書き出し、
+    キューには画像 bytes ではなく保存先パス（"path"）だけを送る。
+    decode=True なら表示用の画素配列（"pixels"、size 指定時はその大きさ）も添える。
+    trace を渡すと各段階の所要時間を記録する（確定はメインスレッドで行う）。
+    job（ジャーナルのエントリ）を渡すと状態遷移を記録する。出力の確定前に saving を書くため、
+    確定直後にクラッシュしても再開時に再送されない。seed は候補ごとの generationConfig.seed。
+    cancel_evt が set() されると送受信中の接続も閉じ、ワーカーはすぐに終わる。
+    """
+    tag = tag or {}
+
+    def on_progress(ev):
+        if trace is not None:
+            trace.on_event(ev)
+        value = _progress_value(ev)
+        if value is not None:
+            q.put({"type": "progress", "value": value, **ev, **tag})
+
+    def cancelled():
+        if job is not None:
+            job.cancelled()
+        q.put({"type": "cancel", **tag})
+
+    part = None
     try:
         if cancel_evt.is_set():
-            q.put({"type": "cancel"})
+            cancelled()
             return
-        data = _run_monkey_banana(api_key, prompt, ref1, ref2, render_img)
-        if cancel_evt.is_set():
-            q.put({"type": "cancel"})
+        if job is not None:
+            job.inflight()
+        if out is None:
+            data = _run_monkey_banana(api_key, prompt, ref1, ref2, render_img, cache, stream, on_progress, seed=seed,
+                                      cancel=cancel_evt)
+            result = {"data": data}
         else:
-            q.put({"type": "progress", "value": 100})
-            q.put({"type": "done", "data": data})
+            part = out.part_path()
+            _run_monkey_banana(api_key, prompt, ref1, ref2, render_img, cache, stream, on_progress, out_path=part, seed=seed,
+                               cancel=cancel_evt)
+        if cancel_evt.is_set():
+            cancelled()
+            return
+        if part is not None:
+            t0 = time.perf_counter()
+            path = out.final_path()
+            if job is not None:
+                job.saving(path)
+            os.replace(part, path)
+            part = None
+            if job is not None:
+                job.done(path)
+            result = {"path": path}
+            if trace is not None:
+                trace.add("save", time.perf_counter() - t0)
+        if decode:
+            t0 = time.perf_counter()
+            if "data" in result:
+                result["pixels"] = _decode_result(result["data"], size)
+            else:
+                with open(result["path"], "rb") as f:
+                    result["pixels"] = _decode_result(f.read(), size)
+            if trace is not None:
+                trace.add("decode", time.perf_counter() - t0)
+        q.put({"type": "progress", "value": 100, **tag})
+        q.put({"type": "done", **result, **tag})
+    except Cancelled:
+        cancelled()
+    except Exception as e:
+        if job is not None and job.state != "done":
+            job.failed(str(e))
+        q.put({"type": "error", "message": str(e), **tag})
+    finally:
+        if part is not None and os.path.exists(part):
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+
+def _run_tile_worker(api_key: str, prompt: str, ref1: str, ref2: str, tile, index: int, q: "queue.Queue", cancel_evt: CancelToken, cache: ResultCache = None, stream: bool = False, trace: JobTrace = None) -> None:
+    """タイル画素（下から上の行順）を PNG 化して _run_worker に渡す（結果は同じ大きさの画素で返る）"""
+    try:
+        t0 = time.perf_counter()
+        png = imaging.encode_png(np.ascontiguousarray(imaging.to_uint8(tile[::-1, :, :3])))
+        if trace is not None:
+            trace.add("encode", time.perf_counter() - t0)
     except Exception as e:
-        q.put({"type": "error", "message": str(e)})
+        q.put({"type": "error", "message": str(e), "tile": index})
+        return
+    _run_worker(api_key, prompt, ref1, ref2, InlineImage("image/png", data=png), q, cancel_evt, {"tile": index}, cache, stream,
+                decode=True, size=(tile.shape[1], tile.shape[0]), trace=trace)
+
+# =========================================================
+# Helpers（ジョブの再開）
+# =========================================================
+class _JobResumer:
+    """ジャーナルに残った未完了ジョブをバックグラウンドで再実行し、タイマーで結果を回収する
+
+    モーダルオペレーターと違いウィンドウを持たないため、ファイル読み込み直後でも動かせる。
+    """
+
+    def __init__(self):
+        self.pool = None
+        self.queue = queue.Queue()
+        self.cancel = CancelToken()
+        self.journal = None
+        self.traces = {}  # ジャーナル id -> JobTrace
+        self.scene_name = ""
+
+    @property
+    def running(self) -> bool:
+        return self.pool is not None
+
+    def start(self, scene) -> int:
+        """未完了ジョブを投入して件数を返す（実行中・対象なしなら 0）"""
+        props = scene.mb_props
+        journal = _job_journal(props)
+        if journal is None or self.running:
+            return 0
+        api_key = _api_key(props)
+        if not api_key:
+            pending = len(journal.unfinished())
+            if pending:
+                mb_log(scene, "ERROR", f"未完了ジョブ {pending} 件を再開できません（APIキー未設定）")
+            return 0
+        entries = journal.claim()
+        if not entries:
+            journal.compact()
+            return 0
+
+        _configure_transport(props, props.batch_concurrency)
+        cache = _result_cache(props)
+        self.journal = journal
+        self.scene_name = scene.name
+        self.cancel = CancelToken()
+        self.pool = ThreadPoolExecutor(max_workers=props.batch_concurrency, thread_name_prefix="mb_resume")
+        for e in entries:
+            j = e.job
+            refs = (list(j.get("refs", [])) + ["", ""])[:2]
+            trace = self.traces[e.id] = JobTrace("resume", journal_id=e.id, frame=j.get("frame"))
+            _trace_inputs(props, trace, j.get("prompt", ""), j["render"], refs[0], refs[1])
+            self.pool.submit(
+                _run_worker, api_key, j.get("prompt", ""), refs[0], refs[1], j["render"],
+                self.queue, self.cancel, {"job": e.id}, cache, j.get("stream", False),
+                _OutputTarget(j["out_base"], j.get("frame")), trace=trace, job=e,
+            )
+        mb_log(scene, "INFO", f"未完了ジョブを再開: {len(entries)} 件")
+        bpy.app.timers.register(self._poll, first_interval=0.2)
+        return len(entries)
+
+    def stop(self):
+        if self.pool is not None:
+            self.cancel.set()
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def _poll(self):
+        scene = bpy.data.scenes.get(self.scene_name)
+        while not self.queue.empty():
+            msg = self.queue.get()
+            kind = msg.get('type')
+            if kind == 'progress':
+                continue
+            trace = self.traces.pop(msg.get('job'), None)
+            if kind == 'done':
+                mb_log(scene, "INFO", f"再開したジョブを保存: {msg['path']}")
+                _finish_trace(scene, trace, "done", output=msg['path'])
+            else:
+                if kind == 'error':
+                    mb_log(scene, "ERROR", f"再開したジョブが失敗: {msg.get('message', '')}")
+                _finish_trace(scene, trace, kind, error=msg.get('message'))
+        if self.traces and not self.cancel.is_set():
+            return 0.2
+        self.pool.shutdown(wait=False)
+        self.pool = None
+        self.traces.clear()
+        self.journal.compact()
+        _schedule_journal()
+        return None
+
+_RESUMER = _JobResumer()
+
+def _auto_resume():
+    """ファイル読み込み後に呼ばれ、設定が有効なら未完了ジョブを再開する"""
+    scene = getattr(bpy.context, "scene", None)
+    if scene is not None and scene.mb_props.use_journal:
+        if scene.mb_props.auto_resume:
+            _RESUMER.start(scene)
+        _schedule_journal()
+    return None
+
+@persistent
+def _on_load_post(*_args):
+    global _ACTIVE_RENDER
+    # 読み込みでモーダル操作は終了するため、完了待ちのレンダジョブも手放す
+    _ACTIVE_RENDER = None
+    # 読み込み直後はコンテキストが揃っていないため、タイマーで少し遅らせる
+    bpy.app.timers.register(_auto_resume, first_interval=1.0)
 
 # =========================================================
 # Operators
 # =========================================================
+def _render_poll(cls) -> bool:
+    """レンダを伴う操作の poll（他の MB 操作のレンダ完了待ちの間は開始させない）"""
+    if _render_busy():
+        cls.poll_message_set("別の Monkey Banana の操作がレンダリング中です")
+        return False
+    return True
+
 class MB_OT_Run(Operator):
     bl_idname = "mb.run_edit"
     bl_label = "Run Monkey Banana (manual)"
     bl_description = "参照→参照→レンダの順でAPI実行して保存"
 
+    @classmethod
+    def poll(cls, ctx):
+        return _render_poll(cls)
+
     def invoke(self, ctx, event):
         scene = ctx.scene
         props = scene.mb_props
 
-        api_key = (props.api_key or "").strip()
+        api_key = _api_key(props)
         if not api_key:
             self.report({'ERROR'}, "APIキー未設定（Nパネルで設定）")
             mb_log(scene, "ERROR", "APIキー未設定（手動）")
@@ -292,51 +1277,194 @@ class MB_OT_Run(Operator):
             mb_log(scene, "ERROR", "Render (Base) Image が見つかりません")
             return {'CANCELLED'}
 
-        # 生成ボタン押下時にレンダリングを実行し、その結果で参照画像を上書き
-        try:
-            os.makedirs(os.path.dirname(in_a), exist_ok=True)
-            prev = scene.render.filepath
-            scene.render.filepath = in_a
-            bpy.ops.render.render(write_still=True)
-        finally:
-            scene.render.filepath = prev
-
-        if not os.path.isfile(in_a):
-            self.report({'ERROR'}, "Render (Base) Image のレンダリングに失敗しました")
-            mb_log(scene, "ERROR", "Render (Base) Image のレンダリングに失敗しました")
-            return {'CANCELLED'}
-        ref1 = _abs(props.input_path_b) if props.input_path_b else ""
-        ref2 = _abs(props.input_path_c) if props.input_path_c else ""
-
-        out_path = _abs(props.output_path).strip()
-        if not out_path:
-            base_dir = os.path.dirname(in_a) if os.path.dirname(in_a) else bpy.path.abspath("//")
-            out_dir = base_dir; os.makedirs(out_dir, exist_ok=True)
-            out_base = os.path.join(out_dir, "mb_out.png")
-        else:
-            is_dir_like = out_path.endswith(("/", "\\")) or os.path.isdir(out_path) or (os.path.splitext(out_path)[1] == "")
-            if is_dir_like:
-                out_dir = out_path.rstrip("/\\")
-                _ensure_dir(out_dir)
-                out_base = os.path.join(out_dir, "mb_out.png")
-            else:
-                out_dir = os.path.dirname(out_path) or bpy.path.abspath("//")
-                _ensure_dir(out_dir)
-                out_base = out_path
-
-        out_path = _next_version_path(out_base)
-        self._out_path = out_path
+        _configure_transport(props)
+        self._out_base = _resolve_out_base(props, in_a)
+        self._in_a = in_a
+        self._api_key = api_key
         self._scene = scene
         self._props = props
         self._queue = queue.Queue()
-        self._cancel = threading.Event()
+        self._cancel = CancelToken()
+        self._thread = None
+        self._job = None
+        self._received = 0
+        self._trace = JobTrace("run")
+        self._render_t0 = time.perf_counter()
+
+        # 生成ボタン押下時にレンダリングを開始し、完了後にその結果で API を実行（UI はブロックしない）
+        self._render = _RenderJob(scene, in_a, write=not props.render_in_memory)
+
+        wm = ctx.window_manager
+        self._timer = wm.event_timer_add(0.1, window=ctx.window)
+        wm.progress_begin(0, 100)
+        wm.progress_update(0)
+        self._window = ctx.window
+        if self._window:
+            self._window.cursor_modal_set('WAIT')
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def _start_worker(self):
+        props = self._props
+        self._trace.add("render", time.perf_counter() - self._render_t0)
+        with self._trace.stage("encode"):
+            base = _collect_base(self._scene, props, self._in_a)
+        if base is None:
+            return False
+        ref1 = _abs(props.input_path_b) if props.input_path_b else ""
+        ref2 = _abs(props.input_path_c) if props.input_path_c else ""
         prompt_text = props.prompt_text.as_string() if props.prompt_text else ""
+        _trace_inputs(props, self._trace, prompt_text, self._in_a, ref1, ref2)
+        self._job = _journal_job(self._scene, props, base, prompt_text, ref1, ref2, self._out_base)
         self._thread = threading.Thread(
             target=_run_worker,
-            args=(api_key, prompt_text, ref1, ref2, in_a, self._queue, self._cancel),
+            args=(self._api_key, prompt_text, ref1, ref2, base, self._queue, self._cancel, None, _result_cache(props), props.use_streaming,
+                  _OutputTarget(self._out_base), True),
+            kwargs={"trace": self._trace, "job": self._job},
             daemon=True,
         )
         self._thread.start()
+        return True
+
+    def _finish(self, ctx, result, status: str = None, **fields):
+        wm = ctx.window_manager
+        wm.progress_end()
+        if self._timer:
+            wm.event_timer_remove(self._timer)
+        if getattr(self, '_window', None):
+            self._window.cursor_modal_restore()
+        _finish_trace(self._scene, self._trace, status or ('done' if 'FINISHED' in result else 'cancel'), **fields)
+        return result
+
+    def modal(self, ctx, event):
+        wm = ctx.window_manager
+        if event.type == 'ESC':
+            self._cancel.set()
+            if self._thread is None:
+                # レンダリング中は ESC をレンダジョブにも渡し、中断/完了の通知を待つ
+                return {'PASS_THROUGH'}
+            if self._job is not None and self._job.state in ("pending", "inflight"):
+                self._job.cancelled()  # ユーザーが止めたジョブは次回起動時に再開しない
+            return self._finish(ctx, {'CANCELLED'})
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        if self._thread is None:
+            state = self._render.poll()
+            if state is None:
+                return {'PASS_THROUGH'}
+            if state != 'complete' or self._cancel.is_set():
+                mb_log(self._scene, "INFO", "レンダリングが中断されました")
+                return self._finish(ctx, {'CANCELLED'})
+            if not self._start_worker():
+                self.report({'ERROR'}, "Render (Base) Image のレンダリングに失敗しました")
+                mb_log(self._scene, "ERROR", "Render (Base) Image のレンダリングに失敗しました")
+                return self._finish(ctx, {'CANCELLED'}, "error", error="render failed")
+            return {'PASS_THROUGH'}
+
+        while not self._queue.empty():
+            msg = self._queue.get()
+            kind = msg.get('type')
+            if kind == 'progress':
+                wm.progress_update(msg.get('value', 0))
+                if msg.get('stage') == 'first_byte':
+                    mb_log(self._scene, "INFO", f"送信 {msg['sent']} bytes（{msg['upload_s']:.2f}s）/ 初回応答まで {msg['ttfb']:.2f}s")
+                elif msg.get('stage') == 'download':
+                    self._received = msg['received']
+            elif kind == 'done':
+                # 画像はワーカーが保存済み（受信しながらデコード）なのでパスだけ受け取る
+                self._out_path = msg['path']
+                try:
+                    with self._trace.stage("display"):
+                        pixels = msg.get('pixels')
+                        if pixels is None:
+                            pixels = _load_image_pixels(self._out_path)
+                        _show_pixels(ctx, pixels)
+                except Exception:
+                    pass
+
+                self.report({'INFO'}, f"保存: {self._out_path}")
+                mb_log(self._scene, "INFO", f"保存: {self._out_path}（受信 {self._received} bytes）")
+                return self._finish(ctx, {'FINISHED'}, output=self._out_path)
+            elif kind == 'error':
+                msg_txt = msg.get('message', '')
+                self.report({'ERROR'}, msg_txt)
+                mb_log(self._scene, "ERROR", msg_txt)
+                return self._finish(ctx, {'CANCELLED'}, "error", error=msg_txt)
+            elif kind == 'cancel':
+                mb_log(self._scene, "INFO", "キャンセルされました")
+                return self._finish(ctx, {'CANCELLED'})
+        return {'PASS_THROUGH'}
+
+
+class MB_OT_RunBatch(Operator):
+    bl_idname = "mb.run_batch"
+    bl_label = "Run Batch (Frames)"
+    bl_description = "フレーム範囲をレンダリングし、並列にAPI実行して mb_out_####.png に保存"
+
+    @classmethod
+    def poll(cls, ctx):
+        return _render_poll(cls)
+
+    def invoke(self, ctx, event):
+        scene = ctx.scene
+        props = scene.mb_props
+
+        api_key = _api_key(props)
+        if not api_key:
+            self.report({'ERROR'}, "APIキー未設定（Nパネルで設定）")
+            mb_log(scene, "ERROR", "APIキー未設定（バッチ）")
+            return {'CANCELLED'}
+
+        in_a = _abs(props.input_path)
+        if not in_a:
+            self.report({'ERROR'}, "Render (Base) Image が見つかりません")
+            mb_log(scene, "ERROR", "Render (Base) Image が見つかりません")
+            return {'CANCELLED'}
+
+        try:
+            if props.batch_frames.strip():
+                frames = _parse_frames(props.batch_frames)
+            else:
+                frames = list(range(scene.frame_start, scene.frame_end + 1, max(1, scene.frame_step)))
+        except ValueError:
+            self.report({'ERROR'}, f"フレーム指定が不正です: {props.batch_frames}")
+            mb_log(scene, "ERROR", f"フレーム指定が不正です: {props.batch_frames}")
+            return {'CANCELLED'}
+        if not frames:
+            self.report({'ERROR'}, "処理するフレームがありません")
+            return {'CANCELLED'}
+
+        self._in_a = in_a
+        self._out_base = _resolve_out_base(props, in_a)
+        self._ref1 = _abs(props.input_path_b) if props.input_path_b else ""
+        self._ref2 = _abs(props.input_path_c) if props.input_path_c else ""
+        self._api_key = api_key
+        self._prompt = props.prompt_text.as_string() if props.prompt_text else ""
+        self._scene = scene
+        self._frames = frames
+        self._pending = list(frames)
+        self._finished = 0
+        self._failed = 0
+        self._frame_prev = scene.frame_current
+        self._render = None
+        self._render_frame = None
+        self._traces = {}  # frame -> JobTrace（処理中のフレーム）
+        self._jobs = {}    # frame -> JobEntry（ジャーナルに記録したフレーム）
+        self._skip_static = props.batch_skip_static
+        self._skip_threshold = props.batch_skip_threshold
+        self._ref = None         # 直前に送信したフレーム {"frame", "sig"}
+        self._followers = {}     # 送信フレーム -> [(結果を使い回すフレーム, base)]
+        self._done_paths = {}    # 送信フレーム -> 保存先
+        self._reused = 0
+        self._queue = queue.Queue()
+        self._cancel = CancelToken()
+        self._cache = _result_cache(props)
+        self._stream = props.use_streaming
+        _configure_transport(props, props.batch_concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=props.batch_concurrency, thread_name_prefix="mb_batch")
+        mb_log(scene, "INFO", f"バッチ開始: {len(frames)}フレーム（同時実行 {props.batch_concurrency}）")
 
         wm = ctx.window_manager
         self._timer = wm.event_timer_add(0.1, window=ctx.window)
@@ -348,80 +1476,792 @@ class MB_OT_Run(Operator):
         wm.modal_handler_add(self)
         return {'RUNNING_MODAL'}
 
+    def _start_render(self, frame: int):
+        """次フレームの非同期レンダリングを開始（前フレームの API 実行と並行して進む）"""
+        scene = self._scene
+        scene.frame_set(frame)
+        self._render_frame = frame
+        self._traces[frame] = JobTrace("batch", frame=frame)
+        _trace_inputs(scene.mb_props, self._traces[frame], self._prompt, _frame_path(self._in_a, frame), self._ref1, self._ref2)
+        self._render_t0 = time.perf_counter()
+        self._render = _RenderJob(scene, _frame_path(self._in_a, frame), write=not scene.mb_props.render_in_memory)
+
+    def _on_rendered(self, state: str):
+        frame = self._render_frame
+        trace = self._traces[frame]
+        trace.add("render", time.perf_counter() - self._render_t0)
+        self._render = None
+        base = None
+        if state == 'complete':
+            with trace.stage("encode"):
+                base = _collect_base(self._scene, self._scene.mb_props, _frame_path(self._in_a, frame))
+        if base is not None:
+            if not (self._skip_static and self._reuse_previous(frame, base, trace)):
+                self._submit(frame, base)
+        else:
+            self._failed += 1
+            self._finished += 1
+            mb_log(self._scene, "ERROR", f"フレーム {frame} のレンダリングに失敗しました")
+            _finish_trace(self._scene, self._traces.pop(frame), "error", error="render failed")
+
+    def _submit(self, frame: int, base):
+        job = _journal_job(self._scene, self._scene.mb_props, base, self._prompt, self._ref1, self._ref2, self._out_base, frame)
+        if job is not None:
+            self._jobs[frame] = job
+        self._pool.submit(
+            _run_worker, self._api_key, self._prompt, self._ref1, self._ref2,
+            base, self._queue, self._cancel, {"frame": frame}, self._cache, self._stream,
+            _OutputTarget(self._out_base, frame), trace=self._traces[frame], job=job,
+        )
+
+    def _reuse_previous(self, frame: int, base, trace: JobTrace) -> bool:
+        """直前に送信したフレームとほぼ同じなら、その結果を使い回す（True なら送信しない）"""
+        try:
+            with trace.stage("encode"):
+                sig = _frame_signature(base)
+        except Exception as e:
+            mb_log(self._scene, "ERROR", f"フレーム {frame} の比較に失敗: {e}")
+            self._ref = None
+            return False
+        ref = self._ref
+        if ref is not None:
+            diff = imaging.frame_difference(sig, ref["sig"])
+            if diff * 100 < self._skip_threshold:
+                trace.set(reused_from=ref["frame"], diff=round(diff * 100, 3))
+                if ref["frame"] in self._done_paths:
+                    self._copy_result(frame, ref["frame"])
+                else:
+                    self._followers.setdefault(ref["frame"], []).append((frame, base))
+                return True
+        # 比較の基準は直前に「送信した」フレーム（少しずつ変わるショットで差が積み重ならないように）
+        self._ref = {"frame": frame, "sig": sig}
+        return False
+
+    def _copy_result(self, frame: int, src: int):
+        """送信フレーム src の結果をフレーム frame の出力として複製"""
+        trace = self._traces.pop(frame, None)
+        self._finished += 1
+        try:
+            with trace.stage("save"):
+                dst = _OutputTarget(self._out_base, frame).final_path()
+                shutil.copyfile(self._done_paths[src], dst)
+        except OSError as e:
+            self._failed += 1
+            mb_log(self._scene, "ERROR", f"フレーム {frame}: {e}")
+            _finish_trace(self._scene, trace, "error", error=str(e))
+            return
+        self._reused += 1
+        mb_log(self._scene, "INFO", f"保存: {dst}（フレーム {src} の結果を再利用）")
+        _finish_trace(self._scene, trace, "done", output=dst)
+
+    def _on_source_done(self, frame: int, path: str):
+        self._done_paths[frame] = path
+        for follower, _base in self._followers.pop(frame, []):
+            self._copy_result(follower, frame)
+
+    def _on_source_failed(self, frame: int):
+        """送信フレームが失敗したら、使い回す予定だったフレームの先頭を代わりに送信する"""
+        followers = self._followers.pop(frame, [])
+        if not followers:
+            if self._ref is not None and self._ref["frame"] == frame:
+                self._ref = None
+            return
+        head, base = followers[0]
+        self._submit(head, base)
+        if followers[1:]:
+            self._followers[head] = followers[1:]
+        if self._ref is not None and self._ref["frame"] == frame:
+            self._ref["frame"] = head
+
+    def _finish(self, ctx, cancelled: bool):
+        wm = ctx.window_manager
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._scene.frame_set(self._frame_prev)
+        wm.progress_end()
+        if self._timer:
+            wm.event_timer_remove(self._timer)
+        if getattr(self, '_window', None):
+            self._window.cursor_modal_restore()
+        for trace in self._traces.values():
+            _finish_trace(self._scene, trace, "cancel")
+        self._traces.clear()
+        for job in self._jobs.values():
+            if job.state in ("pending", "inflight"):
+                job.cancelled()  # 投入待ちのまま破棄したフレームを次回起動時に再開しない
+        self._jobs.clear()
+        ok = self._finished - self._failed
+        summary = f"バッチ完了: 成功 {ok} / 失敗 {self._failed} / 全 {len(self._frames)}"
+        if self._reused:
+            summary += f"（再利用 {self._reused}）"
+        if cancelled:
+            summary = "バッチをキャンセルしました（" + summary + "）"
+        self.report({'ERROR'} if self._failed else {'INFO'}, summary)
+        mb_log(self._scene, "ERROR" if self._failed else "INFO", summary)
+        return {'CANCELLED'} if cancelled else {'FINISHED'}
+
     def modal(self, ctx, event):
+        if event.type == 'ESC':
+            self._cancel.set()
+            if self._render is not None:
+                # レンダリング中は ESC をレンダジョブにも渡し、中断/完了の通知を待つ
+                return {'PASS_THROUGH'}
+            return self._finish(ctx, cancelled=True)
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        if self._render is not None:
+            state = self._render.poll()
+            if state is not None:
+                if self._cancel.is_set() or state == 'cancel':
+                    self._cancel.set()
+                    return self._finish(ctx, cancelled=True)
+                self._on_rendered(state)
+
+        while not self._queue.empty():
+            msg = self._queue.get()
+            kind = msg.get('type')
+            frame = msg.get('frame')
+            if kind == 'done':
+                mb_log(self._scene, "INFO", f"保存: {msg['path']}")
+                _finish_trace(self._scene, self._traces.pop(frame, None), "done", output=msg['path'])
+                self._jobs.pop(frame, None)
+                self._on_source_done(frame, msg['path'])
+                self._finished += 1
+            elif kind in ('error', 'cancel'):
+                self._failed += 1
+                self._finished += 1
+                _finish_trace(self._scene, self._traces.pop(frame, None), kind, error=msg.get('message'))
+                self._jobs.pop(frame, None)
+                if not self._cancel.is_set():
+                    self._on_source_failed(frame)
+                if kind == 'error':
+                    mb_log(self._scene, "ERROR", f"フレーム {frame}: {msg.get('message', '')}")
+
+        if self._render is None and self._pending:
+            self._start_render(self._pending.pop(0))
+            if self._render.state is not None:  # バックグラウンド起動では即座に完了している
+                self._on_rendered(self._render.state)
+
+        ctx.window_manager.progress_update(int(100 * self._finished / len(self._frames)))
+        if self._finished >= len(self._frames):
+            return self._finish(ctx, cancelled=False)
+        return {'PASS_THROUGH'}
+
+
+class MB_OT_RunTiled(Operator):
+    bl_idname = "mb.run_tiled"
+    bl_label = "Run Tiled"
+    bl_description = "レンダを重なり付きタイルに分割して並列にAPI実行し、継ぎ目をぼかして合成・保存"
+
+    @classmethod
+    def poll(cls, ctx):
+        return _render_poll(cls)
+
+    def invoke(self, ctx, event):
+        scene = ctx.scene
+        props = scene.mb_props
+
+        api_key = _api_key(props)
+        if not api_key:
+            self.report({'ERROR'}, "APIキー未設定（Nパネルで設定）")
+            mb_log(scene, "ERROR", "APIキー未設定（タイル）")
+            return {'CANCELLED'}
+
+        in_a = _abs(props.input_path)
+        if not in_a:
+            self.report({'ERROR'}, "Render (Base) Image が見つかりません")
+            mb_log(scene, "ERROR", "Render (Base) Image が見つかりません")
+            return {'CANCELLED'}
+
+        self._in_a = in_a
+        self._api_key = api_key
+        self._scene = scene
+        self._props = props
+        self._out_base = _resolve_out_base(props, in_a)
+        self._queue = queue.Queue()
+        self._cancel = CancelToken()
+        self._pool = None
+        self._blender = None
+        self._save = None
+        # タイルは並列に処理されるため、通信等の段階時間は全タイルの合計になる
+        self._trace = JobTrace("tiled")
+        self._render_t0 = time.perf_counter()
+        # タイル分割には全解像度の画素が必要なので、常にファイルへ書き出す
+        self._render = _RenderJob(scene, in_a, write=True)
+
         wm = ctx.window_manager
+        self._timer = wm.event_timer_add(0.1, window=ctx.window)
+        wm.progress_begin(0, 100)
+        wm.progress_update(0)
+        self._window = ctx.window
+        if self._window:
+            self._window.cursor_modal_set('WAIT')
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def _submit_tiles(self):
+        """レンダ画像をタイルに分割してワーカーに投入"""
+        props = self._props
+        self._trace.add("render", time.perf_counter() - self._render_t0)
+        with self._trace.stage("encode"):
+            src = bpy.data.images.load(self._in_a, check_existing=False)
+            try:
+                pixels = _image_pixels(src)
+            finally:
+                bpy.data.images.remove(src)
+        h, w = pixels.shape[:2]
+        overlap = min(props.tile_overlap, props.tile_size // 2)
+        self._boxes = imaging.tile_boxes(w, h, props.tile_size, overlap)
+        self._blender = imaging.TileBlender(w, h, overlap)
+        self._received = 0
+        self._trace.set(width=w, height=h, tiles=len(self._boxes))
+
+        ref1 = _abs(props.input_path_b) if props.input_path_b else ""
+        ref2 = _abs(props.input_path_c) if props.input_path_c else ""
+        prompt_text = props.prompt_text.as_string() if props.prompt_text else ""
+        _trace_inputs(props, self._trace, prompt_text, self._in_a, ref1, ref2)
+        cache = _result_cache(props)
+        _configure_transport(props, props.batch_concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=props.batch_concurrency, thread_name_prefix="mb_tile")
+        for i, (x0, y0, x1, y1) in enumerate(self._boxes):
+            self._pool.submit(
+                _run_tile_worker, self._api_key, prompt_text, ref1, ref2,
+                pixels[y0:y1, x0:x1], i, self._queue, self._cancel, cache, props.use_streaming, self._trace,
+            )
+        mb_log(self._scene, "INFO", f"タイル分割: {w}x{h} → {len(self._boxes)}タイル（{props.tile_size}px, 重なり {overlap}px）")
+
+    def _finish(self, ctx, result, status: str = None, **fields):
+        wm = ctx.window_manager
+        self._cancel.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._blender = None
+        wm.progress_end()
+        if self._timer:
+            wm.event_timer_remove(self._timer)
+        if getattr(self, '_window', None):
+            self._window.cursor_modal_restore()
+        _finish_trace(self._scene, self._trace, status or ('done' if 'FINISHED' in result else 'cancel'), **fields)
+        return result
+
+    def _fail(self, ctx, msg_txt: str):
+        self.report({'ERROR'}, msg_txt)
+        mb_log(self._scene, "ERROR", msg_txt)
+        return self._finish(ctx, {'CANCELLED'}, "error", error=msg_txt)
+
+    def modal(self, ctx, event):
         if event.type == 'ESC':
             self._cancel.set()
-            wm.progress_end()
-            if self._timer:
-                wm.event_timer_remove(self._timer)
-            if getattr(self, '_window', None):
-                self._window.cursor_modal_restore()
+            if self._pool is None:
+                # レンダリング中は ESC をレンダジョブにも渡し、中断/完了の通知を待つ
+                return {'PASS_THROUGH'}
+            mb_log(self._scene, "INFO", "キャンセルされました")
+            return self._finish(ctx, {'CANCELLED'})
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        if self._pool is None:
+            state = self._render.poll()
+            if state is None:
+                return {'PASS_THROUGH'}
+            if state != 'complete' or self._cancel.is_set():
+                mb_log(self._scene, "INFO", "レンダリングが中断されました")
+                return self._finish(ctx, {'CANCELLED'})
+            if not os.path.isfile(self._in_a):
+                return self._fail(ctx, "Render (Base) Image のレンダリングに失敗しました")
+            try:
+                self._submit_tiles()
+            except Exception as e:
+                return self._fail(ctx, f"タイル分割に失敗: {e}")
+            return {'PASS_THROUGH'}
+
+        while not self._queue.empty():
+            msg = self._queue.get()
+            kind = msg.get('type')
+            if kind == 'done':
+                box = self._boxes[msg['tile']]
+                try:
+                    with self._trace.stage("decode"):
+                        tile = msg.get('pixels')
+                        if tile is None:
+                            tile = _decode_image_bytes(msg['data'], (box[2] - box[0], box[3] - box[1]))
+                        self._blender.add(box, tile)
+                except Exception as e:
+                    return self._fail(ctx, f"タイル {msg['tile']} の読み込みに失敗: {e}")
+                self._received += 1
+                ctx.window_manager.progress_update(int(100 * self._received / len(self._boxes)))
+            elif kind == 'error':
+                return self._fail(ctx, f"タイル {msg.get('tile')}: {msg.get('message', '')}")
+            elif kind == 'cancel':
+                mb_log(self._scene, "INFO", "キャンセルされました")
+                return self._finish(ctx, {'CANCELLED'})
+
+        if self._received < len(self._boxes):
+            return {'PASS_THROUGH'}
+
+        if self._save is None:
+            # 表示は画素の直接書き込みで即時に、PNG エンコードと保存はワーカーで行う
+            result = self._blender.result()
+            try:
+                with self._trace.stage("display"):
+                    _show_pixels(ctx, result)
+            except Exception:
+                pass
+            self._out_path = _next_version_path(self._out_base)
+            self._save_t0 = time.perf_counter()
+            self._save = self._pool.submit(_write_pixels_png, result, self._out_path)
+            return {'PASS_THROUGH'}
+        if not self._save.done():
+            return {'PASS_THROUGH'}
+        self._trace.add("save", time.perf_counter() - self._save_t0)
+        try:
+            self._save.result()
+        except Exception as e:
+            return self._fail(ctx, f"保存に失敗: {e}")
+        self.report({'INFO'}, f"保存: {self._out_path}")
+        mb_log(self._scene, "INFO", f"保存: {self._out_path}")
+        return self._finish(ctx, {'FINISHED'}, output=self._out_path)
+
+
+class MB_OT_RunRegion(Operator):
+    bl_idname = "mb.run_region"
+    bl_label = "Run Region"
+    bl_description = "指定範囲（レンダ境界/オブジェクト/マスク）だけを切り出してAPI実行し、フル解像度のレンダに合成・保存"
+
+    @classmethod
+    def poll(cls, ctx):
+        return _render_poll(cls)
+
+    def invoke(self, ctx, event):
+        scene = ctx.scene
+        props = scene.mb_props
+
+        api_key = _api_key(props)
+        if not api_key:
+            self.report({'ERROR'}, "APIキー未設定（Nパネルで設定）")
+            mb_log(scene, "ERROR", "APIキー未設定（部分編集）")
             return {'CANCELLED'}
 
-        if event.type == 'TIMER':
+        in_a = _abs(props.input_path)
+        if not in_a:
+            self.report({'ERROR'}, "Render (Base) Image が見つかりません")
+            mb_log(scene, "ERROR", "Render (Base) Image が見つかりません")
+            return {'CANCELLED'}
+
+        # 範囲はレンダ前に確定させる（失敗ならレンダしない）
+        self._region = None
+        self._mask_path = ""
+        r = scene.render
+        if props.roi_source == 'BORDER':
+            self._region = (r.border_min_x, r.border_min_y, r.border_max_x, r.border_max_y)
+            if not r.use_border or self._region == (0.0, 0.0, 1.0, 1.0):
+                self.report({'ERROR'}, "レンダ境界が設定されていません（Ctrl+B）")
+                return {'CANCELLED'}
+        elif props.roi_source == 'OBJECT':
+            obj = ctx.active_object
+            if obj is None or scene.camera is None:
+                self.report({'ERROR'}, "アクティブオブジェクトとシーンカメラが必要です")
+                return {'CANCELLED'}
+            self._region = _object_region(scene, obj)
+            if self._region is None:
+                self.report({'ERROR'}, f"{obj.name} がカメラに写っていません")
+                return {'CANCELLED'}
+        else:
+            self._mask_path = _abs(props.roi_mask_path)
+            if not self._mask_path or not os.path.isfile(self._mask_path):
+                self.report({'ERROR'}, "マスク画像が見つかりません")
+                return {'CANCELLED'}
+
+        self._in_a = in_a
+        self._api_key = api_key
+        self._scene = scene
+        self._props = props
+        self._out_base = _resolve_out_base(props, in_a)
+        self._queue = queue.Queue()
+        self._cancel = CancelToken()
+        self._pool = None
+        self._save = None
+        self._trace = JobTrace("region", source=props.roi_source)
+        self._render_t0 = time.perf_counter()
+        # 合成先としてフル解像度が必要なので、境界を一時的に外して全体をファイルにレンダする
+        self._use_border = r.use_border
+        r.use_border = False
+        self._render = _RenderJob(scene, in_a, write=True)
+
+        wm = ctx.window_manager
+        self._timer = wm.event_timer_add(0.1, window=ctx.window)
+        wm.progress_begin(0, 100)
+        wm.progress_update(0)
+        self._window = ctx.window
+        if self._window:
+            self._window.cursor_modal_set('WAIT')
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def _restore_border(self):
+        if self._use_border is not None:
+            self._scene.render.use_border = self._use_border
+            self._use_border = None
+
+    def _submit_region(self):
+        """レンダ画像から範囲を切り出してワーカーに投入"""
+        props = self._props
+        self._trace.add("render", time.perf_counter() - self._render_t0)
+        with self._trace.stage("encode"):
+            src = bpy.data.images.load(self._in_a, check_existing=False)
+            try:
+                self._full = _image_pixels(src)
+            finally:
+                bpy.data.images.remove(src)
+            h, w = self._full.shape[:2]
+            self._mask = None
+            if self._mask_path:
+                self._mask = imaging.mask_values(_load_image_pixels(self._mask_path, (w, h)))
+                box = imaging.mask_box(self._mask)
+                if box is None:
+                    raise RuntimeError("マスクが空です")
+            else:
+                x0, y0, x1, y1 = self._region
+                box = (x0 * w, y0 * h, x1 * w, y1 * h)
+            self._box = imaging.region_box(box, w, h, props.roi_padding)
+            if self._box is None:
+                raise RuntimeError("範囲が空です")
+        x0, y0, x1, y1 = self._box
+        ratio = (x1 - x0) * (y1 - y0) / (w * h)
+        self._trace.set(width=w, height=h, region=list(self._box), region_ratio=round(ratio, 4))
+
+        ref1 = _abs(props.input_path_b) if props.input_path_b else ""
+        ref2 = _abs(props.input_path_c) if props.input_path_c else ""
+        prompt_text = props.prompt_text.as_string() if props.prompt_text else ""
+        _trace_inputs(props, self._trace, prompt_text, self._in_a, ref1, ref2)
+        _configure_transport(props)
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mb_region")
+        self._pool.submit(
+            _run_tile_worker, self._api_key, prompt_text, ref1, ref2, self._full[y0:y1, x0:x1], 0,
+            self._queue, self._cancel, _result_cache(props), props.use_streaming, self._trace,
+        )
+        mb_log(self._scene, "INFO", f"部分編集: {w}x{h} の ({x0}, {y0})-({x1}, {y1}) を送信（面積 {ratio:.1%}）")
+
+    def _finish(self, ctx, result, status: str = None, **fields):
+        wm = ctx.window_manager
+        self._restore_border()
+        self._cancel.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._full = None
+        wm.progress_end()
+        if self._timer:
+            wm.event_timer_remove(self._timer)
+        if getattr(self, '_window', None):
+            self._window.cursor_modal_restore()
+        _finish_trace(self._scene, self._trace, status or ('done' if 'FINISHED' in result else 'cancel'), **fields)
+        return result
+
+    def _fail(self, ctx, msg_txt: str):
+        self.report({'ERROR'}, msg_txt)
+        mb_log(self._scene, "ERROR", msg_txt)
+        return self._finish(ctx, {'CANCELLED'}, "error", error=msg_txt)
+
+    def modal(self, ctx, event):
+        if event.type == 'ESC':
+            self._cancel.set()
+            if self._pool is None:
+                # レンダリング中は ESC をレンダジョブにも渡し、中断/完了の通知を待つ
+                return {'PASS_THROUGH'}
+            mb_log(self._scene, "INFO", "キャンセルされました")
+            return self._finish(ctx, {'CANCELLED'})
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        if self._pool is None:
+            state = self._render.poll()
+            if state is None:
+                return {'PASS_THROUGH'}
+            self._restore_border()
+            if state != 'complete' or self._cancel.is_set():
+                mb_log(self._scene, "INFO", "レンダリングが中断されました")
+                return self._finish(ctx, {'CANCELLED'})
+            if not os.path.isfile(self._in_a):
+                return self._fail(ctx, "Render (Base) Image のレンダリングに失敗しました")
+            try:
+                self._submit_region()
+            except Exception as e:
+                return self._fail(ctx, f"範囲の切り出しに失敗: {e}")
+            return {'PASS_THROUGH'}
+
+        if self._save is None:
             while not self._queue.empty():
                 msg = self._queue.get()
                 kind = msg.get('type')
                 if kind == 'progress':
-                    wm.progress_update(msg.get('value', 0))
+                    ctx.window_manager.progress_update(msg.get('value', 0))
                 elif kind == 'done':
-                    data = msg.get('data')
+                    x0, y0, x1, y1 = self._box
                     try:
-                        with open(self._out_path, 'wb') as f:
-                            f.write(data)
+                        with self._trace.stage("decode"):
+                            patch = msg.get('pixels')
+                            if patch is None:
+                                patch = _decode_image_bytes(msg['data'], (x1 - x0, y1 - y0))
+                            result = imaging.composite_region(self._full, patch, self._box, self._props.roi_feather, self._mask)
                     except Exception as e:
-                        self.report({'ERROR'}, f"保存に失敗: {e}")
-                        mb_log(self._scene, "ERROR", f"保存に失敗: {e}")
-                        wm.progress_end()
-                        if self._timer:
-                            wm.event_timer_remove(self._timer)
-                        if getattr(self, '_window', None):
-                            self._window.cursor_modal_restore()
-                        return {'CANCELLED'}
-
+                        return self._fail(ctx, f"合成に失敗: {e}")
                     try:
-                        img = bpy.data.images.load(self._out_path, check_existing=True)
-                        img.reload()
-                        for area in ctx.screen.areas:
-                            if area.type == 'IMAGE_EDITOR':
-                                area.spaces.active.image = img
-                                area.tag_redraw()
-                                break
-                        for window in ctx.window_manager.windows:
-                            for a in window.screen.areas:
-                                a.tag_redraw()
+                        with self._trace.stage("display"):
+                            _show_pixels(ctx, result)
                     except Exception:
                         pass
-
-                    self.report({'INFO'}, f"保存: {self._out_path}")
-                    mb_log(self._scene, "INFO", f"保存: {self._out_path}")
-                    wm.progress_end()
-                    if self._timer:
-                        wm.event_timer_remove(self._timer)
-                    if getattr(self, '_window', None):
-                        self._window.cursor_modal_restore()
-                    return {'FINISHED'}
+                    # 表示は即時に、PNG エンコードと保存はワーカーで行う
+                    self._out_path = _next_version_path(self._out_base)
+                    self._save_t0 = time.perf_counter()
+                    self._save = self._pool.submit(_write_pixels_png, result, self._out_path)
+                    return {'PASS_THROUGH'}
                 elif kind == 'error':
-                    msg_txt = msg.get('message', '')
-                    self.report({'ERROR'}, msg_txt)
-                    mb_log(self._scene, "ERROR", msg_txt)
-                    wm.progress_end()
-                    if self._timer:
-                        wm.event_timer_remove(self._timer)
-                    if getattr(self, '_window', None):
-                        self._window.cursor_modal_restore()
-                    return {'CANCELLED'}
+                    return self._fail(ctx, msg.get('message', ''))
                 elif kind == 'cancel':
                     mb_log(self._scene, "INFO", "キャンセルされました")
-                    wm.progress_end()
-                    if self._timer:
-                        wm.event_timer_remove(self._timer)
-                    if getattr(self, '_window', None):
-                        self._window.cursor_modal_restore()
-                    return {'CANCELLED'}
+                    return self._finish(ctx, {'CANCELLED'})
+            return {'PASS_THROUGH'}
+
+        if not self._save.done():
+            return {'PASS_THROUGH'}
+        self._trace.add("save", time.perf_counter() - self._save_t0)
+        try:
+            self._save.result()
+        except Exception as e:
+            return self._fail(ctx, f"保存に失敗: {e}")
+        self.report({'INFO'}, f"保存: {self._out_path}")
+        mb_log(self._scene, "INFO", f"保存: {self._out_path}")
+        return self._finish(ctx, {'FINISHED'}, output=self._out_path)
+
+
+class MB_OT_RunVariants(Operator):
+    bl_idname = "mb.run_variants"
+    bl_label = "Run Variants"
+    bl_description = "プロンプトの段落・候補数ぶんのリクエストを並列に送り、全結果とコンタクトシートを保存"
+
+    @classmethod
+    def poll(cls, ctx):
+        return _render_poll(cls)
+
+    def invoke(self, ctx, event):
+        scene = ctx.scene
+        props = scene.mb_props
+
+        api_key = _api_key(props)
+        if not api_key:
+            self.report({'ERROR'}, "APIキー未設定（Nパネルで設定）")
+            mb_log(scene, "ERROR", "APIキー未設定（バリエーション）")
+            return {'CANCELLED'}
+
+        in_a = _abs(props.input_path)
+        if not in_a:
+            self.report({'ERROR'}, "Render (Base) Image が見つかりません")
+            mb_log(scene, "ERROR", "Render (Base) Image が見つかりません")
+            return {'CANCELLED'}
+
+        self._in_a = in_a
+        self._api_key = api_key
+        self._scene = scene
+        self._props = props
+        self._out_base = _resolve_out_base(props, in_a)
+        self._queue = queue.Queue()
+        self._cancel = CancelToken()
+        self._pool = None
+        self._save = None
+        self._traces = {}
+        self._render_t0 = time.perf_counter()
+        self._render = _RenderJob(scene, in_a, write=not props.render_in_memory)
+
+        wm = ctx.window_manager
+        self._timer = wm.event_timer_add(0.1, window=ctx.window)
+        wm.progress_begin(0, 100)
+        wm.progress_update(0)
+        self._window = ctx.window
+        if self._window:
+            self._window.cursor_modal_set('WAIT')
+        wm.modal_handler_add(self)
         return {'RUNNING_MODAL'}
 
+    def _submit_variants(self) -> bool:
+        """レンダと参照を 1 度だけエンコードし、全バリエーションを並列に投入"""
+        props = self._props
+        scene = self._scene
+        render_s = time.perf_counter() - self._render_t0
+        t0 = time.perf_counter()
+        base = _collect_base(scene, props, self._in_a)
+        if base is None:
+            return False
+        if not isinstance(base, InlineImage):
+            base = InlineImage(_guess_mime(base), base)
+        base = base.shared()
+        ref1 = _abs(props.input_path_b) if props.input_path_b else ""
+        ref2 = _abs(props.input_path_c) if props.input_path_c else ""
+        for ref in (ref1, ref2):
+            if ref and os.path.isfile(ref):
+                REF_CACHE.encode(ref)
+        encode_s = time.perf_counter() - t0
+
+        text = props.prompt_text.as_string() if props.prompt_text else ""
+        self._prompts = _split_prompts(text) if props.variant_split else [text]
+        count = props.variant_count
+        # seed はキャッシュのキーに含まれるため、起点を毎回変えないと再実行で同じ候補が返る
+        if count == 1 and not props.variant_seed:
+            self._seed_base = None
+            seeds = [None]  # 候補 1 つなら seed を付けない（通常の実行と同じキャッシュを使う）
+        else:
+            self._seed_base = props.variant_seed or random.randint(1, SEED_MAX)
+            props.variant_last_seed = self._seed_base
+            seeds = [self._seed_base + c for c in range(count)]
+        self._variants = [(pi, seed) for pi in range(len(self._prompts)) for seed in seeds]
+        n = len(self._variants)
+        self._cols = count if count > 1 else math.ceil(math.sqrt(n))
+        self._cells = [None] * n
+        self._results = [{} for _ in range(n)]
+        self._finished = 0
+        self._failed = 0
+        res_x = scene.render.resolution_x * scene.render.resolution_percentage // 100
+        res_y = scene.render.resolution_y * scene.render.resolution_percentage // 100
+        self._thumb = (props.variant_thumb, max(1, round(props.variant_thumb * res_y / max(res_x, 1))))
+
+        cache = _result_cache(props)
+        _configure_transport(props, props.batch_concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=min(props.batch_concurrency, n), thread_name_prefix="mb_variant")
+        for i, (pi, seed) in enumerate(self._variants):
+            trace = self._traces[i] = JobTrace("variant", variant=i, prompt_index=pi, seed=seed, seed_base=self._seed_base)
+            _trace_inputs(props, trace, self._prompts[pi], self._in_a, ref1, ref2)
+            trace.add("render", render_s)
+            trace.add("encode", encode_s)
+            self._pool.submit(
+                _run_worker, self._api_key, self._prompts[pi], ref1, ref2, base, self._queue, self._cancel,
+                {"variant": i}, cache, props.use_streaming, _OutputTarget(self._out_base), True, self._thumb,
+                trace=trace, seed=seed,
+            )
+        mb_log(scene, "INFO", f"バリエーション開始: プロンプト {len(self._prompts)} × 候補 {count} = {n}件"
+                              f"（seed 起点 {self._seed_base if self._seed_base else 'なし'}, 同時実行 {min(props.batch_concurrency, n)}）")
+        return True
+
+    def _on_result(self, ctx, msg: dict):
+        i = msg['variant']
+        pi, seed = self._variants[i]
+        self._finished += 1
+        self._results[i] = {"index": i, "prompt_index": pi, "seed": seed}
+        trace = self._traces.pop(i, None)
+        if msg['type'] == 'done':
+            self._results[i]["output"] = msg['path']
+            try:
+                with trace.stage("decode"):
+                    cell = msg.get('pixels')
+                    if cell is None:
+                        cell = _load_image_pixels(msg['path'], self._thumb)
+                    self._cells[i] = cell
+            except Exception as e:
+                mb_log(self._scene, "ERROR", f"候補 {i} の縮小に失敗: {e}")
+            mb_log(self._scene, "INFO", f"保存: {msg['path']}（プロンプト {pi + 1}, seed {seed}）")
+            _finish_trace(self._scene, trace, "done", output=msg['path'])
+        else:
+            self._failed += 1
+            self._results[i]["error"] = msg.get('message', '')
+            mb_log(self._scene, "ERROR", f"候補 {i}（プロンプト {pi + 1}, seed {seed}）: {msg.get('message', '')}")
+            _finish_trace(self._scene, trace, "error", error=msg.get('message'))
+        ctx.window_manager.progress_update(int(100 * self._finished / len(self._variants)))
+
+    def _write_sheet(self, ctx):
+        """候補を縮小して並べたコンタクトシートを表示し、保存はワーカーで行う（対応表は JSON で隣に置く）"""
+        # セルは下から上の行順なので、上下を反転して並べ、最後に戻す（左上が最初の候補）
+        sheet = imaging.contact_sheet([c[::-1] if c is not None else None for c in self._cells], self._cols)[::-1]
+        try:
+            _show_pixels(ctx, np.ascontiguousarray(sheet))
+        except Exception:
+            pass
+        self._sheet_path = _next_version_path(os.path.join(os.path.dirname(self._out_base), "mb_variants.png"))
+        index = {
+            "sheet": self._sheet_path,
+            "columns": self._cols,
+            "seed_base": self._seed_base,
+            "prompts": self._prompts,
+            "variants": self._results,
+        }
+        with open(os.path.splitext(self._sheet_path)[0] + ".json", "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+        self._save = self._pool.submit(_write_pixels_png, sheet, self._sheet_path)
+
+    def _finish(self, ctx, result):
+        wm = ctx.window_manager
+        self._cancel.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        wm.progress_end()
+        if self._timer:
+            wm.event_timer_remove(self._timer)
+        if getattr(self, '_window', None):
+            self._window.cursor_modal_restore()
+        for trace in self._traces.values():
+            _finish_trace(self._scene, trace, "cancel")
+        self._traces.clear()
+        return result
+
+    def _fail(self, ctx, msg_txt: str):
+        self.report({'ERROR'}, msg_txt)
+        mb_log(self._scene, "ERROR", msg_txt)
+        return self._finish(ctx, {'CANCELLED'})
+
+    def modal(self, ctx, event):
+        if event.type == 'ESC':
+            self._cancel.set()
+            if self._pool is None:
+                # レンダリング中は ESC をレンダジョブにも渡し、中断/完了の通知を待つ
+                return {'PASS_THROUGH'}
+            mb_log(self._scene, "INFO", "キャンセルされました")
+            return self._finish(ctx, {'CANCELLED'})
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        if self._pool is None:
+            state = self._render.poll()
+            if state is None:
+                return {'PASS_THROUGH'}
+            if state != 'complete' or self._cancel.is_set():
+                mb_log(self._scene, "INFO", "レンダリングが中断されました")
+                return self._finish(ctx, {'CANCELLED'})
+            if not self._submit_variants():
+                return self._fail(ctx, "Render (Base) Image のレンダリングに失敗しました")
+            return {'PASS_THROUGH'}
+
+        while not self._queue.empty():
+            msg = self._queue.get()
+            if msg.get('type') in ('done', 'error'):
+                self._on_result(ctx, msg)
+            elif msg.get('type') == 'cancel':
+                mb_log(self._scene, "INFO", "キャンセルされました")
+                return self._finish(ctx, {'CANCELLED'})
+
+        if self._finished < len(self._variants):
+            return {'PASS_THROUGH'}
+        if not any(c is not None for c in self._cells):
+            return self._fail(ctx, f"全 {len(self._variants)} 件の候補が失敗しました")
+
+        if self._save is None:
+            try:
+                self._write_sheet(ctx)
+            except Exception as e:
+                return self._fail(ctx, f"コンタクトシートの作成に失敗: {e}")
+            return {'PASS_THROUGH'}
+        if not self._save.done():
+            return {'PASS_THROUGH'}
+        try:
+            self._save.result()
+        except Exception as e:
+            return self._fail(ctx, f"保存に失敗: {e}")
+        ok = len(self._variants) - self._failed
+        summary = f"バリエーション完了: 成功 {ok} / 失敗 {self._failed} → {self._sheet_path}"
+        self.report({'ERROR'} if self._failed else {'INFO'}, summary)
+        mb_log(self._scene, "ERROR" if self._failed else "INFO", summary)
+        return self._finish(ctx, {'FINISHED'})
+
 
 class MB_OT_NewPromptText(Operator):
     bl_idname = "mb.new_prompt_text"
@@ -455,6 +2295,52 @@ class MB_OT_OpenPromptText(Operator):
         return {'FINISHED'}
 
 
+class MB_OT_ResumeJobs(Operator):
+    bl_idname = "mb.resume_jobs"
+    bl_label = "Resume Jobs"
+    bl_description = "ジャーナルに残った未完了ジョブ（クラッシュ等で中断したもの）をバックグラウンドで再実行"
+
+    def execute(self, ctx):
+        if _RESUMER.running:
+            self.report({'WARNING'}, "再開中のジョブがあります")
+            return {'CANCELLED'}
+        n = _RESUMER.start(ctx.scene)
+        _schedule_journal()
+        self.report({'INFO'}, f"未完了ジョブを再開: {n} 件" if n else "未完了のジョブはありません")
+        return {'FINISHED'}
+
+
+class MB_OT_HistoryPage(Operator):
+    bl_idname = "mb.history_page"
+    bl_label = "History Page"
+    bl_description = "履歴のページを移動"
+
+    delta: IntProperty(default=1)
+
+    def execute(self, ctx):
+        p = ctx.scene.mb_props
+        pages = _HISTORY_VIEW["pages"] if _HISTORY_VIEW is not None else 1
+        p.history_page = min(max(0, p.history_page + self.delta), pages - 1)
+        _schedule_history()
+        return {'FINISHED'}
+
+
+class MB_OT_HistoryOpen(Operator):
+    bl_idname = "mb.history_open"
+    bl_label = "Open Result"
+    bl_description = "この結果画像を読み込んで Image Editor に表示"
+
+    path: StringProperty(default="")
+
+    def execute(self, ctx):
+        if not self.path or not os.path.isfile(self.path):
+            self.report({'ERROR'}, f"ファイルが見つかりません: {self.path}")
+            return {'CANCELLED'}
+        img = bpy.data.images.load(self.path, check_existing=True)
+        _show_image(ctx, img)
+        return {'FINISHED'}
+
+
 class MB_OT_ShowLastLog(Operator):
     bl_idname = "mb.show_last_log"
     bl_label = "Show Last Log"
@@ -495,6 +2381,7 @@ class MB_PT_Panel(Panel):
         layout = self.layout
 
         layout.prop(p, "api_key")
+        layout.prop(p, "api_keys_text")
         layout.operator("wm.url_open", text=_("Open API Key Page")).url = "https://aistudio.google.com/app/apikey"
         layout.separator()
 
@@ -524,6 +2411,162 @@ class MB_PT_Panel(Panel):
         col.prop(p, "output_path")
         col.operator("mb.run_edit", icon='PLAY')
 
+        layout.separator()
+        col = layout.column(align=True)
+        col.label(text=_("Batch (Animation)"))
+        col.prop(p, "batch_frames")
+        col.prop(p, "batch_concurrency")
+        col.prop(p, "batch_skip_static")
+        row = col.row()
+        row.enabled = p.batch_skip_static
+        row.prop(p, "batch_skip_threshold")
+        col.operator("mb.run_batch", icon='RENDER_ANIMATION')
+
+        layout.separator()
+        col = layout.column(align=True)
+        col.label(text=_("Tiled (Large Renders)"))
+        col.prop(p, "tile_size")
+        col.prop(p, "tile_overlap")
+        col.operator("mb.run_tiled", icon='MESH_GRID')
+
+        layout.separator()
+        col = layout.column(align=True)
+        col.label(text=_("Region (Local Edit)"))
+        col.prop(p, "roi_source", text="")
+        if p.roi_source == 'MASK':
+            col.prop(p, "roi_mask_path")
+        col.prop(p, "roi_padding")
+        col.prop(p, "roi_feather")
+        col.operator("mb.run_region", icon='SELECT_SUBTRACT')
+
+        layout.separator()
+        col = layout.column(align=True)
+        col.label(text=_("Variants (Look Exploration)"))
+        col.prop(p, "variant_split")
+        col.prop(p, "variant_count")
+        col.prop(p, "variant_seed")
+        if p.variant_last_seed:
+            col.label(text=_("Last base seed: ") + str(p.variant_last_seed), icon='INFO')
+        col.prop(p, "variant_thumb")
+        col.operator("mb.run_variants", icon='IMGDISPLAY')
+
+        layout.separator()
+        box = layout.box()
+        box.label(text=_("Upload"))
+        box.prop(p, "render_in_memory")
+        box.prop(p, "upload_format")
+        row = box.row()
+        row.enabled = p.upload_format in {'JPEG', 'WEBP'}
+        row.prop(p, "upload_quality")
+        box.prop(p, "upload_max_edge")
+
+        layout.separator()
+        box = layout.box()
+        box.label(text=_("Network"))
+        col = box.column(align=True)
+        col.prop(p, "api_url")
+        col.prop(p, "use_streaming")
+        col.prop(p, "pool_size")
+        col.prop(p, "rate_limit_rpm")
+        col.prop(p, "max_inflight")
+        col.prop(p, "max_retries")
+        col = box.column(align=True)
+        col.prop(p, "connect_timeout")
+        col.prop(p, "upload_timeout")
+        col.prop(p, "first_byte_timeout")
+        col.prop(p, "read_timeout")
+        if SCHEDULER.retries:
+            box.label(text=_("Retries / 429s: ") + f"{SCHEDULER.retries} / {SCHEDULER.throttled}", icon='TIME')
+        if INFLIGHT.coalesced:
+            box.label(text=_("Coalesced Duplicates: ") + str(INFLIGHT.coalesced), icon='LINKED')
+        keys = KEYS.snapshot()
+        if len(keys) > 1 or any(k["requests"] for k in keys):
+            col = box.column(align=True)
+            col.label(text=_("Keys (in-flight / last min / total)"))
+            for k in keys:
+                if k["cooldown"] > 0:
+                    state, icon = _("Cooldown ") + f"{k['cooldown']:.0f}s", 'TIME'
+                elif k["last_status"] in (None, 200):
+                    state, icon = "OK", 'CHECKMARK'
+                else:
+                    state, icon = str(k["last_status"] or _("Error")), 'ERROR'
+                col.label(text=f"{k['label']}  {k['inflight']} / {k['last_minute']} / {k['requests']}"
+                               f"  429×{k['throttled']}  {state}", icon=icon)
+
+        layout.separator()
+        box = layout.box()
+        box.label(text=_("Result Cache"))
+        box.prop(p, "use_cache")
+        col = box.column(align=True)
+        col.enabled = p.use_cache
+        col.prop(p, "cache_dir")
+        col.prop(p, "cache_max_mb")
+        if _RESULT_CACHE is not None:
+            box.label(text=_("Hits / Misses: ") + f"{_RESULT_CACHE.hits} / {_RESULT_CACHE.misses}", icon='FILE_CACHE')
+
+        layout.separator()
+        box = layout.box()
+        box.label(text=_("History"))
+        box.prop(p, "use_history")
+        view = _HISTORY_VIEW
+        if view is None or view["key"] != _history_key(p):
+            _schedule_history()  # DB は描画中に開かず、タイマーで読み直す
+        if p.use_history and view is not None:
+            box.prop(p, "history_filter", text="", icon='VIEWZOOM')
+            if view["error"]:
+                box.label(text=view["error"], icon='ERROR')
+            row = box.row(align=True)
+            row.operator("mb.history_page", text="", icon='TRIA_LEFT').delta = -1
+            row.label(text=f"{view['page'] + 1} / {view['pages']}  ({view['total']})")
+            row.operator("mb.history_page", text="", icon='TRIA_RIGHT').delta = 1
+            if _PREVIEWS is not None and len(_PREVIEWS) > _PREVIEW_LIMIT:
+                _PREVIEWS.clear()
+            grid = box.grid_flow(row_major=True, columns=3, even_columns=True, even_rows=True, align=True)
+            for r in view["rows"]:
+                cell = grid.column(align=True)
+                icon = _history_icon(r)
+                if icon:
+                    cell.template_icon(icon_value=icon, scale=4.0)
+                else:
+                    cell.label(text="", icon='IMAGE_DATA' if r["output"] else 'ERROR')
+                name = os.path.basename(r["output"]) if r["output"] else r["status"]
+                op = cell.operator("mb.history_open", text=name)
+                op.path = r["output"] or ""
+
+        layout.separator()
+        box = layout.box()
+        box.label(text=_("Job Journal"))
+        box.prop(p, "use_journal")
+        row = box.row()
+        row.enabled = p.use_journal
+        row.prop(p, "auto_resume")
+        if p.use_journal:
+            view = _JOURNAL_VIEW
+            if view is None or view["key"] != _journal_key(p):
+                _schedule_journal()
+            if _RESUMER.running:
+                unfinished = len(_RESUMER.traces)
+            else:
+                unfinished = view["unfinished"] if view is not None else 0
+            row = box.row()
+            row.label(text=(_("Resuming: ") if _RESUMER.running else _("Unfinished: ")) + str(unfinished), icon='RECOVER_LAST')
+            sub = row.row()
+            sub.enabled = bool(unfinished) and not _RESUMER.running
+            sub.operator("mb.resume_jobs", text=_("Resume"), icon='PLAY')
+
+        layout.separator()
+        box = layout.box()
+        box.label(text=_("Telemetry"))
+        box.prop(p, "use_telemetry")
+        last = _TELEMETRY.last
+        if last:
+            box.label(text=_("Last: ") + f"{last['total_s']:.2f}s ({last['status']})", icon='TIME')
+            box.label(text=format_stages(last["stages"], tr=_))
+        avg = _TELEMETRY.averages()
+        if avg:
+            box.label(text=_("Average: ") + f"{avg['total_s']:.2f}s / {avg['count']}", icon='SORTTIME')
+            box.label(text=format_stages(avg, tr=_))
+
         layout.separator()
         box = layout.box()
         box.label(text=_("Logs"))
@@ -547,18 +2590,54 @@ class MB_PT_Panel(Panel):
 classes = (
     MBProps,
     MB_OT_Run,
+    MB_OT_RunBatch,
+    MB_OT_RunTiled,
+    MB_OT_RunRegion,
+    MB_OT_RunVariants,
     MB_OT_NewPromptText,
     MB_OT_OpenPromptText,
+    MB_OT_ResumeJobs,
+    MB_OT_HistoryPage,
+    MB_OT_HistoryOpen,
     MB_OT_ShowLastLog,
     MB_PT_Panel,
 )
 
 def register():
+    global _PREVIEWS
     for c in classes:
         bpy.utils.register_class(c)
+    _PREVIEWS = bpy.utils.previews.new()
     bpy.types.Scene.mb_props = bpy.props.PointerProperty(type=MBProps)
+    bpy.app.handlers.render_complete.append(_on_render_complete)
+    bpy.app.handlers.render_cancel.append(_on_render_cancel)
+    bpy.app.handlers.load_post.append(_on_load_post)
 
 def unregister():
+    global _PREVIEWS, _HISTORY, _HISTORY_VIEW, _JOURNAL, _JOURNAL_VIEW, _ACTIVE_RENDER
+    _RESUMER.stop()
+    _ACTIVE_RENDER = None
+    if bpy.app.timers.is_registered(_journal_tick):
+        bpy.app.timers.unregister(_journal_tick)
+    _JOURNAL_VIEW = None
+    if _JOURNAL is not None:
+        _JOURNAL.close()
+        _JOURNAL = None
+    if _PREVIEWS is not None:
+        bpy.utils.previews.remove(_PREVIEWS)
+        _PREVIEWS = None
+    if bpy.app.timers.is_registered(_history_tick):
+        bpy.app.timers.unregister(_history_tick)
+    if _HISTORY is not None:
+        _HISTORY.close()
+        _HISTORY = None
+    _HISTORY_VIEW = None
+    _LOG_WRITER.close()
+    for handlers, fn in ((bpy.app.handlers.render_complete, _on_render_complete),
+                         (bpy.app.handlers.render_cancel, _on_render_cancel),
+                         (bpy.app.handlers.load_post, _on_load_post)):
+        if fn in handlers:
+            handlers.remove(fn)
     for c in reversed(classes):
         bpy.utils.unregister_class(c)
     del bpy.types.Scene.mb_props
@@ -0,0 +1,138 @@
+import datetime, itertools, json, threading, time
+from collections import deque
+
+TELEMETRY_NAME = "mb_telemetry.jsonl"
+
+# パネル表示用の段階（この順に並べる）と表示名
+STAGES = (
+    ("render", "Render"),
+    ("encode", "Encode"),
+    ("prepare", "Prepare"),
+    ("cache", "Cache"),
+    ("upload", "Upload"),
+    ("server", "Server"),
+    ("download", "Download"),
+    ("decode", "Decode"),
+    ("save", "Save"),
+    ("display", "Display"),
+)
+
+_ids = itertools.count(1)
+
+
+class JobTrace:
+    """1 ジョブの段階ごとの所要時間（秒）とサイズ等を記録する
+
+    メインスレッドとワーカーの両方から書き込まれるため、更新はロックで保護する。
+    """
+
+    def __init__(self, kind: str, **fields):
+        self.kind = kind
+        self.job = f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}-{next(_ids)}"
+        self.started = datetime.datetime.now().isoformat(timespec="milliseconds")
+        self.fields = dict(fields)
+        self.stages = {}
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def set(self, **fields):
+        with self._lock:
+            self.fields.update(fields)
+
+    def stage(self, stage: str):
+        """with trace.stage("save"): ... の形で区間を計測"""
+        return _Stage(self, stage)
+
+    def on_event(self, ev: dict):
+        """_run_monkey_banana / _api_call の進捗イベントを段階時間に変換"""
+        kind = ev.get("stage")
+        if kind == "first_byte":
+            self.add("upload", ev["upload_s"])
+            self.add("server", ev["ttfb"])
+            self.set(request_bytes=ev["sent"])
+        elif kind == "response":
+            self.add("download", ev["download_s"])
+            self.set(response_bytes=ev["received"])
+        elif kind in ("prepare", "cache", "decode"):
+            self.add(kind, ev["seconds"])
+            if kind == "cache":
+                self.set(cache_hit=ev["hit"])
+        elif kind == "coalesce":
+            self.add("coalesce", ev["seconds"])
+            self.set(coalesced=True)
+
+    def record(self, status: str, **fields) -> dict:
+        with self._lock:
+            rec = {
+                "job": self.job,
+                "kind": self.kind,
+                "started": self.started,
+                "status": status,
+                "total_s": round(time.perf_counter() - self._t0, 4),
+                "stages": {k: round(v, 4) for k, v in self.stages.items()},
+            }
+            rec.update(self.fields)
+        rec.update(fields)
+        return rec
+
+
+class _Stage:
+    def __init__(self, trace: JobTrace, stage: str):
+        self.trace = trace
+        self.name = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+class TelemetryLog:
+    """完了したジョブの記録を保持し、JSONL として書き出す（直近 history 件の平均も出す）"""
+
+    def __init__(self, history: int = 20):
+        self.last = None
+        self._recent = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def finish(self, trace: JobTrace, status: str, **fields) -> dict:
+        """記録を確定して返す（JSONL には dumps() で 1 行にして書く）"""
+        rec = trace.record(status, **fields)
+        with self._lock:
+            self.last = rec
+            if status == "done":
+                self._recent.append(rec)
+        return rec
+
+    @staticmethod
+    def dumps(rec: dict) -> str:
+        return json.dumps(rec, ensure_ascii=False)
+
+    def averages(self) -> dict:
+        """直近の成功ジョブの段階ごとの平均秒数と件数"""
+        with self._lock:
+            recs = list(self._recent)
+        if not recs:
+            return {}
+        totals = {}
+        for rec in recs:
+            for k, v in rec["stages"].items():
+                totals[k] = totals.get(k, 0.0) + v
+        avg = {k: v / len(recs) for k, v in totals.items()}
+        avg["total_s"] = sum(r["total_s"] for r in recs) / len(recs)
+        avg["count"] = len(recs)
+        return avg
+
+
+def format_stages(stages: dict, limit: int = 5, tr=str) -> str:
+    """所要時間の長い順に 'Server 3.10s · Upload 0.40s' の形で要約（tr で表示名を翻訳）"""
+    labels = dict(STAGES)
+    items = sorted(((v, k) for k, v in stages.items() if k in labels), reverse=True)[:limit]
+    return " · ".join(f"{tr(labels[k])} {v:.2f}s" for v, k in items)
@@ -0,0 +1,501 @@
+import contextlib, email.utils, http.client, io, random, socket, ssl, threading, time
+from collections import deque, namedtuple
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+
+# 再利用した keep-alive 接続がサーバ側で既に閉じられていたときに出る例外
+# （TLS では閉じられたソケットへの書き込みが SSLEOFError になる）
+_STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError,
+                 ssl.SSLEOFError, ssl.SSLZeroReturnError)
+
+# 段階ごとのタイムアウト（秒）。connect: 接続確立 / upload: 送信が進まない時間 /
+# first_byte: 送信完了から応答ヘッダまで / read: 受信が進まない時間
+Timeouts = namedtuple("Timeouts", "connect upload first_byte read")
+DEFAULT_TIMEOUTS = Timeouts(connect=10.0, upload=60.0, first_byte=120.0, read=60.0)
+
+
+class Cancelled(Exception):
+    """CancelToken によって中断された（再試行しない）"""
+
+    def __init__(self, message: str = "キャンセルされました"):
+        super().__init__(message)
+
+
+class PhaseTimeout(TimeoutError):
+    """どの段階で時間切れになったかを持つタイムアウト（再試行の対象）"""
+
+    def __init__(self, phase: str, seconds: float):
+        super().__init__(f"{phase} が {seconds:g} 秒以内に終わりませんでした")
+        self.phase = phase
+        self.seconds = seconds
+
+
+class CancelToken:
+    """ジョブのキャンセル通知。set() で送受信中の接続のソケットを即座に閉じる
+
+    threading.Event と同じ set() / is_set() / wait() を持つので、キャンセルフラグとしてそのまま使える。
+    ソケットは shutdown するだけで、close は接続を使っているスレッドが行う。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._conns = set()
+        self.cancelled_at = None  # set() した時刻（perf_counter）
+
+    def set(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.cancelled_at = time.perf_counter()
+            self._event.set()
+            conns = list(self._conns)
+        for conn in conns:
+            _abort(conn)
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._event.wait(timeout)
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled()
+
+    @contextlib.contextmanager
+    def watch(self, conn):
+        """この間に set() されたら conn のソケットを閉じる"""
+        with self._lock:
+            self.check()
+            self._conns.add(conn)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._conns.discard(conn)
+
+def _abort(conn):
+    """別スレッドで送受信中の接続を止める（ブロック中の send/recv がすぐに戻る）"""
+    sock = conn.sock
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class ConnectionPool:
+    """(scheme, host, port) ごとに keep-alive 接続を再利用する HTTP(S) コネクションプール
+
+    アイドル時間が idle_timeout を超えた接続は再利用せずに閉じる。
+    ssl_context を渡すと HTTPS 接続に使う（自己署名のローカルサーバ相手の検証用など）。
+    timeouts は open() で指定がないときの段階ごとのタイムアウト。
+    """
+
+    def __init__(self, max_size: int = 4, idle_timeout: float = 60.0, ssl_context: ssl.SSLContext = None,
+                 timeouts: Timeouts = DEFAULT_TIMEOUTS):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl_context
+        self.timeouts = timeouts
+        self.created = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+        self._idle = {}  # key -> [(conn, last_used)]
+
+    def _new_conn(self, scheme: str, host: str, port: int, timeout: float):
+        if scheme == "https":
+            ctx = self.ssl_context or ssl.create_default_context()
+            return http.client.HTTPSConnection(host, port, timeout=timeout, context=ctx)
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _acquire(self, key, timeout: float):
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used > self.idle_timeout:
+                    conn.close()
+                    continue
+                self.reused += 1
+                conn.timeout = timeout
+                return conn, True
+            self.created += 1
+        return self._new_conn(*key, timeout), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) >= self.max_size:
+                conn.close()
+                return
+            idle.append((conn, time.monotonic()))
+
+    def prune(self):
+        """アイドル時間を超えた接続を閉じる"""
+        now = time.monotonic()
+        with self._lock:
+            for key, idle in self._idle.items():
+                keep = []
+                for conn, last_used in idle:
+                    if now - last_used > self.idle_timeout:
+                        conn.close()
+                    else:
+                        keep.append((conn, last_used))
+                self._idle[key] = keep
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self._idle.clear()
+
+    @contextlib.contextmanager
+    def open(self, method: str, url: str, body=None, headers: dict = None, timeouts: Timeouts = None,
+             cancel: CancelToken = None):
+        """リクエストを送り、レスポンスを返すコンテキストマネージャ
+
+        4xx/5xx は urlopen と同様に HTTPError を送出する。
+        レスポンスを最後まで読み切った接続だけがプールに戻される。
+        タイムアウトは段階（接続・送信・初回応答・受信）ごとにかかり、超えると PhaseTimeout を送出する。
+        cancel が set() されると送受信中でもソケットを閉じ、Cancelled を送出する。
+        """
+        t = timeouts or self.timeouts
+        parts = urlsplit(url)
+        scheme = parts.scheme or "https"
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        watch = cancel.watch if cancel is not None else (lambda _conn: contextlib.nullcontext())
+
+        while True:
+            conn, reused = self._acquire(key, t.connect)
+            phase = "connect"
+            try:
+                with watch(conn):
+                    if conn.sock is None:
+                        conn.connect()
+                        if cancel is not None:
+                            cancel.check()  # 接続中の set() はソケットがまだないので、ここで止める
+                    phase = "upload"
+                    conn.sock.settimeout(t.upload)
+                    conn.request(method, path, body=body, headers=headers or {})
+                    phase = "first_byte"
+                    conn.sock.settimeout(t.first_byte)
+                    resp = conn.getresponse()
+                    conn.sock.settimeout(t.read)
+            except Cancelled:
+                conn.close()
+                raise
+            except _STALE_ERRORS as e:
+                conn.close()
+                _raise_if_cancelled(cancel, e)
+                if reused:
+                    continue  # 古い接続だったので新しい接続でやり直す
+                raise
+            except TimeoutError as e:
+                conn.close()
+                _raise_if_cancelled(cancel, e)
+                raise PhaseTimeout(phase, getattr(t, phase)) from e
+            except BaseException as e:
+                conn.close()
+                _raise_if_cancelled(cancel, e)
+                raise
+            break
+
+        try:
+            with watch(conn):
+                if resp.status >= 400:
+                    data = resp.read()
+                    raise HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(data))
+                yield resp
+        except HTTPError:
+            raise
+        except TimeoutError as e:
+            _raise_if_cancelled(cancel, e)
+            raise PhaseTimeout("read", t.read) from e
+        except Exception as e:
+            _raise_if_cancelled(cancel, e)
+            raise
+        finally:
+            if resp.isclosed() and not resp.will_close and not (cancel is not None and cancel.is_set()):
+                self._release(key, conn)
+            else:
+                conn.close()
+
+def _raise_if_cancelled(cancel: CancelToken, error: BaseException):
+    """キャンセルでソケットを閉じたために出た例外なら Cancelled に置き換える"""
+    if cancel is not None and cancel.is_set() and not isinstance(error, Cancelled):
+        raise Cancelled() from error
+
+
+# =========================================================
+# Key Pool（複数キー・プロジェクトへの分散）
+# =========================================================
+class KeyState:
+    """1 つの API キー（と任意の送信先）の利用状況"""
+
+    def __init__(self, key: str, url: str = ""):
+        self.key = key
+        self.url = url
+        self.inflight = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.cooldown_until = 0.0
+        self.last_status = None
+        self._sent = deque()  # 直近 60 秒の送出時刻
+
+    @property
+    def label(self) -> str:
+        """表示用の名前（キーは末尾 4 文字だけ）"""
+        host = urlsplit(self.url).hostname if self.url else ""
+        return f"…{self.key[-4:]}" + (f" @ {host}" if host else "")
+
+    def recent(self, now: float) -> int:
+        """直近 60 秒の送出数"""
+        while self._sent and now - self._sent[0] >= 60.0:
+            self._sent.popleft()
+        return len(self._sent)
+
+
+class KeyPool:
+    """複数の API キー（プロジェクトごとのクォータ）にリクエストを分散する
+
+    - キーごとに同時実行数・送出数・エラー数・429 回数を数える
+    - 429 を受けたキーは Retry-After（なければ cooldown 秒）の間は選ばない
+    - rpm > 0 ならキーごとに直近 1 分の送出数を rpm 件までに抑える
+    - 使えるキーのうち最も空いているもの（同時実行数 → 直近の送出数 → 累計の順）を選ぶ
+    キーが 1 つも設定されていなければ acquire() は None を返し、呼び出し側のキーがそのまま使われる。
+    """
+
+    def __init__(self, cooldown: float = 30.0):
+        self.cooldown = cooldown
+        self.rpm = 0
+        self._cond = threading.Condition()
+        self._keys = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def configure(self, entries, rpm: int = None):
+        """(キー, URL) の列でキーを入れ替える（同じキー・URL の統計は引き継ぐ）"""
+        with self._cond:
+            old = {(k.key, k.url): k for k in self._keys}
+            self._keys = [old.get((key, url)) or KeyState(key, url) for key, url in dict.fromkeys(entries)]
+            if rpm is not None:
+                self.rpm = rpm
+            self._cond.notify_all()
+
+    def _ready_at(self, k: KeyState, now: float) -> float:
+        """k が次に使える時刻（now 以下なら今すぐ使える）。ロックを保持して呼ぶこと"""
+        at = k.cooldown_until
+        if self.rpm > 0 and k.recent(now) >= self.rpm:
+            at = max(at, k._sent[0] + 60.0)
+        return at
+
+    def has_ready(self) -> bool:
+        """今すぐ使えるキーがあるか"""
+        with self._cond:
+            now = time.monotonic()
+            return any(self._ready_at(k, now) <= now for k in self._keys)
+
+    def acquire(self, cancel: CancelToken = None):
+        """最も空いているキーを確保する（すべて待機中なら使えるまで待つ）。キー未設定なら None"""
+        with self._cond:
+            while True:
+                if cancel is not None:
+                    cancel.check()
+                if not self._keys:
+                    return None
+                now = time.monotonic()
+                ready = [k for k in self._keys if self._ready_at(k, now) <= now]
+                if ready:
+                    k = min(ready, key=lambda k: (k.inflight, k.recent(now), k.requests))
+                    k.inflight += 1
+                    k.requests += 1
+                    k._sent.append(now)
+                    return k
+                wake = min(self._ready_at(k, now) for k in self._keys)
+                # キャンセルに気付けるよう、長い待機は区切る
+                self._cond.wait(min(max(wake - now, 0.05), _CANCEL_POLL))
+
+    def release(self, k: KeyState, error: Exception = None):
+        """acquire() したキーを返す。error には送信時の例外（成功なら None）を渡す"""
+        with self._cond:
+            k.inflight -= 1
+            if error is None:
+                k.last_status = 200
+            elif isinstance(error, Cancelled):
+                pass
+            elif isinstance(error, HTTPError):
+                k.last_status = error.code
+                if error.code == 429:
+                    k.throttled += 1
+                    delay = _retry_after(error)
+                    k.cooldown_until = time.monotonic() + (self.cooldown if delay is None else delay)
+                else:
+                    k.errors += 1
+            else:
+                k.last_status = None
+                k.errors += 1
+            self._cond.notify_all()
+
+    def snapshot(self) -> list:
+        """パネル表示用の各キーの状態"""
+        with self._cond:
+            now = time.monotonic()
+            return [{
+                "label": k.label,
+                "inflight": k.inflight,
+                "requests": k.requests,
+                "last_minute": k.recent(now),
+                "errors": k.errors,
+                "throttled": k.throttled,
+                "cooldown": max(0.0, k.cooldown_until - now),
+                "last_status": k.last_status,
+            } for k in self._keys]
+
+
+# =========================================================
+# Scheduler（レート制限・リトライ）
+# =========================================================
+# 再試行する HTTP ステータス（レート制限・一時的なサーバエラー）
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# 送出待ち・再試行待ちの間にキャンセルを確認する間隔（秒）
+_CANCEL_POLL = 0.1
+
+def _retry_after(err: HTTPError):
+    """Retry-After ヘッダ（秒数 or HTTP 日付）を秒に変換。なければ None"""
+    value = err.headers.get("Retry-After") if err.headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class RequestScheduler:
+    """すべての API 呼び出しを通すスケジューラ
+
+    - トークンバケットで 1 分あたりのリクエスト数（rpm, 0 で無制限）を制限
+    - 同時実行数を max_inflight 件に制限
+    - 429/5xx・接続エラーは指数バックオフ（フルジッター）で再試行し、Retry-After があれば従う
+    - 429 を受けたら Retry-After の間は全リクエストの送出を止める
+      （keys に使えるキーが残っていれば止めずに、すぐ別のキーで再試行する）
+    - cancel（CancelToken）が set() されたら送出待ち・再試行待ちをやめて Cancelled を送出する
+    """
+
+    def __init__(self, rpm: int = 0, max_inflight: int = 4, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0,
+                 keys: KeyPool = None):
+        self.rpm = rpm
+        self.max_inflight = max_inflight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.keys = keys
+        self.retries = 0
+        self.throttled = 0
+        self._cond = threading.Condition()
+        self._inflight = 0
+        self._tokens = float(max(rpm, 1))
+        self._refilled = time.monotonic()
+        self._not_before = 0.0
+
+    def configure(self, rpm: int = None, max_inflight: int = None, max_retries: int = None):
+        with self._cond:
+            if rpm is not None and rpm != self.rpm:
+                # 無制限から切り替えたときはバケットを満杯から始める
+                self._tokens = float(rpm) if self.rpm <= 0 else min(self._tokens, float(max(rpm, 1)))
+                self.rpm = rpm
+            if max_inflight is not None:
+                self.max_inflight = max_inflight
+            if max_retries is not None:
+                self.max_retries = max_retries
+            self._cond.notify_all()
+
+    def _wait_time(self, now: float) -> float:
+        """送出できるまでの待ち時間（0 なら即時）。呼び出し側でロックを保持すること"""
+        if now < self._not_before:
+            return self._not_before - now
+        if self.rpm > 0:
+            rate = self.rpm / 60.0
+            self._tokens = min(float(self.rpm), self._tokens + (now - self._refilled) * rate)
+            self._refilled = now
+            if self._tokens < 1.0:
+                return (1.0 - self._tokens) / rate
+        return 0.0
+
+    def _acquire(self, cancel: CancelToken = None):
+        poll = _CANCEL_POLL if cancel is not None else None
+        with self._cond:
+            while True:
+                if cancel is not None:
+                    cancel.check()
+                if self._inflight < self.max_inflight:
+                    wait = self._wait_time(time.monotonic())
+                    if wait <= 0:
+                        if self.rpm > 0:
+                            self._tokens -= 1.0
+                        self._inflight += 1
+                        return
+                    self._cond.wait(min(wait, poll) if poll else wait)
+                else:
+                    self._cond.wait(poll)
+
+    def _release(self):
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, send, cancel: CancelToken = None):
+        """send() を制限内で実行し、再試行可能なエラーなら間隔をあけて繰り返す"""
+        attempt = 0
+        while True:
+            self._acquire(cancel)
+            try:
+                return send()
+            except HTTPError as e:
+                if e.code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    raise
+                delay = _retry_after(e)
+                if e.code == 429:
+                    self.throttled += 1
+                    if self.keys is not None and len(self.keys) > 1 and self.keys.has_ready():
+                        delay = 0.0  # 429 を返したキーは待機中になったので、別のキーですぐに再試行
+                    elif delay is not None:
+                        with self._cond:
+                            self._not_before = max(self._not_before, time.monotonic() + delay)
+                if delay is None:
+                    delay = self._backoff(attempt)
+            except (ConnectionError, TimeoutError, http.client.HTTPException):
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+            finally:
+                self._release()
+            attempt += 1
+            self.retries += 1
+            delay += random.uniform(0, 0.1 * delay)
+            if cancel is None:
+                time.sleep(delay)
+            elif cancel.wait(delay):
+                raise Cancelled()
+
+
+# API 呼び出しで共有するプール・キー・スケジューラ（設定はパネルの値で更新）
+POOL = ConnectionPool()
+KEYS = KeyPool()
+SCHEDULER = RequestScheduler(keys=KEYS)
@@ -0,0 +1,75 @@
+import json, os, re, threading
+
+# 出力フォルダごとの連番カウンタ（{"mb_out.png": 12, ...}）
+INDEX_NAME = ".mb_versions.json"
+
+_lock = threading.Lock()
+
+
+def _scan_max(path_dir: str, prefix: str, ext: str) -> int:
+    """フォルダを走査して既存の最大番号を返す（カウンタがない初回のみ使用）"""
+    pattern = re.compile(rf"^{re.escape(prefix)}_(\d+){re.escape(ext)}$")
+    max_n = 0
+    if os.path.isdir(path_dir):
+        for name in os.listdir(path_dir):
+            m = pattern.match(name)
+            if m:
+                max_n = max(max_n, int(m.group(1)))
+    return max_n
+
+def _load_index(path_dir: str) -> dict:
+    try:
+        with open(os.path.join(path_dir, INDEX_NAME), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def _save_index(path_dir: str, index: dict):
+    path = os.path.join(path_dir, INDEX_NAME)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+def reserve_version_path(path: str) -> str:
+    """path（mb_out.png 等）に対する次の連番パス（mb_out_NN.png）を排他作成で予約して返す
+
+    番号はフォルダごとのカウンタから求めるためフォルダ内のファイル数に依存しない。
+    作成は O_EXCL なので、複数ジョブ/プロセスが同時に保存しても同じ番号は使われない。
+    """
+    base, ext = os.path.splitext(path)
+    dir_path = os.path.dirname(path) or "."
+    prefix = os.path.basename(base)
+    key = prefix + ext
+    with _lock:
+        index = _load_index(dir_path)
+        n = index.get(key)
+        if not isinstance(n, int):
+            n = _scan_max(dir_path, prefix, ext)
+        while True:
+            n += 1
+            candidate = os.path.join(dir_path, f"{prefix}_{n:02d}{ext}")
+            try:
+                fd = os.open(candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                continue
+            os.close(fd)
+            break
+        index[key] = n
+        _save_index(dir_path, index)
+    return candidate
+
+
+def reserve_path(path: str) -> str:
+    """path を排他作成で予約して返す。既にあれば上書きせず、次の連番（name_NN.ext）を予約する"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        return reserve_version_path(path)
+    os.close(fd)
+    return path
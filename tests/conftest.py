@@ -0,0 +1,35 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+for path in (ROOT, ROOT / "benchmarks"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+
+@pytest.fixture
+def mock_server():
+    """Start ``benchmarks/mock_server.py`` with the given ``MockConfig`` fields; stopped after the test."""
+    from mock_server import MockConfig, MockServer
+
+    servers = []
+
+    def start(tls: bool = False, **config) -> MockServer:
+        server = MockServer(config=MockConfig(**config), tls=tls).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def server_stats(server, requests: int) -> dict:
+    """Mock server counters once ``requests`` have been recorded (they are updated after the reply is sent)."""
+    deadline = time.monotonic() + 1.0
+    while server.stats.snapshot()["requests"] < requests and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return server.stats.snapshot()
@@ -0,0 +1,35 @@
+"""Batch CLI against the mock server."""
+
+import json
+
+import numpy as np
+
+from monkey_banana import cli, imaging
+
+
+def _renders(path, count):
+    path.mkdir()
+    pixels = np.zeros((8, 8, 3), dtype=np.uint8)
+    for i in range(count):
+        (path / f"frame_{i}.png").write_bytes(imaging.encode_png(pixels))
+
+
+def test_one_result_cache_is_shared_by_all_jobs(mock_server, tmp_path, monkeypatch):
+    server = mock_server()
+    renders = tmp_path / "renders"
+    _renders(renders, 4)  # identical renders: one miss, then hits
+    monkeypatch.setattr(cli, "_cache", None)
+    monkeypatch.setattr(cli, "_settings", {})
+    args = ["--dir", str(renders), "--prompt", "p", "--api-key", "k", "--api-url", server.url,
+            "--workers", "1", "--cache-dir", str(tmp_path / "cache")]
+
+    assert cli.main(args) == 0
+    cache = cli._cache
+    report = json.loads((renders / cli.DEFAULT_OUT / "mb_report.json").read_text(encoding="utf-8"))
+    assert report["counts"] == {"done": 4}
+    assert report["cache"] == {"hits": 3, "misses": 1}
+
+    # A second run in the same process reuses the same cache (and its index)
+    assert cli.main(args + ["--out", str(tmp_path / "again")]) == 0
+    assert cli._cache is cache
+    assert (cache.hits, cache.misses) == (7, 1)
@@ -0,0 +1,75 @@
+"""ConnectionPool keep-alive reuse and eviction against the mock server, over HTTP and HTTPS."""
+
+import shutil
+import time
+
+import pytest
+
+from monkey_banana.transport import ConnectionPool
+
+BODY = b'{"contents": [{"parts": [{"text": "test"}]}]}'
+
+schemes = pytest.mark.parametrize("tls", [
+    False,
+    pytest.param(True, marks=pytest.mark.skipif(shutil.which("openssl") is None, reason="needs openssl")),
+], ids=["http", "https"])
+
+
+def _pool(server, **kwargs) -> ConnectionPool:
+    return ConnectionPool(ssl_context=server.client_context() if server.cert_path else None, **kwargs)
+
+
+def _post(pool: ConnectionPool, url: str) -> bytes:
+    with pool.open("POST", url, body=BODY, headers={"Content-Type": "application/json"}) as resp:
+        return resp.read()
+
+
+@schemes
+def test_sequential_calls_reuse_one_connection(mock_server, tls):
+    server = mock_server(tls=tls)
+    assert server.url.startswith("https://" if tls else "http://")
+    pool = _pool(server)
+    for _ in range(5):
+        assert b'"candidates"' in _post(pool, server.url)
+    assert pool.created == 1
+    assert pool.reused == 4
+    pool.close()
+
+
+@schemes
+def test_idle_connections_are_evicted(mock_server, tls):
+    server = mock_server(tls=tls)
+    pool = _pool(server, idle_timeout=0.1)
+    _post(pool, server.url)
+    time.sleep(0.2)
+    _post(pool, server.url)
+    # The idle connection outlived idle_timeout, so a new one was opened instead of reusing it
+    assert pool.created == 2
+    assert pool.reused == 0
+
+    time.sleep(0.2)
+    pool.prune()
+    assert all(not idle for idle in pool._idle.values())
+
+
+@schemes
+def test_server_closed_connection_is_replaced(mock_server, tls):
+    # The server drops each connection after replying without saying so, like a keep-alive timeout
+    server = mock_server(tls=tls, close_after_response=True)
+    pool = _pool(server)
+    for _ in range(3):
+        assert b'"candidates"' in _post(pool, server.url)
+    # Each stale pooled connection failed once and was replaced transparently
+    assert pool.created == 3
+    pool.close()
+
+
+def test_https_rejects_untrusted_certificate(mock_server):
+    if shutil.which("openssl") is None:
+        pytest.skip("needs openssl")
+    import ssl
+
+    server = mock_server(tls=True)
+    pool = ConnectionPool()  # default context: the self-signed certificate is not trusted
+    with pytest.raises(ssl.SSLError):
+        _post(pool, server.url)
@@ -0,0 +1,72 @@
+"""decode_png against PNGs whose rows use every filter type, including Average/Paeth."""
+
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from monkey_banana import imaging
+
+
+def encode_rows(pixels: np.ndarray, filters) -> bytes:
+    """Encode ``(h, w, c)`` uint8 pixels as a PNG, row ``y`` using ``filters[y]``."""
+    h, w, c = pixels.shape
+    x = pixels.reshape(h, w * c).astype(np.int16)
+    a = np.zeros_like(x)
+    a[:, c:] = x[:, :-c]
+    b = np.zeros_like(x)
+    b[1:] = x[:-1]
+    cc = np.zeros_like(x)
+    cc[1:, c:] = x[:-1, :-c]
+    pa, pb, pc = np.abs(b - cc), np.abs(a - cc), np.abs(a + b - 2 * cc)
+    paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, cc))
+    preds = [np.zeros_like(x), a, b, (a + b) // 2, paeth]
+    raw = np.empty((h, w * c + 1), dtype=np.uint8)
+    for y, f in enumerate(filters):
+        raw[y, 0] = f
+        raw[y, 1:] = (x[y] - preds[f][y]) & 0xFF
+    color_type = {1: 0, 2: 4, 3: 2, 4: 6}[c]
+    return (
+        imaging._PNG_SIG
+        + imaging._png_chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, color_type, 0, 0, 0))
+        + imaging._png_chunk(b"IDAT", zlib.compress(raw.tobytes(), 1))
+        + imaging._png_chunk(b"IEND", b"")
+    )
+
+
+@pytest.mark.parametrize("shape", [(1, 1, 3), (7, 5, 3), (16, 33, 4), (40, 3, 1), (9, 12, 2)])
+@pytest.mark.parametrize("filters", ["paeth", "average", "mixed", "paeth-after-up"])
+def test_all_row_filters_round_trip(shape, filters):
+    rng = np.random.default_rng(sum(shape))
+    pixels = rng.integers(0, 256, shape, dtype=np.uint8)
+    h = shape[0]
+    rows = {
+        "paeth": [4] * h,
+        "average": [3] * h,
+        "mixed": rng.integers(0, 5, h).tolist(),
+        "paeth-after-up": [1, 2] + [4] * (h - 2) if h > 2 else [2] * h,
+    }[filters]
+    decoded = imaging.decode_png(encode_rows(pixels, rows))
+    assert decoded is not None
+    assert np.array_equal(decoded, pixels)
+
+
+def test_large_images_are_unfiltered_in_bands(monkeypatch):
+    monkeypatch.setattr(imaging, "_WAVEFRONT_ELEMS", 2000)
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (50, 20, 3), dtype=np.uint8)
+    assert imaging._band_rows(20, 3) < 50
+    rows = rng.integers(0, 5, 50).tolist()
+    assert np.array_equal(imaging.decode_png(encode_rows(pixels, rows)), pixels)
+
+
+def test_unsupported_formats_return_none():
+    assert imaging.decode_png(b"\xff\xd8not a png") is None
+    bad_filter = (
+        imaging._PNG_SIG
+        + imaging._png_chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0))
+        + imaging._png_chunk(b"IDAT", zlib.compress(b"\x05\x00\x00\x00"))
+        + imaging._png_chunk(b"IEND", b"")
+    )
+    assert imaging.decode_png(bad_filter) is None
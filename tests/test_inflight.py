@@ -0,0 +1,130 @@
+"""InflightRegistry coalescing, directly and through _run_monkey_banana against the mock server."""
+
+import threading
+import time
+from urllib.error import HTTPError
+
+import pytest
+
+from monkey_banana import api
+from monkey_banana.api import InlineImage
+from monkey_banana.cache import InflightRegistry
+from monkey_banana.transport import Cancelled, CancelToken, KeyPool, RequestScheduler
+
+from conftest import server_stats
+
+
+def test_first_join_leads_and_later_ones_wait():
+    reg = InflightRegistry()
+    assert reg.join("k") is None
+    followers = [reg.join("k"), reg.join("k", "/tmp/out.png")]
+    assert all(f is not None and not f.done() for f in followers)
+    assert reg.join("other") is None
+    assert reg.coalesced == 2 and len(reg) == 2
+
+
+def test_resolve_hands_bytes_to_every_waiter(tmp_path):
+    reg = InflightRegistry()
+    reg.join("k")
+    in_memory = reg.join("k")
+    to_file = reg.join("k", str(tmp_path / "copy.png"))
+    reg.resolve("k", b"image")
+    assert in_memory.result(0) == b"image"
+    assert to_file.result(0) == str(tmp_path / "copy.png")
+    assert (tmp_path / "copy.png").read_bytes() == b"image"
+    assert len(reg) == 0 and reg.join("k") is None  # the next request leads again
+
+
+def test_resolve_copies_the_leaders_file(tmp_path):
+    leader_out = tmp_path / "leader.png"
+    leader_out.write_bytes(b"image")
+    reg = InflightRegistry()
+    reg.join("k")
+    in_memory = reg.join("k")
+    to_file = reg.join("k", str(tmp_path / "follower.png"))
+    reg.resolve("k", str(leader_out))
+    leader_out.unlink()  # the leader moves its file away after resolve()
+    assert in_memory.result(0) == b"image"
+    assert (tmp_path / "follower.png").read_bytes() == b"image"
+
+
+def test_resolve_reports_copy_errors_per_waiter(tmp_path):
+    reg = InflightRegistry()
+    reg.join("k")
+    broken = reg.join("k", str(tmp_path / "missing" / "out.png"))
+    fine = reg.join("k")
+    reg.resolve("k", b"image")
+    assert isinstance(broken.exception(0), OSError)
+    assert fine.result(0) == b"image"
+
+
+def test_reject_passes_the_leaders_error_to_waiters():
+    reg = InflightRegistry()
+    reg.join("k")
+    waiters = [reg.join("k") for _ in range(3)]
+    error = RuntimeError("APIエラー")
+    reg.reject("k", error)
+    assert all(w.exception(0) is error for w in waiters)
+    assert len(reg) == 0
+
+
+def test_cancelled_waiter_leaves_without_touching_others():
+    reg = InflightRegistry()
+    reg.join("k")
+    mine, other = reg.join("k"), reg.join("k")
+    cancel = CancelToken()
+    threading.Timer(0.05, cancel.set).start()
+    with pytest.raises(Cancelled):
+        reg.wait("k", mine, cancel)
+    reg.resolve("k", b"image")
+    assert not mine.done()
+    assert other.result(0) == b"image"
+
+
+@pytest.fixture
+def isolated_api(mock_server, monkeypatch):
+    """api pointed at a fresh mock server with its own scheduler/key pool and coalescing registry."""
+    def start(max_retries=0, **config):
+        server = mock_server(**config)
+        monkeypatch.setattr(api, "API_URL", server.url)
+        monkeypatch.setattr(api, "SCHEDULER", RequestScheduler(max_retries=max_retries, base_delay=0.01))
+        monkeypatch.setattr(api, "KEYS", KeyPool())
+        monkeypatch.setattr(api, "INFLIGHT", InflightRegistry())
+        return server
+    return start
+
+
+def _run_twice(render):
+    results, errors = [None, None], [None, None]
+
+    def run(i):
+        try:
+            results[i] = api._run_monkey_banana("k", "p", "", "", render)
+        except Exception as e:
+            errors[i] = e
+
+    first = threading.Thread(target=run, args=(0,))
+    first.start()
+    time.sleep(0.1)  # the first call is in flight by now
+    run(1)
+    first.join()
+    return results, errors
+
+
+def test_duplicate_request_is_sent_once(isolated_api):
+    server = isolated_api(latency=0.3)
+    results, errors = _run_twice(InlineImage("image/png", data=b"render"))
+    assert errors == [None, None]
+    assert results[0] == results[1] == b"render"  # the mock echoes the render back
+    assert server_stats(server, 1)["requests"] == 1
+    assert api.INFLIGHT.coalesced == 1
+
+
+def test_waiter_sees_the_leaders_error(isolated_api):
+    server = isolated_api(latency=0.3, fail_first=1, error_status=503)
+    results, errors = _run_twice(InlineImage("image/png", data=b"render"))
+    assert results == [None, None]
+    assert all(isinstance(e, HTTPError) and e.code == 503 for e in errors)
+    assert errors[0] is errors[1]
+    assert server_stats(server, 1)["requests"] == 1
+    assert len(api.INFLIGHT) == 0
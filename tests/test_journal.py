@@ -0,0 +1,88 @@
+"""JobJournal: read-only unfinished(), file spills and ownership across instances sharing one folder."""
+
+import os
+import subprocess
+import sys
+
+from monkey_banana.journal import JobJournal
+
+from conftest import ROOT
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"x" * 64
+
+
+def test_spill_file_copies_the_render(tmp_path):
+    src = tmp_path / "render.png"
+    src.write_bytes(PNG)
+    spilled = JobJournal(str(tmp_path)).spill_file(str(src), ".png")
+    assert spilled.endswith(".png") and open(spilled, "rb").read() == PNG
+
+
+def test_unfinished_is_read_only(tmp_path):
+    first = JobJournal(str(tmp_path))
+    pending = first.add({"render": "r.png"})
+    saved = first.add({"render": "r.png"})
+    out = tmp_path / "out.png"
+    out.write_bytes(PNG)
+    saved.saving(str(out))
+    first.close()
+
+    other = JobJournal(str(tmp_path))
+    before = open(other.path, "rb").read()
+    assert [e.id for e in other.unfinished()] == [pending.id]
+    assert [e.id for e in other.unfinished()] == [pending.id]
+    assert open(other.path, "rb").read() == before
+
+    # claim() is what records the saved job as done
+    assert [e.id for e in other.claim()] == [pending.id]
+    assert saved.id not in {e.id for e in JobJournal(str(tmp_path)).unfinished()}
+
+
+def test_live_instance_keeps_its_jobs(tmp_path):
+    first = JobJournal(str(tmp_path))
+    first.add({"render": "r.png"})
+    second = JobJournal(str(tmp_path))
+    assert second.unfinished() == [] and second.claim() == []
+
+    first.close()
+    claimed = second.claim()
+    assert len(claimed) == 1
+    # Now the second instance owns it; a third one must not resubmit it
+    assert JobJournal(str(tmp_path)).claim() == []
+
+
+def test_jobs_of_a_dead_process_are_resumable(tmp_path):
+    code = (
+        "import sys, time\n"
+        f"sys.path.insert(0, {str(ROOT)!r})\n"
+        "from monkey_banana.journal import JobJournal\n"
+        f"JobJournal({str(tmp_path)!r}).add({{'render': 'r.png'}})\n"
+        "print('added', flush=True)\n"
+        "time.sleep(60)\n"
+    )
+    child = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, text=True)
+    try:
+        assert child.stdout.readline().strip() == "added"
+        journal = JobJournal(str(tmp_path))
+        assert journal.unfinished() == []
+    finally:
+        child.kill()
+        child.wait()
+        child.stdout.close()
+    assert len(journal.claim()) == 1
+
+
+def test_stale_owner_locks_are_removed_by_claim_and_compact_only(tmp_path):
+    first = JobJournal(str(tmp_path))
+    first.add({"render": "r.png"})
+    lock = first._owner_path(first.owner)
+    # Simulate a crash: the lock is released but its file stays behind
+    first._owner_file.close()
+    first._owner_file = None
+    assert os.path.isfile(lock)
+
+    other = JobJournal(str(tmp_path))
+    assert len(other.unfinished()) == 1
+    assert os.path.isfile(lock)
+    other.compact()
+    assert not os.path.isfile(lock)
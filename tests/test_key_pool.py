@@ -0,0 +1,145 @@
+"""KeyPool least-loaded selection, per-key 429 cooldown and rpm caps, with a fake clock."""
+
+import threading
+import time
+from urllib.error import HTTPError
+
+import pytest
+
+from monkey_banana import transport
+from monkey_banana.transport import Cancelled, CancelToken, KeyPool
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(transport.time, "monotonic", fake)
+    return fake
+
+
+def _pool(*keys, rpm: int = 0, cooldown: float = 30.0) -> KeyPool:
+    pool = KeyPool(cooldown=cooldown)
+    pool.configure([(k, "") for k in keys], rpm=rpm)
+    return pool
+
+
+def _http_error(code: int, retry_after: str = None) -> HTTPError:
+    headers = {"Retry-After": retry_after} if retry_after is not None else {}
+    return HTTPError("http://mock", code, "error", headers, None)
+
+
+def test_no_keys_means_caller_key():
+    assert KeyPool().acquire() is None
+
+
+def test_picks_the_least_loaded_key(clock):
+    pool = _pool("key-a", "key-b", "key-c")
+    leases = [pool.acquire() for _ in range(3)]
+    assert {k.key for k in leases} == {"key-a", "key-b", "key-c"}
+
+    pool.release(leases[1])
+    # key-b is the only key with nothing in flight
+    assert pool.acquire() is leases[1]
+
+
+def test_ties_go_to_fewer_recent_then_total_requests(clock):
+    pool = _pool("key-a", "key-b")
+    a = pool.acquire()
+    pool.release(a)
+    # Both idle: key-b has sent less in the last minute
+    b = pool.acquire()
+    assert b.key == "key-b"
+    pool.release(b)
+    clock.advance(61)  # both recent windows are empty again; total requests are equal
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is not first
+
+
+def test_429_cools_the_key_down_for_retry_after(clock):
+    pool = _pool("key-a", "key-b")
+    a = pool.acquire()
+    pool.release(a, _http_error(429, "5"))
+    assert a.throttled == 1 and a.last_status == 429
+    for _ in range(3):
+        k = pool.acquire()
+        assert k.key == "key-b"
+        pool.release(k)
+    snap = {s["label"]: s for s in pool.snapshot()}
+    assert snap["…ey-a"]["cooldown"] == pytest.approx(5.0)
+
+    clock.advance(5)
+    assert a in [pool.acquire(), pool.acquire()]
+
+
+def test_429_without_retry_after_uses_the_default_cooldown(clock):
+    pool = _pool("key-a", cooldown=30.0)
+    a = pool.acquire()
+    pool.release(a, _http_error(429))
+    assert not pool.has_ready()
+    clock.advance(29.9)
+    assert not pool.has_ready()
+    clock.advance(0.1)
+    assert pool.has_ready()
+
+
+def test_other_errors_do_not_cool_down(clock):
+    pool = _pool("key-a")
+    a = pool.acquire()
+    pool.release(a, _http_error(503))
+    b = pool.acquire()
+    pool.release(b, OSError("reset"))
+    assert a is b and a.errors == 2 and a.throttled == 0
+    assert pool.has_ready()
+
+
+def test_rpm_caps_each_key_per_minute(clock):
+    pool = _pool("key-a", rpm=2)
+    for _ in range(2):
+        pool.release(pool.acquire())
+    assert not pool.has_ready()
+    clock.advance(60)
+    assert pool.has_ready()
+
+
+def test_acquire_waits_until_a_key_cools_down(clock):
+    pool = _pool("key-a")
+    a = pool.acquire()
+    pool.release(a, _http_error(429, "10"))
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.2)
+    assert not got  # still cooling down on the fake clock
+    clock.advance(10)
+    waiter.join(2)
+    assert got == [a]
+
+
+def test_acquire_can_be_cancelled_while_waiting(clock):
+    pool = _pool("key-a")
+    pool.release(pool.acquire(), _http_error(429, "60"))
+    cancel = CancelToken()
+    threading.Timer(0.1, cancel.set).start()
+    with pytest.raises(Cancelled):
+        pool.acquire(cancel)
+
+
+def test_configure_keeps_stats_of_unchanged_keys(clock):
+    pool = _pool("key-a", "key-b")
+    a = pool.acquire()
+    pool.release(a, _http_error(429, "5"))
+    pool.configure([("key-a", ""), ("key-c", "")])
+    assert [s["label"] for s in pool.snapshot()] == ["…ey-a", "…ey-c"]
+    assert pool.snapshot()[0]["throttled"] == 1
@@ -0,0 +1,55 @@
+"""ResultCache: file copies happen outside the cache lock and never expose partial files."""
+
+import os
+import threading
+
+from monkey_banana.cache import ResultCache
+
+DATA = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 64
+
+
+def test_round_trip_leaves_no_temp_files(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=1 << 20)
+    src = tmp_path / "result.png"
+    src.write_bytes(DATA)
+    cache.put_file("a", str(src))
+    cache.put("b", DATA)
+
+    dest = tmp_path / "out.png"
+    assert cache.get_file("a", str(dest)) and dest.read_bytes() == DATA
+    assert cache.get("b") == DATA
+    assert cache.get("missing") is None
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert not [n for n in os.listdir(tmp_path / "cache") if n.endswith(".tmp")]
+    assert not [n for n in os.listdir(tmp_path) if n.endswith(".tmp")]
+
+
+def test_slow_copy_does_not_block_other_keys(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=1 << 20)
+    cache.put("slow", DATA)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_read(path):
+        started.set()
+        assert release.wait(5)
+        with open(path, "rb") as f:
+            return f.read()
+
+    reader = threading.Thread(target=cache._lookup, args=("slow", slow_read))
+    reader.start()
+    try:
+        assert started.wait(5)
+        # While the first copy is in progress, other keys can still be stored and read
+        done = threading.Event()
+
+        def other():
+            cache.put("other", DATA)
+            assert cache.get("other") == DATA
+            done.set()
+
+        threading.Thread(target=other).start()
+        assert done.wait(2)
+    finally:
+        release.set()
+        reader.join()
+    assert cache.hits == 2
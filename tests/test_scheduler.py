@@ -0,0 +1,119 @@
+"""RequestScheduler against the mock server with injected 429/503 responses."""
+
+import threading
+import time
+
+import pytest
+from urllib.error import HTTPError
+
+from monkey_banana.transport import ConnectionPool, RequestScheduler
+
+from conftest import server_stats
+
+BODY = b'{"contents": [{"parts": [{"text": "test"}]}]}'
+
+
+def _sender(pool: ConnectionPool, url: str):
+    def send() -> bytes:
+        with pool.open("POST", url, body=BODY, headers={"Content-Type": "application/json"}) as resp:
+            return resp.read()
+    return send
+
+
+def test_retry_after_is_honoured(mock_server):
+    server = mock_server(fail_first=2, error_status=429, retry_after=0.3)
+    scheduler = RequestScheduler(max_retries=5, base_delay=0.01, max_delay=0.01)
+    t0 = time.monotonic()
+    scheduler.call(_sender(ConnectionPool(), server.url))
+    elapsed = time.monotonic() - t0
+
+    stats = server_stats(server, 3)
+    assert stats["requests"] == 3 and stats["errors"] == 2
+    assert scheduler.throttled == 2 and scheduler.retries == 2
+    # Two waits of Retry-After (0.3s), not the 0.01s backoff
+    assert elapsed >= 0.6
+    assert elapsed < 0.6 * 1.1 + 0.5
+
+
+def test_retry_after_pauses_other_submitters(mock_server):
+    server = mock_server(fail_first=1, error_status=429, retry_after=0.4)
+    scheduler = RequestScheduler(max_retries=3, base_delay=0.01, max_delay=0.01)
+    send = _sender(ConnectionPool(), server.url)
+    t0 = time.monotonic()
+    first = threading.Thread(target=scheduler.call, args=(send,))
+    first.start()
+    time.sleep(0.1)  # the 429 has arrived by now
+    sent_at = []
+
+    def second():
+        sent_at.append(time.monotonic())
+        return send()
+
+    scheduler.call(second)
+    first.join()
+    # The other submitter is held back until the Retry-After window ends too
+    assert sent_at[0] - t0 >= 0.4
+
+
+def test_gives_up_after_max_retries(mock_server):
+    server = mock_server(fail_first=10, error_status=503)
+    scheduler = RequestScheduler(max_retries=2, base_delay=0.01, max_delay=0.02)
+    with pytest.raises(HTTPError) as err:
+        scheduler.call(_sender(ConnectionPool(), server.url))
+    assert err.value.code == 503
+    assert server_stats(server, 3)["requests"] == 3
+
+
+@pytest.mark.parametrize("attempt", range(12))
+def test_backoff_is_bounded(attempt):
+    scheduler = RequestScheduler(base_delay=0.5, max_delay=4.0)
+    cap = min(4.0, 0.5 * 2 ** attempt)
+    delays = [scheduler._backoff(attempt) for _ in range(200)]
+    assert all(0.0 <= d <= cap for d in delays)
+    # Full jitter: spread over the whole window, not pinned to the cap
+    assert min(delays) < cap / 2 < max(delays)
+
+
+def test_jittered_backoff_bounds_total_wait(mock_server):
+    server = mock_server(fail_first=4, error_status=503)  # no Retry-After: backoff only
+    scheduler = RequestScheduler(max_retries=5, base_delay=0.05, max_delay=0.1)
+    t0 = time.monotonic()
+    scheduler.call(_sender(ConnectionPool(), server.url))
+    elapsed = time.monotonic() - t0
+
+    # Caps are 0.05, 0.1, 0.1, 0.1 and each sleep adds at most 10% jitter
+    assert elapsed <= (0.05 + 0.1 * 3) * 1.1 + 0.5
+    assert server_stats(server, 5)["requests"] == 5
+
+
+def test_token_bucket_paces_concurrent_submitters():
+    rpm, extra, threads = 600, 10, 8  # 600 burst tokens, then one every 0.1s
+    scheduler = RequestScheduler(rpm=rpm, max_inflight=threads)
+    sent = []
+    lock = threading.Lock()
+
+    def send():
+        with lock:
+            sent.append(time.monotonic())
+
+    total = rpm + extra
+    todo = iter(range(total))
+
+    def submitter():
+        for _ in todo:
+            scheduler.call(send)
+
+    t0 = time.monotonic()
+    workers = [threading.Thread(target=submitter) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    assert len(sent) == total
+    rate = rpm / 60.0
+    for i, ts in enumerate(sorted(sent)):
+        # Never more than the bucket plus what has refilled since the start
+        assert i + 1 <= rpm + rate * (ts - t0) + 1
+    elapsed = max(sent) - t0
+    assert (extra - 1) / rate * 0.9 <= elapsed < extra / rate + 1.0
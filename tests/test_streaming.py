@@ -0,0 +1,93 @@
+"""InlineDataDecoder and SSE parsing fed in 1-byte and odd-sized chunks, directly and through the mock server."""
+
+import base64
+
+import pytest
+
+from monkey_banana import api
+from monkey_banana.api import InlineDataDecoder, InlineImage, RequestBody
+
+# 0xff bytes make "/" in base64, which JSON encoders may escape as "\/"; 1000 bytes leaves a 2-char tail
+IMAGE = bytes(range(256)) * 3 + b"\xff" * 232
+B64 = base64.b64encode(IMAGE)
+ESCAPED = B64.replace(b"/", b"\\/")
+
+JSON_BODY = (b'{"candidates": [{"content": {"parts": [{"text": "mock"}, '
+             b'{"inlineData": {"mimeType": "image/png", "data": "' + ESCAPED + b'"}}]}}], "usage": 1}')
+SSE_BODY = (
+    b'data: {"candidates": [{"content": {"parts": [{"text": "mock"}]}}]}\r\n\r\n'
+    b'data: {"candidates": [{"content": {"parts": [{"inline_data": {"mime_type": "image/png", "data": "'
+    + ESCAPED + b'"}}]}}]}\n\n'
+)
+
+SIZES = [1, 2, 3, 7, 13, 511, 513, 4096]
+
+
+def _chunks(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def _parts(res: dict) -> list:
+    return res["candidates"][0]["content"]["parts"]
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_json_response_in_chunks(tmp_path, size):
+    decoder = InlineDataDecoder(str(tmp_path / "out.png"))
+    for chunk in _chunks(JSON_BODY, size):
+        decoder.feed(chunk)
+    decoder.close()
+
+    assert (tmp_path / "out.png").read_bytes() == IMAGE
+    assert decoder.size == len(IMAGE)
+    res = api._parse_json([bytes(decoder.text)])
+    assert _parts(res)[0] == {"text": "mock"}
+    assert _parts(res)[1]["inlineData"] == {"mimeType": "image/png", "data": ""}
+    assert res["usage"] == 1
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_sse_response_in_chunks(tmp_path, size):
+    decoder = InlineDataDecoder(str(tmp_path / "out.png"))
+    for chunk in _chunks(SSE_BODY, size):
+        decoder.feed(chunk)
+    decoder.close()
+
+    assert (tmp_path / "out.png").read_bytes() == IMAGE
+    res = api._parse_sse([bytes(decoder.text)])
+    assert _parts(res) == [{"text": "mock"}, {"inline_data": {"mime_type": "image/png", "data": ""}}]
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_sse_events_split_anywhere(size):
+    # Without a decoder the whole base64 string stays in the parsed result
+    res = api._parse_sse(_chunks(SSE_BODY, size))
+    assert base64.b64decode(_parts(res)[1]["inline_data"]["data"]) == IMAGE
+
+
+def test_reset_truncates_a_partial_file(tmp_path):
+    decoder = InlineDataDecoder(str(tmp_path / "out.png"))
+    decoder.feed(JSON_BODY[:len(JSON_BODY) // 2])
+    decoder.close()
+    decoder.reset()  # a retry starts over
+    assert not (tmp_path / "out.png").exists() and decoder.text == b"" and not decoder.found
+    decoder.feed(JSON_BODY)
+    decoder.close()
+    assert (tmp_path / "out.png").read_bytes() == IMAGE
+
+
+@pytest.mark.parametrize("stream", [False, True], ids=["json", "sse"])
+@pytest.mark.parametrize("read_chunk", [1, 7, 64 * 1024])
+def test_decoder_through_the_mock_server(mock_server, monkeypatch, tmp_path, stream, read_chunk):
+    server = mock_server(sse_chunk=5)
+    server.image_b64 = ESCAPED
+    monkeypatch.setattr(api, "API_URL", server.url)
+    monkeypatch.setattr(api, "_READ_CHUNK", read_chunk)
+    decoder = InlineDataDecoder(str(tmp_path / "out.png"))
+    body = RequestBody("p", [InlineImage("image/png", data=b"render")])
+
+    res = api._api_call("k", body, stream=stream, decoder=decoder)
+
+    assert (tmp_path / "out.png").read_bytes() == IMAGE
+    assert _parts(res)[0] == {"text": "mock"}
+    assert _parts(res)[-1]["inlineData"]["data"] == ""
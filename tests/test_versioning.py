@@ -0,0 +1,68 @@
+"""Output numbering: O_EXCL reservations, the per-folder counter, and batch frame names."""
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from monkey_banana.versioning import INDEX_NAME, reserve_path, reserve_version_path
+
+
+def test_frame_outputs_are_not_counted_as_versions(tmp_path):
+    for frame in (1, 240, 1000):
+        (tmp_path / f"mb_out_f{frame:04d}.png").write_bytes(b"x")
+    path = reserve_version_path(str(tmp_path / "mb_out.png"))
+    assert path == str(tmp_path / "mb_out_01.png")
+
+
+def test_reserve_path_versions_existing_files(tmp_path):
+    frame = str(tmp_path / "mb_out_f0001.png")
+    assert reserve_path(frame) == frame
+    assert reserve_path(frame) == str(tmp_path / "mb_out_f0001_01.png")
+    assert reserve_path(frame) == str(tmp_path / "mb_out_f0001_02.png")
+    # The next still is unaffected by the frame versions
+    assert reserve_version_path(str(tmp_path / "mb_out.png")) == str(tmp_path / "mb_out_01.png")
+
+
+def test_concurrent_reservations_are_unique(tmp_path):
+    base = str(tmp_path / "mb_out.png")
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        paths = list(pool.map(lambda _: reserve_version_path(base), range(200)))
+    assert len(set(paths)) == 200
+    assert all(os.path.isfile(p) for p in paths)
+    assert json.loads((tmp_path / INDEX_NAME).read_text())["mb_out.png"] == 200
+
+
+def test_concurrent_processes_never_share_a_number(tmp_path):
+    base = str(tmp_path / "mb_out.png")
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        paths = list(pool.map(reserve_version_path, [base] * 40))
+    assert len(set(paths)) == 40
+
+
+def test_existing_folder_without_counter_continues_numbering(tmp_path):
+    for name in ("mb_out_03.png", "mb_out_12.png", "mb_out_7.png", "other_99.png", "mb_out_x.png"):
+        (tmp_path / name).write_bytes(b"x")
+    assert not (tmp_path / INDEX_NAME).exists()
+    assert reserve_version_path(str(tmp_path / "mb_out.png")) == str(tmp_path / "mb_out_13.png")
+    assert json.loads((tmp_path / INDEX_NAME).read_text()) == {"mb_out.png": 13}
+
+
+@pytest.mark.parametrize("content", ["{not json", "[1, 2]", '{"mb_out.png": "5"}', ""])
+def test_corrupt_counter_never_reuses_a_number(tmp_path, content):
+    base = str(tmp_path / "mb_out.png")
+    first = [reserve_version_path(base) for _ in range(3)]
+    (tmp_path / INDEX_NAME).write_text(content)
+    nxt = reserve_version_path(base)
+    assert nxt not in first and nxt == str(tmp_path / "mb_out_04.png")
+    # The rewritten counter is valid again
+    assert json.loads((tmp_path / INDEX_NAME).read_text())["mb_out.png"] == 4
+
+
+def test_counter_behind_the_folder_skips_taken_names(tmp_path):
+    base = str(tmp_path / "mb_out.png")
+    (tmp_path / INDEX_NAME).write_text(json.dumps({"mb_out.png": 1}))
+    (tmp_path / "mb_out_02.png").write_bytes(b"keep")
+    assert reserve_version_path(base) == str(tmp_path / "mb_out_03.png")
+    assert (tmp_path / "mb_out_02.png").read_bytes() == b"keep"